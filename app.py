@@ -1,22 +1,57 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
-from datetime import datetime, timedelta
-from collections import defaultdict, Counter
+import os
+import io
+import csv
+import json
+import zlib
+import hashlib
+import atexit
+import logging
+import threading
+import time
+import queue
+import multiprocessing
+import uuid
+from bisect import bisect_left
+from flask import (Flask, render_template, request, redirect, url_for, flash, session, jsonify, g, Response,
+                   stream_with_context, after_this_request, has_request_context, request_started, request_finished,
+                   before_render_template, template_rendered)
+from datetime import datetime, timedelta, timezone
+from collections import defaultdict, deque, Counter, OrderedDict, namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from functools import wraps, lru_cache
 
 # --- Importaciones de Terceros ---
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import func 
+from sqlalchemy import event, func, insert, update, select, case, cast, literal_column, and_, or_, Integer
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 # --- Constantes Globales de Negocio ---
 # Define el rango de horas operativas para las reservas
 HORA_APERTURA = 14
 HORA_CIERRE = 23
 
+# Máximo de días que se pueden pedir en una consulta de disponibilidad por rango
+MAX_DIAS_RANGO = 62
+
 # --- Configuración de la aplicación Flask ---
 app = Flask(__name__, template_folder='plantillas', static_folder='static')
 app.secret_key = 'una_clave_secreta_muy_segura_aqui_12345' # ¡IMPORTANTE: Cambiar por una variable de entorno en producción!
 app.permanent_session_lifetime = timedelta(minutes=30)
 
+# Detrás de un proxy (nginx), PROXIES_CONFIABLES indica cuántos proxies
+# agregan X-Forwarded-For: así request.remote_addr es la IP real del cliente
+# (la usa el límite de intentos de login). Sin proxy, dejarla sin definir.
+if os.environ.get('PROXIES_CONFIABLES'):
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.environ['PROXIES_CONFIABLES']))
+
 # --- INICIO: Configuración de la Base de Datos MySQL ---
 # ¡IMPORTANTE: Usar variables de entorno en producción para estas credenciales!
 USUARIO_DB = 'root'
@@ -24,11 +59,135 @@ PASS_DB = 'Lisandro22'
 HOST_DB = '127.0.0.1' 
 NOMBRE_DB = 'canchas_db' 
 
-app.config['SQLALCHEMY_DATABASE_URI'] = f'mysql+pymysql://{USUARIO_DB}:{PASS_DB}@{HOST_DB}/{NOMBRE_DB}'
+# DATABASE_URL permite apuntar a otra base (ej: un SQLite local para benchmarks)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+    'DATABASE_URL', f'mysql+pymysql://{USUARIO_DB}:{PASS_DB}@{HOST_DB}/{NOMBRE_DB}'
+)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db = SQLAlchemy(app)
 # --- FIN: Configuración de la Base de Datos MySQL ---
 
+# Segundos que una fecha cargada en el motor de ocupación se considera válida.
+# Acota el desfase entre workers (cada proceso tiene su propia copia).
+app.config['OCUPACION_TTL'] = 60
+
+# Cada cuántos segundos cada worker verifica si cambiaron las canchas (una
+# consulta por clave primaria). Es la demora máxima para ver en un worker la
+# edición de una cancha hecha en otro.
+app.config['CATALOGO_CANCHAS_VERIFICAR_S'] = 2
+
+# Segundos que un KPI del panel de administrador se sirve desde la caché.
+# Las escrituras lo invalidan antes; el TTL acota el desfase entre workers.
+app.config['KPI_TTL'] = 30
+
+# Segundos que cada worker confía en su lista de administradores válidos sin
+# volver a consultarla. Es la demora máxima para que la baja de un admin
+# (hecha en la DB o desde otro worker) cierre sus sesiones.
+app.config['ADMIN_CACHE_TTL'] = 30
+
+# Época de las sesiones de administrador. Cambiarla (variable de entorno
+# ADMIN_EPOCA) invalida de inmediato todas las sesiones de admin abiertas.
+app.config['ADMIN_EPOCA'] = os.environ.get('ADMIN_EPOCA', '1')
+
+# Los reportes que tarden más que esto (en ms) se registran como advertencia
+app.config['REPORTES_UMBRAL_MS'] = 100
+
+# Cantidad de requests recientes que guarda cada worker para /admin/rendimiento
+app.config['RENDIMIENTO_MUESTRAS'] = 500
+
+# Las consultas SQL que tarden más que esto (en ms) se registran como advertencia
+app.config['CONSULTA_LENTA_MS'] = int(os.environ.get('CONSULTA_LENTA_MS', 200))
+
+# Límites (en segundos) de los buckets del histograma de latencia de /metrics
+app.config['METRICAS_BUCKETS'] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Con varios workers (gunicorn), directorio donde cada proceso vuelca sus
+# métricas cada METRICAS_VOLCADO_S segundos para que /metrics las sume todas.
+# Vaciarlo al desplegar. Sin definir, /metrics muestra sólo el proceso actual.
+app.config['METRICAS_DIR'] = os.environ.get('METRICAS_DIR')
+app.config['METRICAS_VOLCADO_S'] = 5
+
+# Con VERIFICAR_PRESUPUESTO_CONSULTAS=1 (tests/CI) cada ruta falla si hace más
+# consultas SQL que las declaradas con @presupuesto_consultas (detecta N+1)
+app.config['VERIFICAR_PRESUPUESTO_CONSULTAS'] = os.environ.get('VERIFICAR_PRESUPUESTO_CONSULTAS') == '1'
+
+# Máximo de turnos por página en los listados del admin (se cortan en un límite de día)
+app.config['TURNOS_POR_PAGINA'] = 200
+
+# Si se define REDIS_URL, las cachés se comparten entre workers vía Redis
+# (requiere 'pip install redis'); si no, cada proceso usa un dict en memoria.
+app.config['REDIS_URL'] = os.environ.get('REDIS_URL')
+
+def huella_contenido():
+    """
+    Hash del código (app.py) y de las plantillas: es el mismo en todos los
+    workers y entre reinicios, y cambia apenas cambia alguno de esos archivos.
+    """
+    resumen = hashlib.sha256()
+    carpeta_plantillas = os.path.join(app.root_path, app.template_folder)
+    rutas = [os.path.join(app.root_path, 'app.py')]
+    for raiz, carpetas, archivos in os.walk(carpeta_plantillas):
+        carpetas.sort() # Mismo orden en todos los procesos
+        rutas += [os.path.join(raiz, archivo) for archivo in sorted(archivos)]
+    for ruta in rutas:
+        resumen.update(os.path.relpath(ruta, app.root_path).encode('utf-8'))
+        with open(ruta, 'rb') as archivo:
+            resumen.update(archivo.read())
+    return resumen.hexdigest()[:16]
+
+# Forma parte de todos los ETag: al cambiar el código o las plantillas, las
+# páginas guardadas por los clientes dejan de valer. Se puede fijar (ej: el id
+# del release); si no, se deriva del contenido de esos archivos, así todos los
+# workers generan el mismo ETag y un reinicio sin cambios no invalida nada.
+app.config['VERSION_CONTENIDO'] = os.environ.get('VERSION_CONTENIDO') or huella_contenido()
+
+# Conexiones de /api/turnos_stream (Server-Sent Events). Cada conexión ocupa
+# un hilo del worker mientras está abierta: se cierra a los EVENTOS_DURACION_MAX_S
+# (el navegador reconecta solo) y cada worker acepta hasta EVENTOS_MAX_CONEXIONES.
+# Cada EVENTOS_KEEPALIVE_S sin novedades se envía un comentario para que los
+# proxies no corten la conexión.
+app.config['EVENTOS_KEEPALIVE_S'] = 15
+app.config['EVENTOS_DURACION_MAX_S'] = 300
+app.config['EVENTOS_MAX_CONEXIONES'] = int(os.environ.get('EVENTOS_MAX_CONEXIONES', 50))
+app.config['EVENTOS_MAX_PENDIENTES'] = 100
+
+# Login: las contraseñas se verifican en LOGIN_PROCESOS_HASH procesos aparte
+# (0 = en el mismo hilo). Cada worker admite hasta LOGIN_MAX_PENDIENTES
+# verificaciones en curso; las demás se rechazan con "servidor ocupado".
+app.config['LOGIN_PROCESOS_HASH'] = int(os.environ.get('LOGIN_PROCESOS_HASH', 2))
+app.config['LOGIN_MAX_PENDIENTES'] = 8
+app.config['LOGIN_TIMEOUT_S'] = 5
+
+# Intentos de login permitidos como (cantidad, por cada N segundos), por IP y
+# por nombre de usuario. Se cuentan por worker. Se rechazan antes de consultar
+# la DB o calcular hashes.
+app.config['LOGIN_INTENTOS_IP'] = (30, 60)
+app.config['LOGIN_INTENTOS_USUARIO'] = (5, 60)
+
+# Segundos que se recuerda que un nombre de usuario no existe
+app.config['LOGIN_INEXISTENTES_TTL'] = 60
+
+# Política de hash de contraseñas, en el formato de werkzeug (ej: 'scrypt:32768:8:1'
+# o 'pbkdf2:sha256:600000'). Las contraseñas nuevas se guardan con este método
+# y las cuentas con otro método o costo se actualizan solas, en segundo plano,
+# la próxima vez que inician sesión. Cada worker encola hasta REHASH_MAX_PENDIENTES.
+app.config['METODO_HASH_CONTRASENAS'] = os.environ.get('METODO_HASH_CONTRASENAS', 'scrypt:32768:8:1')
+app.config['REHASH_MAX_PENDIENTES'] = 100
+
+# Claves de idempotencia de las reservas (campo oculto del formulario o
+# encabezado Idempotency-Key): el resultado de cada clave se recuerda
+# IDEMPOTENCIA_TTL segundos. Un envío repetido mientras el original sigue en
+# curso espera hasta IDEMPOTENCIA_ESPERA_S; si el worker que lo procesaba se
+# cae, la clave se libera a los IDEMPOTENCIA_EN_CURSO_TTL segundos.
+app.config['IDEMPOTENCIA_TTL'] = 3600
+app.config['IDEMPOTENCIA_EN_CURSO_TTL'] = 30
+app.config['IDEMPOTENCIA_ESPERA_S'] = 5
+app.config['IDEMPOTENCIA_MAX_CLAVES'] = 10000
+
+# Turnos por pedido en los lotes de /api/reservas (alta o cancelación de varios
+# turnos en una sola transacción)
+app.config['API_RESERVAS_MAX_LOTE'] = 20
+
 
 # --- INICIO: Definición de Modelos (Tablas de la DB) ---
 
@@ -43,13 +202,17 @@ class Administrador(db.Model):
     contrasena_hash = db.Column(db.String(256), nullable=False) 
 
     def set_password(self, contrasena):
-        """Genera un hash seguro para la contraseña y lo almacena."""
-        self.contrasena_hash = generate_password_hash(contrasena)
+        """Genera un hash seguro para la contraseña (con la política vigente) y lo almacena."""
+        self.contrasena_hash = generate_password_hash(contrasena, method=app.config['METODO_HASH_CONTRASENAS'])
 
     def check_password(self, contrasena):
         """Verifica si la contraseña proporcionada coincide con el hash almacenado."""
         return check_password_hash(self.contrasena_hash, contrasena)
 
+    def necesita_rehash(self):
+        """Indica si el hash guardado usa un método o costo distinto de la política vigente."""
+        return hash_desactualizado(self.contrasena_hash)
+
 class Usuario(db.Model):
     """
     Modelo de la tabla 'usuarios'.
@@ -67,13 +230,17 @@ class Usuario(db.Model):
     reservas = db.relationship('Reserva', backref='usuario', lazy=True)
 
     def set_password(self, contrasena):
-        """Genera un hash seguro para la contraseña y lo almacena."""
-        self.contrasena_hash = generate_password_hash(contrasena)
+        """Genera un hash seguro para la contraseña (con la política vigente) y lo almacena."""
+        self.contrasena_hash = generate_password_hash(contrasena, method=app.config['METODO_HASH_CONTRASENAS'])
 
     def check_password(self, contrasena):
         """Verifica si la contraseña proporcionada coincide con el hash almacenado."""
         return check_password_hash(self.contrasena_hash, contrasena)
 
+    def necesita_rehash(self):
+        """Indica si el hash guardado usa un método o costo distinto de la política vigente."""
+        return hash_desactualizado(self.contrasena_hash)
+
 class Cancha(db.Model):
     """
     Modelo de la tabla 'canchas'.
@@ -96,9 +263,9 @@ class Reserva(db.Model):
     """
     __tablename__ = 'reservas' 
     id = db.Column(db.Integer, primary_key=True)
-    fecha = db.Column(db.String(10), nullable=False) # Formato YYYY-MM-DD
-    hora_inicio = db.Column(db.String(5), nullable=False) # Formato HH:MM
-    hora_fin = db.Column(db.String(5), nullable=False) # Formato HH:MM
+    fecha = db.Column(db.Date, nullable=False)
+    hora_inicio = db.Column(db.Time, nullable=False)
+    hora_fin = db.Column(db.Time, nullable=False)
     monto = db.Column(db.Float, nullable=False) # Monto al momento de la reserva
     estado = db.Column(db.String(20), nullable=False, default='activa') # 'activa' o 'cancelada'
     
@@ -106,6 +273,22 @@ class Reserva(db.Model):
     usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False) 
     cancha_id = db.Column(db.Integer, db.ForeignKey('canchas.id'), nullable=False) 
 
+    # Columna generada por la DB: 1 si la reserva está activa, NULL si está cancelada.
+    # Como NULL nunca colisiona en un índice único, el índice de abajo sólo impide
+    # dos reservas ACTIVAS en el mismo turno (las canceladas no bloquean el horario).
+    turno_activo = db.Column(db.Integer, db.Computed("CASE WHEN estado = 'activa' THEN 1 ELSE NULL END"))
+
+    __table_args__ = (
+        # También sirve (por prefijo) para buscar por (cancha_id, fecha, hora_inicio)
+        db.Index('uq_reservas_turno_activo', 'cancha_id', 'fecha', 'hora_inicio', 'turno_activo', unique=True),
+        # Disponibilidad, KPIs, listados del admin e informes: WHERE estado = ? AND fecha ...
+        db.Index('ix_reservas_estado_fecha', 'estado', 'fecha'),
+        # Panel e historial del usuario: WHERE usuario_id = ? AND estado = ? AND fecha >= ?
+        db.Index('ix_reservas_usuario_estado_fecha', 'usuario_id', 'estado', 'fecha'),
+        # Panel de reportes: demanda por cancha/hora/día sin leer la tabla (índice cubriente)
+        db.Index('ix_reservas_estado_cancha_hora', 'estado', 'cancha_id', 'hora_inicio', 'fecha'),
+    )
+
 class Gasto(db.Model):
     """
     ¡ESTE ES EL MODELO QUE FALTABA!
@@ -114,15 +297,1414 @@ class Gasto(db.Model):
     """
     __tablename__ = 'gastos' 
     id = db.Column(db.Integer, primary_key=True)
-    fecha = db.Column(db.String(10), nullable=False) # Formato YYYY-MM-DD
+    fecha = db.Column(db.Date, nullable=False, index=True)
     monto = db.Column(db.Float, nullable=False)
     categoria = db.Column(db.String(100), nullable=False) # Ej: 'Servicios', 'Impuestos', 'Sueldos', 'Mantenimiento'
     concepto = db.Column(db.String(255), nullable=False) # Ej: 'Pago Luz Enero', 'Alquiler Mes', 'Sueldo Empleado'
     descripcion = db.Column(db.Text, nullable=True) # Opcional, para más detalles
 
+    __table_args__ = (
+        # Reporte de gastos: total por categoría sin leer la tabla (índice cubriente)
+        db.Index('ix_gastos_categoria_monto', 'categoria', 'monto'),
+        # Reporte de gastos: los más caros, leyendo sólo el principio del índice
+        db.Index('ix_gastos_monto', 'monto'),
+    )
+
+class ResumenDiario(db.Model):
+    """
+    Modelo de la tabla 'resumen_diario'.
+    Totales financieros precalculados por fecha, para que los informes sumen
+    a lo sumo 365 filas por año en lugar de recorrer todas las reservas y gastos.
+    Se actualiza en la misma transacción que cada reserva, cancelación o gasto
+    (ver acumular_resumen) y se repara con 'python reconstruir_resumen.py'.
+    """
+    __tablename__ = 'resumen_diario'
+    fecha = db.Column(db.Date, primary_key=True)
+    ingresos = db.Column(db.Float, nullable=False, default=0.0) # Suma de reservas activas
+    egresos = db.Column(db.Float, nullable=False, default=0.0) # Suma de gastos
+    reservas_activas = db.Column(db.Integer, nullable=False, default=0)
+    reservas_canceladas = db.Column(db.Integer, nullable=False, default=0)
+    cantidad_gastos = db.Column(db.Integer, nullable=False, default=0)
+
+class ResumenDiarioCancha(db.Model):
+    """
+    Modelo de la tabla 'resumen_diario_canchas'.
+    Mismo resumen que 'resumen_diario', desglosado por cancha.
+    """
+    __tablename__ = 'resumen_diario_canchas'
+    fecha = db.Column(db.Date, primary_key=True)
+    cancha_id = db.Column(db.Integer, db.ForeignKey('canchas.id'), primary_key=True)
+    ingresos = db.Column(db.Float, nullable=False, default=0.0)
+    reservas_activas = db.Column(db.Integer, nullable=False, default=0)
+    reservas_canceladas = db.Column(db.Integer, nullable=False, default=0)
+
+class VersionDatos(db.Model):
+    """
+    Modelo de la tabla 'versiones_datos'.
+    Un contador por conjunto de datos (ej: 'reservas:2025-11-20', 'gastos:2025-11-01',
+    'canchas') que se incrementa en la misma transacción que cada escritura.
+    Con él se arman los ETag de las respuestas sin leer las tablas de datos.
+    """
+    __tablename__ = 'versiones_datos'
+    clave = db.Column(db.String(40), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    modificado = db.Column(db.DateTime, nullable=False) # UTC
+
 # --- FIN: Definición de Modelos ---
 
 
+# --- INICIO: Resumen Diario (tabla de totales precalculados) ---
+
+def _sumar_en_fila(modelo, claves, deltas, fijos=None):
+    """
+    Suma 'deltas' a la fila de 'modelo' identificada por 'claves', creándola si
+    no existe, con un único UPSERT atómico (sin leer antes). Las columnas de
+    'fijos' se reemplazan por el valor dado. No hace commit.
+    """
+    tabla = modelo.__table__
+    fijos = fijos or {}
+    if db.engine.dialect.name == 'mysql':
+        sentencia = mysql_insert(tabla).values(**claves, **deltas, **fijos)
+        sentencia = sentencia.on_duplicate_key_update(
+            {**{columna: tabla.c[columna] + sentencia.inserted[columna] for columna in deltas}, **fijos}
+        )
+    else:
+        sentencia = sqlite_insert(tabla).values(**claves, **deltas, **fijos)
+        sentencia = sentencia.on_conflict_do_update(
+            index_elements=list(claves),
+            set_={**{columna: tabla.c[columna] + sentencia.excluded[columna] for columna in deltas}, **fijos}
+        )
+    db.session.execute(sentencia)
+
+def acumular_resumen(fecha, cancha_id=None, ingresos=0.0, egresos=0.0,
+                     reservas_activas=0, reservas_canceladas=0, cantidad_gastos=0):
+    """
+    Aplica un cambio (positivo o negativo) al resumen diario de 'fecha' y, si se
+    indica la cancha, también a su desglose. Debe llamarse dentro de la misma
+    transacción que la reserva, cancelación o gasto que lo origina.
+    """
+    _sumar_en_fila(ResumenDiario, {'fecha': fecha}, {
+        'ingresos': ingresos,
+        'egresos': egresos,
+        'reservas_activas': reservas_activas,
+        'reservas_canceladas': reservas_canceladas,
+        'cantidad_gastos': cantidad_gastos,
+    })
+    if cancha_id is not None:
+        _sumar_en_fila(ResumenDiarioCancha, {'fecha': fecha, 'cancha_id': cancha_id}, {
+            'ingresos': ingresos,
+            'reservas_activas': reservas_activas,
+            'reservas_canceladas': reservas_canceladas,
+        })
+
+def reconstruir_resumen_diario(desde=None, hasta=None):
+    """
+    Recalcula desde cero el resumen diario (y por cancha) a partir de las tablas
+    'reservas' y 'gastos', para todo el historial o sólo entre 'desde' y 'hasta'.
+    Devuelve la cantidad de días resumidos. No hace commit.
+    """
+    def en_rango(columna_fecha):
+        filtros = []
+        if desde:
+            filtros.append(columna_fecha >= desde)
+        if hasta:
+            filtros.append(columna_fecha <= hasta)
+        return filtros
+
+    es_activa = Reserva.estado == 'activa'
+    es_cancelada = Reserva.estado == 'cancelada'
+    ingresos = func.coalesce(func.sum(case((es_activa, Reserva.monto), else_=0.0)), 0.0)
+    activas = func.coalesce(func.sum(case((es_activa, 1), else_=0)), 0)
+    canceladas = func.coalesce(func.sum(case((es_cancelada, 1), else_=0)), 0)
+
+    ResumenDiario.query.filter(*en_rango(ResumenDiario.fecha)).delete(synchronize_session=False)
+    ResumenDiarioCancha.query.filter(*en_rango(ResumenDiarioCancha.fecha)).delete(synchronize_session=False)
+
+    # Desglose por cancha: un INSERT ... SELECT agrupado, sin pasar por Python
+    db.session.execute(insert(ResumenDiarioCancha).from_select(
+        ['fecha', 'cancha_id', 'ingresos', 'reservas_activas', 'reservas_canceladas'],
+        select(Reserva.fecha, Reserva.cancha_id, ingresos, activas, canceladas)
+            .where(*en_rango(Reserva.fecha))
+            .group_by(Reserva.fecha, Reserva.cancha_id)
+    ))
+
+    # Totales por día: se combinan reservas y gastos (una fila por fecha)
+    dias = defaultdict(lambda: {'ingresos': 0.0, 'egresos': 0.0, 'reservas_activas': 0,
+                                'reservas_canceladas': 0, 'cantidad_gastos': 0})
+    filas_reservas = db.session.query(Reserva.fecha, ingresos, activas, canceladas) \
+        .filter(*en_rango(Reserva.fecha)).group_by(Reserva.fecha)
+    for fecha, total, cant_activas, cant_canceladas in filas_reservas:
+        dias[fecha].update(ingresos=float(total), reservas_activas=int(cant_activas),
+                           reservas_canceladas=int(cant_canceladas))
+    filas_gastos = db.session.query(Gasto.fecha, func.sum(Gasto.monto), func.count(Gasto.id)) \
+        .filter(*en_rango(Gasto.fecha)).group_by(Gasto.fecha)
+    for fecha, total, cantidad in filas_gastos:
+        dias[fecha].update(egresos=float(total), cantidad_gastos=int(cantidad))
+
+    if dias:
+        db.session.execute(insert(ResumenDiario), [{'fecha': fecha, **datos} for fecha, datos in dias.items()])
+
+    # Se usa tras cargas masivas por fuera de la app: cambia el ETag de todo
+    marcar_cambio('reconstruccion')
+    publicar_al_confirmar(CANAL_TODAS, {'tipo': 'recargar'})
+    return len(dias)
+
+# --- FIN: Resumen Diario ---
+
+
+# --- INICIO: Versiones de datos (ETag / Last-Modified) ---
+
+def marcar_cambio(*claves):
+    """
+    Incrementa la versión de cada clave (ej: 'reservas:2025-11-20'). Llamarla
+    en la misma transacción que la escritura: así ninguna request puede ver
+    el dato nuevo con la versión vieja. No hace commit.
+    """
+    ahora = datetime.now(timezone.utc).replace(tzinfo=None)
+    for clave in claves:
+        _sumar_en_fila(VersionDatos, {'clave': clave}, {'version': 1}, fijos={'modificado': ahora})
+
+def leer_versiones(claves=(), prefijos=()):
+    """
+    Lee en una sola consulta (sobre la clave primaria de 'versiones_datos') la
+    versión de cada clave y la suma de las versiones de cada prefijo
+    (ej: 'reservas:' = cualquier fecha). Como las versiones sólo crecen, la
+    suma cambia con cualquier escritura del conjunto.
+    Devuelve ({clave o prefijo: versión}, momento del último cambio o None).
+    """
+    columnas = [func.max(case((VersionDatos.clave == clave, VersionDatos.version))) for clave in claves]
+    columnas += [func.sum(case((VersionDatos.clave.startswith(prefijo), VersionDatos.version)))
+                 for prefijo in prefijos]
+    fila = db.session.query(*columnas, func.max(VersionDatos.modificado)).filter(
+        or_(VersionDatos.clave.in_(claves), *(VersionDatos.clave.startswith(prefijo) for prefijo in prefijos))
+    ).one()
+    versiones = {nombre: int(valor or 0) for nombre, valor in zip(list(claves) + list(prefijos), fila)}
+    return versiones, fila[-1]
+
+def respuesta_condicional(nombre, claves=(), prefijos=(), extra=''):
+    """
+    Soporte de GET condicional para una ruta. Arma un ETag fuerte con las
+    versiones de los datos de los que depende la respuesta (más el usuario de
+    la sesión y 'extra', ej: la fecha de hoy). Si el cliente ya tiene ese ETag
+    devuelve una respuesta 304 lista para retornar, sin haber leído las tablas
+    de datos; si no, programa los encabezados ETag y Last-Modified para la
+    respuesta que arme la ruta y devuelve None.
+    También devuelve las versiones leídas: (respuesta_304 o None, versiones).
+
+    El 304 se decide sólo por el ETag: Last-Modified tiene resolución de un
+    segundo y podría ocultar dos cambios en el mismo segundo.
+    """
+    versiones, modificado = leer_versiones(claves, prefijos)
+    if '_flashes' in session:
+        return None, versiones # La página tiene que mostrar mensajes pendientes
+
+    firma = '|'.join([app.config['VERSION_CONTENIDO'], nombre, f"{session.get('rol')}:{session.get('user_id')}",
+                      extra, repr(sorted(versiones.items()))])
+    etag = hashlib.blake2b(firma.encode('utf-8'), digest_size=12).hexdigest()
+
+    def agregar_encabezados(respuesta):
+        respuesta.set_etag(etag)
+        if modificado:
+            respuesta.last_modified = modificado
+        respuesta.cache_control.private = True
+        respuesta.cache_control.no_cache = True # El cliente puede guardarla, pero siempre revalida
+        return respuesta
+
+    if request.if_none_match.contains(etag):
+        return agregar_encabezados(Response(status=304)), versiones
+
+    @after_this_request
+    def etiquetar(respuesta):
+        # Sólo se etiqueta una respuesta normal: no errores, redirecciones ni
+        # páginas que mostraron o dejaron mensajes flash (tocaron la sesión)
+        if respuesta.status_code == 200 and not session.modified:
+            agregar_encabezados(respuesta)
+        return respuesta
+
+    return None, versiones
+
+def version_fecha(versiones, fecha):
+    """Versión de la ocupación de 'fecha' (sus reservas y la última reconstrucción masiva)."""
+    return versiones.get(f'reservas:{fecha.isoformat()}', 0), versiones.get('reconstruccion', 0)
+
+def versiones_de_cambios(fechas):
+    """
+    Recibe la fecha de cada cambio de reservas hecho en la transacción en curso
+    (en orden) y devuelve la versión de ocupación (ver version_fecha) que dejó
+    cada uno, para pasarla a ocupacion_turnos.marcar/liberar tras el commit.
+    Llamarla antes del commit: esta transacción tiene bloqueadas las filas de
+    versiones_datos de esas fechas, así que lo leído es lo que queda confirmado.
+    Hace una sola consulta.
+    """
+    claves = [f'reservas:{fecha.isoformat()}' for fecha in dict.fromkeys(fechas)]
+    versiones, _ = leer_versiones(claves + ['reconstruccion'])
+    restantes = Counter(fechas)
+    resultado = []
+    for fecha in fechas:
+        restantes[fecha] -= 1
+        reservas, reconstruccion = version_fecha(versiones, fecha)
+        resultado.append((reservas - restantes[fecha], reconstruccion))
+    return resultado
+
+# --- FIN: Versiones de datos ---
+
+
+# --- INICIO: Catálogo de canchas (en memoria, versionado) ---
+
+# Registro inmutable y compacto de una cancha (lo que muestran las vistas)
+CanchaInfo = namedtuple('CanchaInfo', 'id nombre tipo condicion monto')
+
+class CatalogoCanchas:
+    """
+    Copia en memoria de la tabla 'canchas', una por proceso (worker). Las
+    canchas cambian muy de vez en cuando, así que se cargan una vez y se
+    reusan mientras no cambie la versión 'canchas' de versiones_datos (la
+    incrementan agregar/editar/eliminar_cancha en su transacción).
+    Si el llamador ya leyó esa versión (ej: para el ETag) no hace falta
+    ninguna consulta; si no, se verifica como mucho cada
+    CATALOGO_CANCHAS_VERIFICAR_S segundos, con una sola consulta que trae la
+    versión junto con las filas (son pocas).
+    """
+    def __init__(self):
+        self._canchas = () # CanchaInfo ordenadas por id
+        self._por_id = {}
+        self._version = None # None = sin cargar o invalidado
+        self._verificado_en = 0.0
+        self._lock = threading.Lock()
+
+    def _vigentes(self, version=None, verificar=False):
+        ahora = time.monotonic()
+        with self._lock:
+            if self._version is not None and not verificar:
+                if version == self._version or (version is None and
+                        ahora - self._verificado_en < app.config['CATALOGO_CANCHAS_VERIFICAR_S']):
+                    return self._canchas, self._por_id
+
+        # Versión y filas en la misma consulta: la copia nunca queda con una
+        # versión más nueva que sus datos
+        version_actual = select(VersionDatos.version).where(VersionDatos.clave == 'canchas').scalar_subquery()
+        filas = db.session.query(func.coalesce(version_actual, 0), Cancha.id, Cancha.nombre, Cancha.tipo,
+                                 Cancha.condicion, Cancha.monto).order_by(Cancha.id).all()
+        with self._lock:
+            nueva_version = filas[0][0] if filas else -1 # Sin canchas: se vuelve a mirar en la próxima verificación
+            if nueva_version != self._version:
+                self._canchas = tuple(CanchaInfo(*fila[1:]) for fila in filas)
+                self._por_id = {cancha.id: cancha for cancha in self._canchas}
+                self._version = nueva_version
+            self._verificado_en = ahora
+            return self._canchas, self._por_id
+
+    def todas(self, version=None, verificar=False):
+        """Todas las canchas (CanchaInfo), ordenadas por id."""
+        return self._vigentes(version, verificar)[0]
+
+    def ordenadas_por_nombre(self, version=None):
+        return sorted(self.todas(version), key=lambda cancha: cancha.nombre)
+
+    def obtener(self, cancha_id, version=None, verificar=False):
+        """
+        La cancha 'cancha_id' o None si no existe. Si no está en la copia, se
+        verifica la versión antes de responder None (puede ser una cancha
+        recién creada en otro worker).
+        """
+        cancha = self._vigentes(version, verificar)[1].get(cancha_id)
+        if cancha is None and version is None and not verificar:
+            cancha = self._vigentes(verificar=True)[1].get(cancha_id)
+        return cancha
+
+    def nombres(self, version=None):
+        """Diccionario id -> nombre."""
+        return {cancha.id: cancha.nombre for cancha in self.todas(version)}
+
+    def invalidar(self):
+        """Fuerza la recarga en el próximo uso (llamar después del commit que cambia canchas)."""
+        with self._lock:
+            self._version = None
+
+# Instancia única por proceso (worker)
+catalogo_canchas = CatalogoCanchas()
+
+# --- FIN: Catálogo de canchas ---
+
+
+# --- INICIO: Motor de Ocupación de Turnos (bitmap en memoria) ---
+
+# Horarios operativos como tuplas (hora_inicio, hora_fin). El índice de cada
+# tupla es el bit que la representa en el bitmap de ocupación.
+HORARIOS_OPERATIVOS = [
+    (f"{hora:02d}:00", f"{hora+1:02d}:00") for hora in range(HORA_APERTURA, HORA_CIERRE)
+]
+
+def consulta_ocupacion(desde, hasta):
+    """Turnos activos (fecha, cancha, hora) entre dos fechas: la base del bitmap de ocupación."""
+    return select(Reserva.fecha, Reserva.cancha_id, Reserva.hora_inicio).where(
+        Reserva.estado == 'activa', Reserva.fecha.between(desde, hasta))
+
+class OcupacionTurnos:
+    """
+    Ocupación de turnos por fecha (date), guardada en memoria como un bitmap:
+    un int por cancha y un bit por hora (bit 0 = HORA_APERTURA).
+    Las fechas se cargan con una sola consulta la primera vez que se piden
+    y luego las rutas de reserva/cancelación las actualizan incrementalmente.
+    """
+
+    def __init__(self, max_fechas=400):
+        self._fechas = OrderedDict() # fecha -> (momento de carga, {cancha_id: bits}, versión de los datos)
+        self._lock = threading.Lock()
+        self._max_fechas = max_fechas
+        # Se incrementan en cada modificación (por fecha, y la época al invalidar
+        # todo). Permiten descartar una carga desde la DB que se haya solapado
+        # con una reserva/cancelación de este proceso en la misma fecha.
+        self._generaciones = {}
+        self._epoca = 0
+
+    @staticmethod
+    def _bit(hora_inicio):
+        """Devuelve la máscara del bit correspondiente a una hora de inicio (time)."""
+        return 1 << (hora_inicio.hour - HORA_APERTURA)
+
+    def _cargar(self, fechas):
+        """
+        Consulta la DB y arma el bitmap de ocupación de varias fechas.
+        Usa una única consulta por rango, sin importar cuántas fechas sean.
+        """
+        ocupacion = {fecha: defaultdict(int) for fecha in fechas}
+        filas = db.session.execute(consulta_ocupacion(min(fechas), max(fechas))).all()
+        for fecha, cancha_id, hora_inicio in filas:
+            if fecha in ocupacion:
+                ocupacion[fecha][cancha_id] |= self._bit(hora_inicio)
+        return {fecha: dict(bits) for fecha, bits in ocupacion.items()}
+
+    def obtener_varias(self, fechas, versiones=None):
+        """
+        Devuelve {fecha: {cancha_id: bits}} para una lista de fechas.
+        Sólo consulta la DB por las fechas que no están en memoria o expiraron.
+        Si se pasan 'versiones' ({fecha: versión}, ver version_fecha), además
+        recarga las fechas cargadas con otra versión: el dato nunca es más
+        viejo que la versión con la que se arma el ETag de la respuesta.
+        """
+        ahora = time.monotonic()
+        resultado = {}
+        faltantes = []
+        with self._lock:
+            for fecha in fechas:
+                entrada = self._fechas.get(fecha)
+                vigente = entrada and ahora - entrada[0] < app.config['OCUPACION_TTL']
+                if vigente and (versiones is None or entrada[2] == versiones[fecha]):
+                    self._fechas.move_to_end(fecha)
+                    resultado[fecha] = dict(entrada[1])
+                else:
+                    faltantes.append(fecha)
+            epoca = self._epoca
+            generaciones = {fecha: self._generaciones.get(fecha, 0) for fecha in faltantes}
+
+        if not faltantes:
+            return resultado
+
+        cargadas = self._cargar(faltantes)
+
+        with self._lock:
+            # Si una fecha cambió mientras consultábamos, no guardamos su dato viejo
+            for fecha, ocupacion in cargadas.items():
+                if epoca == self._epoca and generaciones[fecha] == self._generaciones.get(fecha, 0):
+                    self._fechas[fecha] = (ahora, ocupacion, versiones[fecha] if versiones else None)
+                    self._fechas.move_to_end(fecha)
+            while len(self._fechas) > self._max_fechas:
+                self._fechas.popitem(last=False)
+
+        for fecha, ocupacion in cargadas.items():
+            resultado[fecha] = dict(ocupacion)
+        return resultado
+
+    def obtener(self, fecha, version=None):
+        """Devuelve {cancha_id: bits} para una fecha."""
+        return self.obtener_varias([fecha], None if version is None else {fecha: version})[fecha]
+
+    def _modificar(self, fecha, cancha_id, cambio, version):
+        """
+        Aplica 'cambio' a los bits de una cancha en una fecha cargada. Si la copia
+        estaba en la versión anterior a 'version' (la que dejó este cambio, ver
+        versiones_de_cambios), pasa a 'version' y la próxima lectura de la fecha
+        no consulta la DB; si no (otro worker la cambió), sigue con su versión
+        vieja y se recargará.
+        """
+        with self._lock:
+            self._generaciones[fecha] = self._generaciones.get(fecha, 0) + 1
+            if len(self._generaciones) > 2 * self._max_fechas:
+                # Se reinician los contadores: sólo se pierden las cargas en curso
+                self._generaciones.clear()
+                self._epoca += 1
+            entrada = self._fechas.get(fecha)
+            if entrada:
+                ocupacion = entrada[1]
+                ocupacion[cancha_id] = cambio(ocupacion.get(cancha_id, 0))
+                if version is not None and entrada[2] == (version[0] - 1, version[1]):
+                    self._fechas[fecha] = (entrada[0], ocupacion, version)
+
+    def marcar(self, fecha, cancha_id, hora_inicio, version=None):
+        """Marca un turno como ocupado (tras confirmar una reserva)."""
+        bit = self._bit(hora_inicio)
+        self._modificar(fecha, cancha_id, lambda bits: bits | bit, version)
+
+    def liberar(self, fecha, cancha_id, hora_inicio, version=None):
+        """Libera un turno (tras cancelar una reserva)."""
+        bit = self._bit(hora_inicio)
+        self._modificar(fecha, cancha_id, lambda bits: bits & ~bit, version)
+
+    def invalidar(self, fecha=None):
+        """Descarta una fecha (o todas) para forzar su recarga desde la DB."""
+        with self._lock:
+            if fecha is None:
+                self._epoca += 1
+                self._generaciones.clear()
+                self._fechas.clear()
+            else:
+                self._generaciones[fecha] = self._generaciones.get(fecha, 0) + 1
+                self._fechas.pop(fecha, None)
+
+def horarios_libres(bits):
+    """Convierte el bitmap de una cancha en la lista de horarios libres."""
+    return [
+        {'hora_inicio': hora_inicio, 'hora_fin': hora_fin}
+        for i, (hora_inicio, hora_fin) in enumerate(HORARIOS_OPERATIVOS)
+        if not (bits >> i) & 1
+    ]
+
+# Instancia única por proceso (worker)
+ocupacion_turnos = OcupacionTurnos()
+
+# --- FIN: Motor de Ocupación de Turnos ---
+
+
+# --- INICIO: Caché con backends intercambiables ---
+
+class BackendMemoria:
+    """
+    Backend de caché por defecto: un dict en memoria del proceso, con
+    vencimiento por clave. Cada worker tiene su propia copia.
+    Con 'max_claves', al llenarse descarta primero las vencidas y después
+    las escritas hace más tiempo (para cachés con muchas claves distintas).
+    """
+    def __init__(self, max_claves=None):
+        self._datos = OrderedDict() # clave -> (vence_en, valor), en orden de escritura
+        self._max_claves = max_claves
+        self._lock = threading.Lock()
+
+    def get(self, clave):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return None
+            if entrada[0] <= time.monotonic():
+                del self._datos[clave]
+                return None
+            return entrada[1]
+
+    def set(self, clave, valor, ttl):
+        with self._lock:
+            self._guardar(clave, valor, ttl)
+
+    def agregar(self, clave, valor, ttl):
+        """Guarda 'valor' sólo si la clave no existe (o venció). Devuelve True si lo guardó."""
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is not None and entrada[0] > time.monotonic():
+                return False
+            self._guardar(clave, valor, ttl)
+            return True
+
+    def _guardar(self, clave, valor, ttl):
+        ahora = time.monotonic()
+        self._datos.pop(clave, None)
+        self._datos[clave] = (ahora + ttl, valor)
+        if self._max_claves and len(self._datos) > self._max_claves:
+            for vencida in [c for c, (vence_en, _) in self._datos.items() if vence_en <= ahora]:
+                del self._datos[vencida]
+            while len(self._datos) > self._max_claves:
+                self._datos.popitem(last=False)
+
+    def delete(self, *claves):
+        with self._lock:
+            for clave in claves:
+                self._datos.pop(clave, None)
+
+class BackendRedis:
+    """
+    Backend de caché compartido entre workers. Acepta cualquier cliente con la
+    interfaz de redis-py (get, set, setex, delete), por ejemplo redis.Redis o un
+    cliente falso en memoria. Los valores se guardan serializados en JSON.
+    Redis vence las claves solo, así que no necesita límite de claves.
+    """
+    def __init__(self, cliente, prefijo='reserva_canchas:'):
+        self._cliente = cliente
+        self._prefijo = prefijo
+
+    def get(self, clave):
+        crudo = self._cliente.get(self._prefijo + clave)
+        return None if crudo is None else json.loads(crudo)
+
+    def set(self, clave, valor, ttl):
+        self._cliente.setex(self._prefijo + clave, max(1, int(ttl)), json.dumps(valor))
+
+    def agregar(self, clave, valor, ttl):
+        return bool(self._cliente.set(self._prefijo + clave, json.dumps(valor), ex=max(1, int(ttl)), nx=True))
+
+    def delete(self, *claves):
+        if claves:
+            self._cliente.delete(*(self._prefijo + clave for clave in claves))
+
+def crear_backend_cache(max_claves=None):
+    """Devuelve el backend configurado: Redis si hay REDIS_URL, si no el dict en memoria."""
+    if app.config['REDIS_URL']:
+        import redis # Dependencia opcional, sólo necesaria con REDIS_URL
+        return BackendRedis(redis.Redis.from_url(app.config['REDIS_URL']))
+    return BackendMemoria(max_claves)
+
+class CacheCalculada:
+    """
+    Caché de valores calculados (ej: KPIs) sobre un backend intercambiable.
+    Si la clave no está, ejecuta la función de cálculo y guarda el resultado
+    por 'ttl' segundos. Las escrituras de la app la invalidan explícitamente.
+    Lleva contadores de aciertos, fallos e invalidaciones por proceso.
+    """
+    def __init__(self, backend, ttl_config):
+        self.backend = backend
+        self._ttl_config = ttl_config # Clave de app.config con el TTL
+        self._contadores = Counter()
+        self._lock = threading.Lock()
+
+    def _contar(self, evento, cantidad=1):
+        with self._lock:
+            self._contadores[evento] += cantidad
+
+    def obtener(self, clave, calcular):
+        """Devuelve el valor de 'clave', calculándolo con 'calcular()' si no está en caché."""
+        valor = self.backend.get(clave)
+        if valor is not None:
+            self._contar('aciertos')
+            return valor
+        self._contar('fallos')
+        valor = calcular()
+        self.backend.set(clave, valor, app.config[self._ttl_config])
+        return valor
+
+    def invalidar(self, *claves):
+        """Descarta las claves indicadas (llamar después del commit que las cambia)."""
+        self.backend.delete(*claves)
+        self._contar('invalidaciones', len(claves))
+
+    def estadisticas(self):
+        with self._lock:
+            aciertos = self._contadores['aciertos']
+            fallos = self._contadores['fallos']
+            invalidaciones = self._contadores['invalidaciones']
+        consultas = aciertos + fallos
+        return {
+            'backend': type(self.backend).__name__,
+            'ttl': app.config[self._ttl_config],
+            'aciertos': aciertos,
+            'fallos': fallos,
+            'invalidaciones': invalidaciones,
+            'tasa_aciertos': round(aciertos / consultas, 4) if consultas else None,
+        }
+
+# Caché de los KPIs del panel de administrador
+cache_kpis = CacheCalculada(crear_backend_cache(), 'KPI_TTL')
+
+# Ids de los administradores válidos. Siempre en memoria del proceso: se
+# consulta en cada request de admin y debe resolverse sin ir a la red.
+cache_admins = CacheCalculada(BackendMemoria(), 'ADMIN_CACHE_TTL')
+
+def invalidar_kpis_reserva(fecha):
+    """Invalida los KPIs que dependen de las reservas de 'fecha' (turnos del día e ingresos del mes)."""
+    cache_kpis.invalidar(f'reservas_dia:{fecha.isoformat()}', f'ingresos_mes:{fecha:%Y-%m}')
+
+# --- FIN: Caché con backends intercambiables ---
+
+
+# --- INICIO: Eventos en vivo de disponibilidad (pub/sub) ---
+
+# Canal por el que se pide a todos los clientes recargar la disponibilidad
+# (cambió una cancha o hubo una carga masiva); el resto de los canales son fechas.
+CANAL_TODAS = 'todas'
+
+class Suscripcion:
+    """
+    Cola de mensajes de un suscriptor (una conexión SSE). La cola es acotada:
+    si el cliente no la consume a tiempo se descartan los pendientes y se le
+    pide recargar, en vez de acumular memoria sin límite.
+    """
+    def __init__(self, pubsub, canales, maximo_pendientes):
+        self._pubsub = pubsub
+        self.canales = canales
+        self._cola = queue.Queue(maximo_pendientes)
+        self._desbordada = False
+
+    def entregar(self, mensaje):
+        try:
+            self._cola.put_nowait(mensaje)
+        except queue.Full:
+            self._desbordada = True
+
+    def esperar(self, timeout):
+        """Devuelve el próximo mensaje, o None si no llegó ninguno en 'timeout' segundos."""
+        if self._desbordada:
+            self._desbordada = False
+            while not self._cola.empty():
+                self._cola.get_nowait()
+            return {'tipo': 'recargar'}
+        try:
+            return self._cola.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def cerrar(self):
+        self._pubsub.desuscribir(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+class PubSubMemoria:
+    """
+    Pub/sub por defecto, dentro del proceso: sólo llega a los suscriptores
+    del mismo worker. Con varios workers usar PubSubRedis.
+    """
+    def __init__(self, maximo_pendientes=100):
+        self._suscriptores = defaultdict(set) # canal -> {Suscripcion}
+        self._maximo_pendientes = maximo_pendientes
+        self._lock = threading.Lock()
+
+    def publicar(self, canal, mensaje):
+        with self._lock:
+            destinatarios = list(self._suscriptores.get(canal, ()))
+        for suscripcion in destinatarios:
+            suscripcion.entregar(mensaje)
+
+    def publicar_a_todos(self, mensaje):
+        with self._lock:
+            destinatarios = set().union(*self._suscriptores.values())
+        for suscripcion in destinatarios:
+            suscripcion.entregar(mensaje)
+
+    def suscribir(self, *canales):
+        suscripcion = Suscripcion(self, canales, self._maximo_pendientes)
+        with self._lock:
+            for canal in canales:
+                self._suscriptores[canal].add(suscripcion)
+        return suscripcion
+
+    def desuscribir(self, suscripcion):
+        with self._lock:
+            for canal in suscripcion.canales:
+                self._suscriptores[canal].discard(suscripcion)
+                if not self._suscriptores[canal]:
+                    del self._suscriptores[canal]
+
+class PubSubRedis:
+    """
+    Pub/sub compartido entre workers vía Redis. Acepta cualquier cliente con
+    la interfaz de redis-py (publish, pubsub). Cada proceso abre una sola
+    conexión de suscripción, en un hilo que escucha todos los canales, y
+    reparte los mensajes a sus suscriptores locales con un PubSubMemoria.
+    """
+    def __init__(self, cliente, prefijo='reserva_canchas:eventos:'):
+        self._cliente = cliente
+        self._prefijo = prefijo
+        self._local = PubSubMemoria()
+        self._pid_escucha = None
+        self._lock = threading.Lock()
+
+    def publicar(self, canal, mensaje):
+        self._cliente.publish(self._prefijo + canal, json.dumps(mensaje))
+
+    def publicar_a_todos(self, mensaje):
+        self._local.publicar_a_todos(mensaje)
+
+    def suscribir(self, *canales):
+        self._asegurar_escucha()
+        return self._local.suscribir(*canales)
+
+    def desuscribir(self, suscripcion):
+        self._local.desuscribir(suscripcion)
+
+    def _asegurar_escucha(self):
+        # Un hilo por proceso: los workers de gunicorn se crean con fork
+        # después de importar la app, y los hilos no sobreviven al fork
+        with self._lock:
+            if self._pid_escucha == os.getpid():
+                return
+            self._pid_escucha = os.getpid()
+        threading.Thread(target=self._escuchar, name='pubsub-redis', daemon=True).start()
+
+    def _escuchar(self):
+        while True:
+            try:
+                conexion = self._cliente.pubsub(ignore_subscribe_messages=True)
+                conexion.psubscribe(self._prefijo + '*')
+                for mensaje in conexion.listen():
+                    canal = mensaje['channel']
+                    if isinstance(canal, bytes):
+                        canal = canal.decode('utf-8')
+                    self._local.publicar(canal[len(self._prefijo):], json.loads(mensaje['data']))
+            except Exception as e:
+                app.logger.warning(f"Se perdió la conexión de eventos con Redis: {e}")
+                # Mientras estuvo caída se pudieron perder eventos
+                self._local.publicar_a_todos({'tipo': 'recargar'})
+                time.sleep(1)
+
+def crear_pubsub():
+    """Devuelve el pub/sub configurado: Redis si hay REDIS_URL, si no en memoria del proceso."""
+    if app.config['REDIS_URL']:
+        import redis # Dependencia opcional, sólo necesaria con REDIS_URL
+        return PubSubRedis(redis.Redis.from_url(app.config['REDIS_URL']))
+    return PubSubMemoria(app.config['EVENTOS_MAX_PENDIENTES'])
+
+# Avisos de turnos ocupados/liberados para /api/turnos_stream
+eventos_turnos = crear_pubsub()
+
+# Lugares para conexiones de /api/turnos_stream en este proceso. Se toma uno
+# antes de responder (sin esperar) y se devuelve al cerrarse la respuesta, así
+# requests simultáneas nunca pasan juntas del límite
+conexiones_en_vivo = threading.BoundedSemaphore(app.config['EVENTOS_MAX_CONEXIONES'])
+
+def publicar_al_confirmar(canal, mensaje):
+    """
+    Publica 'mensaje' en 'canal' cuando la transacción en curso se confirme;
+    si se revierte, no se publica (nadie ve un turno ocupado que no existe).
+    """
+    db.session.info.setdefault('eventos_pendientes', []).append((canal, mensaje))
+
+def avisar_turno(tipo, cancha_id, fecha, hora_inicio):
+    """Programa el aviso de un turno 'ocupado' o 'liberado' para cuando se confirme la transacción."""
+    publicar_al_confirmar(fecha.isoformat(), {
+        'tipo': tipo, 'fecha': fecha.isoformat(), 'cancha_id': cancha_id, 'hora_inicio': formatear_hora(hora_inicio)
+    })
+
+@event.listens_for(Session, 'after_commit')
+def _publicar_eventos_pendientes(sesion):
+    for canal, mensaje in sesion.info.pop('eventos_pendientes', ()):
+        try:
+            eventos_turnos.publicar(canal, mensaje)
+        except Exception as e:
+            # Los datos ya están confirmados: un aviso perdido no debe hacer fallar la request
+            app.logger.warning(f"No se pudo publicar el evento en '{canal}': {e}")
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_eventos_pendientes(sesion):
+    sesion.info.pop('eventos_pendientes', None)
+
+# --- FIN: Eventos en vivo de disponibilidad ---
+
+
+# --- INICIO: Métricas en formato Prometheus ---
+
+AYUDA_METRICAS_NEGOCIO = {
+    'reservas_creadas': 'Reservas confirmadas (commit) desde cualquier ruta.',
+    'reservas_canceladas': 'Reservas canceladas (commit), por el usuario o por un administrador.',
+    'reservas_conflictos': 'Intentos de reserva rechazados porque el turno ya estaba ocupado.',
+    'reservas_repetidas': 'Envíos de reserva repetidos (misma clave de idempotencia) respondidos con el resultado original.',
+    'logins_limitados': 'Intentos de login rechazados por superar el límite por IP o por usuario.',
+    'logins_rechazados_ocupado': 'Intentos de login rechazados por falta de cupo para verificar la contraseña.',
+}
+
+def _etiquetas(**valores):
+    """Arma el bloque de etiquetas {clave="valor",...} escapando los valores."""
+    partes = []
+    for clave, valor in valores.items():
+        valor = str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        partes.append(f'{clave}="{valor}"')
+    return '{' + ','.join(partes) + '}'
+
+class MetricasProceso:
+    """
+    Registro de métricas de este proceso: histograma de latencia y conteo de
+    requests por ruta, más contadores de negocio. Cada observación toma un
+    único lock por unos pocos microsegundos.
+
+    Con METRICAS_DIR definido (gunicorn con varios workers), cada proceso
+    vuelca periódicamente su estado a metricas_<pid>.json y /metrics suma los
+    archivos de todos los workers al momento de la lectura.
+    """
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets) # Límites superiores (segundos), sin +Inf
+        self._lock = threading.Lock()
+        self._duraciones = {} # (ruta, metodo) -> [conteo por bucket..., conteo +Inf, suma]
+        self._requests = Counter() # (ruta, metodo, estado) -> cantidad
+        self._negocio = Counter() # nombre -> cantidad
+        self._pid_volcado = None # PID del proceso que tiene el hilo de volcado corriendo
+
+    def observar_request(self, ruta, metodo, estado, segundos):
+        indice = bisect_left(self.buckets, segundos) # Primer bucket con límite >= segundos
+        with self._lock:
+            fila = self._duraciones.get((ruta, metodo))
+            if fila is None:
+                fila = self._duraciones[(ruta, metodo)] = [0] * (len(self.buckets) + 1) + [0.0]
+            fila[indice] += 1
+            fila[-1] += segundos
+            self._requests[(ruta, metodo, estado)] += 1
+        self._asegurar_volcado()
+
+    def incrementar(self, nombre, cantidad=1):
+        with self._lock:
+            self._negocio[nombre] += cantidad
+        self._asegurar_volcado()
+
+    def instantanea(self):
+        """Estado actual serializable en JSON (es lo que se vuelca a disco)."""
+        with self._lock:
+            return {
+                'duraciones': [[ruta, metodo, fila] for (ruta, metodo), fila in self._duraciones.items()],
+                'requests': [[ruta, metodo, estado, n] for (ruta, metodo, estado), n in self._requests.items()],
+                'negocio': dict(self._negocio),
+            }
+
+    # --- Modo multiproceso ---
+
+    def _archivo(self, pid):
+        return os.path.join(app.config['METRICAS_DIR'], f'metricas_{pid}.json')
+
+    def volcar(self):
+        """Escribe la instantánea de este proceso en METRICAS_DIR (reemplazo atómico)."""
+        archivo = self._archivo(os.getpid())
+        temporal = f'{archivo}.tmp'
+        with open(temporal, 'w') as f:
+            json.dump(self.instantanea(), f)
+        os.replace(temporal, archivo)
+
+    def _asegurar_volcado(self):
+        # El hilo se crea en el primer uso dentro de cada worker (después del fork)
+        if not app.config['METRICAS_DIR'] or self._pid_volcado == os.getpid():
+            return
+        with self._lock:
+            if self._pid_volcado == os.getpid():
+                return
+            self._pid_volcado = os.getpid()
+        os.makedirs(app.config['METRICAS_DIR'], exist_ok=True)
+        threading.Thread(target=self._bucle_volcado, name='volcado-metricas', daemon=True).start()
+        atexit.register(self.volcar)
+
+    def _bucle_volcado(self):
+        while True:
+            time.sleep(app.config['METRICAS_VOLCADO_S'])
+            try:
+                self.volcar()
+            except OSError as e:
+                app.logger.error(f"No se pudieron volcar las métricas: {str(e)}")
+
+    def instantaneas_de_todos(self):
+        """Instantánea propia (en memoria) más las volcadas por los demás workers."""
+        instantaneas = [self.instantanea()]
+        directorio = app.config['METRICAS_DIR']
+        if not directorio or not os.path.isdir(directorio):
+            return instantaneas
+        propio = os.path.basename(self._archivo(os.getpid()))
+        for nombre in sorted(os.listdir(directorio)):
+            if nombre.startswith('metricas_') and nombre.endswith('.json') and nombre != propio:
+                try:
+                    with open(os.path.join(directorio, nombre)) as f:
+                        instantaneas.append(json.load(f))
+                except (OSError, ValueError):
+                    continue # Archivo de un worker que se está cerrando; se toma en el próximo scrape
+        return instantaneas
+
+    # --- Exposición ---
+
+    def exportar(self):
+        """Texto en formato de exposición de Prometheus (versión 0.0.4), sumando todos los workers."""
+        duraciones = {}
+        requests = Counter()
+        negocio = Counter()
+        for instantanea in self.instantaneas_de_todos():
+            for ruta, metodo, fila in instantanea['duraciones']:
+                acumulada = duraciones.setdefault((ruta, metodo), [0] * len(fila))
+                for i, valor in enumerate(fila):
+                    acumulada[i] += valor
+            for ruta, metodo, estado, n in instantanea['requests']:
+                requests[(ruta, metodo, estado)] += n
+            negocio.update(instantanea['negocio'])
+
+        lineas = [
+            '# HELP canchas_request_duracion_segundos Duración de las requests por ruta.',
+            '# TYPE canchas_request_duracion_segundos histogram',
+        ]
+        limites = [str(limite) for limite in self.buckets] + ['+Inf']
+        for (ruta, metodo), fila in sorted(duraciones.items()):
+            acumulado = 0
+            for limite, conteo in zip(limites, fila):
+                acumulado += conteo
+                lineas.append(f'canchas_request_duracion_segundos_bucket'
+                              f'{_etiquetas(ruta=ruta, metodo=metodo, le=limite)} {acumulado}')
+            lineas.append(f'canchas_request_duracion_segundos_sum{_etiquetas(ruta=ruta, metodo=metodo)} {fila[-1]}')
+            lineas.append(f'canchas_request_duracion_segundos_count{_etiquetas(ruta=ruta, metodo=metodo)} {acumulado}')
+
+        lineas += [
+            '# HELP canchas_requests_total Requests atendidas por ruta, método y código de estado.',
+            '# TYPE canchas_requests_total counter',
+        ]
+        for (ruta, metodo, estado), n in sorted(requests.items()):
+            lineas.append(f'canchas_requests_total{_etiquetas(ruta=ruta, metodo=metodo, estado=estado)} {n}')
+
+        for nombre, ayuda in AYUDA_METRICAS_NEGOCIO.items():
+            lineas += [
+                f'# HELP canchas_{nombre}_total {ayuda}',
+                f'# TYPE canchas_{nombre}_total counter',
+                f'canchas_{nombre}_total {negocio[nombre]}',
+            ]
+        return '\n'.join(lineas) + '\n'
+
+metricas = MetricasProceso(app.config['METRICAS_BUCKETS'])
+
+def contar_al_confirmar(nombre, cantidad=1):
+    """
+    Suma 'cantidad' al contador de negocio 'nombre' cuando la transacción en
+    curso se confirme; si se revierte, no se cuenta.
+    """
+    db.session.info.setdefault('metricas_pendientes', Counter())[nombre] += cantidad
+
+@event.listens_for(Session, 'after_commit')
+def _confirmar_metricas_pendientes(sesion):
+    for nombre, cantidad in sesion.info.pop('metricas_pendientes', {}).items():
+        metricas.incrementar(nombre, cantidad)
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_metricas_pendientes(sesion):
+    sesion.info.pop('metricas_pendientes', None)
+
+# --- FIN: Métricas en formato Prometheus ---
+
+
+# --- INICIO: Instrumentación de rendimiento por request ---
+
+def percentil(muestras, q):
+    """Devuelve el percentil 'q' (0-100) de una lista de muestras."""
+    ordenadas = sorted(muestras)
+    indice = round(q / 100 * (len(ordenadas) - 1))
+    return ordenadas[indice]
+
+class RegistroRendimiento:
+    """
+    Buffer circular (en memoria del proceso) con las mediciones de las últimas
+    requests: consultas SQL, tiempo en SQL, consulta más lenta, tiempo de
+    render de plantillas y tiempo total. Al llenarse descarta las más viejas.
+    """
+    def __init__(self, capacidad):
+        self._muestras = deque(maxlen=capacidad)
+        self._lock = threading.Lock()
+
+    def registrar(self, muestra):
+        with self._lock:
+            self._muestras.append(muestra)
+
+    def muestras(self):
+        """Devuelve las mediciones guardadas, de la más reciente a la más vieja."""
+        with self._lock:
+            return list(reversed(self._muestras))
+
+    def resumen_por_ruta(self):
+        """Agrega las mediciones por endpoint, de la ruta más lenta (p95) a la más rápida."""
+        por_ruta = defaultdict(list)
+        for muestra in self.muestras():
+            por_ruta[muestra['endpoint']].append(muestra)
+
+        resumen = []
+        for endpoint, muestras in por_ruta.items():
+            totales = [m['total_ms'] for m in muestras]
+            resumen.append({
+                'endpoint': endpoint,
+                'requests': len(muestras),
+                'total_p50_ms': round(percentil(totales, 50), 2),
+                'total_p95_ms': round(percentil(totales, 95), 2),
+                'total_max_ms': round(max(totales), 2),
+                'consultas_promedio': round(sum(m['consultas'] for m in muestras) / len(muestras), 1),
+                'consultas_max': max(m['consultas'] for m in muestras),
+                'sql_promedio_ms': round(sum(m['sql_ms'] for m in muestras) / len(muestras), 2),
+                'render_promedio_ms': round(sum(m['render_ms'] for m in muestras) / len(muestras), 2),
+            })
+        resumen.sort(key=lambda fila: fila['total_p95_ms'], reverse=True)
+        return resumen
+
+registro_rendimiento = RegistroRendimiento(app.config['RENDIMIENTO_MUESTRAS'])
+
+def _medicion_actual():
+    """Medición de la request en curso (None fuera de una request o en estáticos)."""
+    return g.get('_rendimiento') if has_request_context() else None
+
+# Los listeners van sobre la clase Engine: cubren el motor de la app sin
+# necesitar un contexto de aplicación al importar el módulo.
+@event.listens_for(Engine, 'before_cursor_execute')
+def _antes_de_consulta(conexion, cursor, sentencia, parametros, contexto, executemany):
+    conexion.info.setdefault('_inicios_consulta', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'handle_error')
+def _al_fallar_consulta(contexto_error):
+    # La sentencia falló: no habrá after_cursor_execute que retire su inicio
+    if contexto_error.connection is not None:
+        inicios = contexto_error.connection.info.get('_inicios_consulta')
+        if inicios:
+            inicios.pop()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _despues_de_consulta(conexion, cursor, sentencia, parametros, contexto, executemany):
+    duracion = (time.perf_counter() - conexion.info['_inicios_consulta'].pop()) * 1000
+
+    if duracion > app.config['CONSULTA_LENTA_MS']:
+        app.logger.warning(f"Consulta lenta ({duracion:.1f}ms): {sentencia}")
+
+    medicion = _medicion_actual()
+    if medicion is not None:
+        medicion['consultas'] += 1
+        medicion['sql_ms'] += duracion
+        if duracion > medicion['consulta_mas_lenta_ms']:
+            medicion['consulta_mas_lenta_ms'] = duracion
+            medicion['consulta_mas_lenta'] = sentencia
+
+def _al_iniciar_request(emisor, **extra):
+    if request.endpoint == 'static':
+        return
+    g._rendimiento = {
+        'inicio': time.perf_counter(), 'consultas': 0, 'sql_ms': 0.0,
+        'consulta_mas_lenta': None, 'consulta_mas_lenta_ms': 0.0,
+        'render_ms': 0.0, 'inicio_render': None,
+    }
+
+def _antes_de_renderizar(emisor, template, context, **extra):
+    medicion = _medicion_actual()
+    if medicion is not None:
+        medicion['inicio_render'] = time.perf_counter()
+
+def _al_renderizar(emisor, template, context, **extra):
+    medicion = _medicion_actual()
+    if medicion is not None and medicion['inicio_render'] is not None:
+        medicion['render_ms'] += (time.perf_counter() - medicion['inicio_render']) * 1000
+        medicion['inicio_render'] = None
+
+def _al_terminar_request(emisor, response, **extra):
+    medicion = g.pop('_rendimiento', None)
+    if medicion is None:
+        return
+    duracion = time.perf_counter() - medicion['inicio']
+    metricas.observar_request(request.endpoint or '(sin ruta)', request.method, response.status_code, duracion)
+    registro_rendimiento.registrar({
+        'momento': datetime.now().isoformat(timespec='seconds'),
+        'metodo': request.method,
+        'ruta': request.path,
+        'endpoint': request.endpoint or '(sin ruta)',
+        'estado': response.status_code,
+        'total_ms': round(duracion * 1000, 2),
+        'consultas': medicion['consultas'],
+        'sql_ms': round(medicion['sql_ms'], 2),
+        'render_ms': round(medicion['render_ms'], 2),
+        'consulta_mas_lenta_ms': round(medicion['consulta_mas_lenta_ms'], 2),
+        'consulta_mas_lenta': medicion['consulta_mas_lenta'],
+    })
+
+request_started.connect(_al_iniciar_request, app)
+before_render_template.connect(_antes_de_renderizar, app)
+template_rendered.connect(_al_renderizar, app)
+request_finished.connect(_al_terminar_request, app)
+
+# --- FIN: Instrumentación de rendimiento por request ---
+
+
+# --- INICIO: Verificación de contraseñas y límite de intentos de login ---
+
+class LimitadorIntentos:
+    """
+    Balde de tokens por clave (ej: una IP o un nombre de usuario), en memoria
+    del proceso. Cada clave arranca con 'capacidad' intentos y los recupera
+    de a poco, a razón de 'capacidad' cada 'periodo' segundos. Guarda hasta
+    'max_claves' claves; cuando se llena descarta las usadas hace más tiempo.
+    """
+    def __init__(self, capacidad, periodo, max_claves=100000):
+        self.capacidad = capacidad
+        self._recarga = capacidad / periodo # Intentos recuperados por segundo
+        self._max_claves = max_claves
+        self._baldes = OrderedDict() # clave -> (intentos disponibles, momento)
+        self._lock = threading.Lock()
+
+    def consumir(self, clave):
+        """Descuenta un intento de 'clave'. Devuelve False si ya no le quedaban."""
+        ahora = time.monotonic()
+        with self._lock:
+            disponibles, momento = self._baldes.pop(clave, (self.capacidad, ahora))
+            disponibles = min(self.capacidad, disponibles + (ahora - momento) * self._recarga)
+            permitido = disponibles >= 1
+            self._baldes[clave] = (disponibles - 1 if permitido else disponibles, ahora)
+            if len(self._baldes) > self._max_claves:
+                self._baldes.popitem(last=False)
+            return permitido
+
+    def reiniciar(self, clave):
+        with self._lock:
+            self._baldes.pop(clave, None)
+
+class VerificadorContrasenas:
+    """
+    Verifica hashes de contraseñas en un pool de procesos, fuera del worker:
+    el cálculo (lento a propósito) no compite por el GIL con las demás
+    requests y su uso de CPU queda acotado a 'procesos'. Admite hasta
+    'max_pendientes' verificaciones en curso o en espera; las que excedan se
+    rechazan de inmediato (contrapresión) en vez de encolarse sin límite.
+    Con procesos=0 verifica en el mismo hilo (desarrollo y tests).
+    """
+    def __init__(self, procesos, max_pendientes, timeout):
+        self.procesos = procesos
+        self.timeout = timeout
+        self._cupos = threading.BoundedSemaphore(max_pendientes)
+        self._pool = None
+        self._pid_pool = None
+        self._lock = threading.Lock()
+
+    def _obtener_pool(self):
+        # Un pool por proceso: los workers de gunicorn se crean con fork y no
+        # pueden usar el pool del proceso padre. 'spawn' arranca procesos
+        # limpios, sin heredar conexiones a la DB ni hilos del worker.
+        with self._lock:
+            if self._pid_pool != os.getpid():
+                self._pool = ProcessPoolExecutor(self.procesos, mp_context=multiprocessing.get_context('spawn'))
+                self._pid_pool = os.getpid()
+            return self._pool
+
+    def verificar(self, contrasena_hash, contrasena):
+        """
+        Devuelve True o False según la contraseña coincida con el hash, o None
+        si no hay cupo para verificarla ahora o no terminó dentro de 'timeout'.
+        """
+        if not self._cupos.acquire(blocking=False):
+            return None
+        if not self.procesos:
+            try:
+                return check_password_hash(contrasena_hash, contrasena)
+            finally:
+                self._cupos.release()
+
+        try:
+            futuro = self._obtener_pool().submit(check_password_hash, contrasena_hash, contrasena)
+        except BrokenProcessPool:
+            self._cupos.release()
+            with self._lock:
+                self._pid_pool = None # Se recrea en el próximo intento
+            app.logger.error("El pool de verificación de contraseñas se rompió; se recreará.")
+            return None
+        # El cupo se libera cuando el proceso termina, aunque la request ya no espere
+        futuro.add_done_callback(lambda _: self._cupos.release())
+        try:
+            return futuro.result(timeout=self.timeout)
+        except FuturesTimeoutError:
+            return None
+        except BrokenProcessPool:
+            with self._lock:
+                self._pid_pool = None
+            app.logger.error("El pool de verificación de contraseñas se rompió; se recreará.")
+            return None
+
+    def generar(self, contrasena, metodo):
+        """
+        Calcula un hash nuevo en el pool. No usa los cupos del login: sólo lo
+        llama la actualización de hashes, de a uno por worker.
+        """
+        if not self.procesos:
+            return generate_password_hash(contrasena, method=metodo)
+        return self._obtener_pool().submit(generate_password_hash, contrasena, method=metodo).result()
+
+verificador_contrasenas = VerificadorContrasenas(
+    app.config['LOGIN_PROCESOS_HASH'], app.config['LOGIN_MAX_PENDIENTES'], app.config['LOGIN_TIMEOUT_S'])
+limite_login_ip = LimitadorIntentos(*app.config['LOGIN_INTENTOS_IP'])
+limite_login_usuario = LimitadorIntentos(*app.config['LOGIN_INTENTOS_USUARIO'])
+
+# Nombres de usuario que no existen, para no consultar la DB con cada
+# intento de un ataque con nombres inventados. Compartida entre workers si hay
+# REDIS_URL; las altas de cuentas borran su clave.
+cache_login_inexistentes = crear_backend_cache()
+
+MENSAJES_LOGIN = {
+    'limite': 'Demasiados intentos de inicio de sesión. Espera un minuto y vuelve a intentarlo.',
+    'ocupado': 'El servidor está ocupado. Vuelve a intentarlo en unos segundos.',
+    'invalido': 'Nombre de usuario o contraseña incorrectos.',
+}
+
+def clave_login(modelo, nombre_usuario):
+    """Clave de un nombre de usuario en los límites y en la caché de inexistentes."""
+    return f'login:{modelo.__tablename__}:{nombre_usuario}'
+
+def autenticar(modelo, nombre_usuario, contrasena):
+    """
+    Valida un login contra 'modelo' (Usuario o Administrador), en este orden:
+    1. Límite de intentos por IP y por nombre de usuario (sin tocar la DB).
+    2. Caché de nombres inexistentes; si no está, busca la cuenta.
+    3. Verificación del hash en el pool de procesos.
+    Devuelve (cuenta, None) si las credenciales son correctas, o (None, motivo)
+    con motivo 'limite', 'ocupado' o 'invalido' (ver MENSAJES_LOGIN).
+    """
+    clave = clave_login(modelo, nombre_usuario)
+    if not limite_login_ip.consumir(request.remote_addr or '-') or not limite_login_usuario.consumir(clave):
+        metricas.incrementar('logins_limitados')
+        return None, 'limite'
+
+    if cache_login_inexistentes.get(clave):
+        return None, 'invalido'
+    cuenta = modelo.query.filter_by(nombre_usuario=nombre_usuario).first()
+    # Se devuelve la conexión al pool antes de esperar el hash: un login no
+    # debe retener una conexión de la DB que necesitan las reservas.
+    # (close no expira la cuenta: sus atributos ya cargados siguen disponibles)
+    db.session.close()
+    if cuenta is None:
+        cache_login_inexistentes.set(clave, True, app.config['LOGIN_INEXISTENTES_TTL'])
+        return None, 'invalido'
+
+    coincide = verificador_contrasenas.verificar(cuenta.contrasena_hash, contrasena)
+    if coincide is None:
+        metricas.incrementar('logins_rechazados_ocupado')
+        return None, 'ocupado'
+    if not coincide:
+        return None, 'invalido'
+    limite_login_usuario.reiniciar(clave)
+    if cuenta.necesita_rehash():
+        programar_rehash(modelo, cuenta.id, cuenta.contrasena_hash, contrasena)
+    return cuenta, None
+
+# --- Actualización de hashes a la política vigente ---
+
+@lru_cache(maxsize=None)
+def prefijo_hash_vigente(metodo):
+    """
+    Método y parámetros tal como werkzeug los guarda al hashear con 'metodo'
+    (ej: 'pbkdf2:sha256' -> 'pbkdf2:sha256:1000000'). Se calcula una vez por proceso.
+    """
+    return generate_password_hash('', method=metodo).split('$', 1)[0]
+
+def hash_desactualizado(contrasena_hash):
+    """True si 'contrasena_hash' no fue generado con METODO_HASH_CONTRASENAS."""
+    return contrasena_hash.split('$', 1)[0] != prefijo_hash_vigente(app.config['METODO_HASH_CONTRASENAS'])
+
+# Un solo hilo por worker: los hashes se actualizan de a uno, sin competir con los logins
+ejecutor_rehash = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rehash')
+_rehash_pendientes = set() # (tabla, id) encolados en este worker
+_lock_rehash = threading.Lock()
+
+def programar_rehash(modelo, cuenta_id, hash_actual, contrasena):
+    """
+    Encola el recálculo del hash de una cuenta con la política vigente, para
+    después de responder el login. Si la cola está llena no hace nada: se
+    reintenta en el próximo login. Devuelve True si lo encoló.
+    """
+    clave = (modelo.__tablename__, cuenta_id)
+    with _lock_rehash:
+        if clave in _rehash_pendientes or len(_rehash_pendientes) >= app.config['REHASH_MAX_PENDIENTES']:
+            return False
+        _rehash_pendientes.add(clave)
+    ejecutor_rehash.submit(_rehashear, modelo, cuenta_id, hash_actual, contrasena, clave)
+    return True
+
+def _rehashear(modelo, cuenta_id, hash_actual, contrasena, clave):
+    try:
+        nuevo_hash = verificador_contrasenas.generar(contrasena, app.config['METODO_HASH_CONTRASENAS'])
+        with app.app_context():
+            # UPDATE condicional: si la contraseña cambió mientras tanto, no se pisa
+            db.session.execute(update(modelo).where(modelo.id == cuenta_id, modelo.contrasena_hash == hash_actual)
+                               .values(contrasena_hash=nuevo_hash))
+            db.session.commit()
+    except Exception as e:
+        app.logger.error(f"No se pudo actualizar el hash de {clave[0]} {cuenta_id}: {e}")
+    finally:
+        with _lock_rehash:
+            _rehash_pendientes.discard(clave)
+
+def rehash_pendientes():
+    with _lock_rehash:
+        return len(_rehash_pendientes)
+
+def describir_metodo_hash(metodo):
+    """Costo legible de un método de werkzeug (ej: 'scrypt:32768:8:1' -> 'N=32768, r=8, p=1')."""
+    partes = metodo.split(':')
+    if partes[0] == 'scrypt' and len(partes) == 4:
+        return f"N={partes[1]}, r={partes[2]}, p={partes[3]}"
+    if partes[0] == 'pbkdf2' and len(partes) == 3:
+        return f"{int(partes[2]):,} iteraciones ({partes[1]})".replace(',', '.')
+    return 'desconocido'
+
+def estadisticas_hashes():
+    """
+    Cantidad de cuentas de 'usuarios' y 'administradores' por método de hash
+    (la parte del hash antes del primer '$'), con una consulta por tabla.
+    """
+    vigente = prefijo_hash_vigente(app.config['METODO_HASH_CONTRASENAS'])
+    filas = []
+    for modelo in (Usuario, Administrador):
+        columna = modelo.contrasena_hash
+        if db.engine.dialect.name == 'mysql':
+            metodo = func.substring_index(columna, '$', 1)
+        else:
+            metodo = func.substr(columna, 1, func.instr(columna, '$') - 1)
+        consulta = db.session.query(metodo, func.count()).group_by(metodo).order_by(func.count().desc())
+        for valor, cantidad in consulta:
+            filas.append({'tabla': modelo.__tablename__, 'metodo': valor, 'costo': describir_metodo_hash(valor),
+                          'cantidad': cantidad, 'vigente': valor == vigente})
+    return filas
+
+# --- FIN: Verificación de contraseñas y límite de intentos de login ---
+
+
+# --- INICIO: Claves de idempotencia (envíos repetidos de reservas) ---
+
+# Resultados recientes por clave. Sin REDIS_URL cada worker recuerda sólo sus
+# claves; un repetido que cae en otro worker igual choca con el índice único de
+# 'reservas' (responde "turno ocupado" en vez del resultado original).
+almacen_idempotencia = crear_backend_cache(max_claves=app.config['IDEMPOTENCIA_MAX_CLAVES'])
+
+LARGO_MAX_CLAVE_IDEMPOTENCIA = 255
+
+def huella_pedido(datos):
+    """Hash de los datos de un pedido, para detectar una clave reusada con otros datos."""
+    return hashlib.sha256(json.dumps(datos, sort_keys=True).encode()).hexdigest()
+
+def ejecutar_idempotente(alcance, clave, datos, operacion):
+    """
+    Ejecuta 'operacion' (sin argumentos, devuelve un resultado serializable en
+    JSON con 'estado') una sola vez por 'clave' dentro de 'alcance' (ej: el
+    usuario). Un envío repetido con la misma clave y los mismos datos recibe el
+    resultado guardado sin volver a ejecutarla; si el original sigue en curso,
+    lo espera. Si 'operacion' lanza una excepción la clave se libera, así el
+    reintento vuelve a ejecutarla.
+    Devuelve (resultado, repetido). Sin clave, sólo ejecuta la operación.
+    """
+    if not clave:
+        return operacion(), False
+    if len(clave) > LARGO_MAX_CLAVE_IDEMPOTENCIA:
+        return {'estado': 400, 'error': 'Clave de idempotencia inválida.'}, False
+
+    clave_almacen = f'idempotencia:{alcance}:{clave}'
+    huella = huella_pedido(datos)
+    limite = time.monotonic() + app.config['IDEMPOTENCIA_ESPERA_S']
+    # La clave se toma con un "agregar si no existe", atómico también en Redis:
+    # de dos envíos simultáneos, sólo uno ejecuta la operación
+    while not almacen_idempotencia.agregar(clave_almacen, {'huella': huella}, app.config['IDEMPOTENCIA_EN_CURSO_TTL']):
+        guardado = almacen_idempotencia.get(clave_almacen)
+        if guardado is None:
+            continue # Venció o se liberó entre las dos llamadas: se vuelve a intentar tomarla
+        if guardado['huella'] != huella:
+            return {'estado': 422, 'error': 'La clave de idempotencia ya se usó con otros datos.'}, False
+        if 'resultado' in guardado:
+            metricas.incrementar('reservas_repetidas')
+            return guardado['resultado'], True
+        if time.monotonic() >= limite:
+            return {'estado': 409, 'error': 'El envío original todavía se está procesando. Vuelve a intentarlo.'}, False
+        time.sleep(0.05)
+
+    try:
+        resultado = operacion()
+    except Exception:
+        almacen_idempotencia.delete(clave_almacen)
+        raise
+    almacen_idempotencia.set(clave_almacen, {'huella': huella, 'resultado': resultado}, app.config['IDEMPOTENCIA_TTL'])
+    return resultado, False
+
+# --- FIN: Claves de idempotencia ---
+
+
 # --- INICIO: Rutas de la Aplicación ---
 
 # --- Funciones Helper ---
@@ -137,15 +1719,269 @@ def verificar_admin():
         flash('Acceso denegado. Por favor, inicia sesión como administrador.', 'error')
         return redirect(url_for('iniciar_sesion_administrador'))
     
-    # Verifica que el ID de admin en la sesión exista en la DB
-    admin = Administrador.query.get(session.get('user_id'))
-    if not admin:
+    # Verifica la época de la sesión (firmada) y que el admin siga existiendo.
+    # Los ids válidos salen de una caché por proceso, no de una consulta por request.
+    ids_validos = cache_admins.obtener(
+        'ids', lambda: frozenset(i for (i,) in db.session.query(Administrador.id)))
+    if session.get('admin_epoca') != app.config['ADMIN_EPOCA'] or session.get('user_id') not in ids_validos:
         flash('Sesión de administrador no válida.', 'error')
         session.clear()
         return redirect(url_for('iniciar_sesion_administrador'))
         
     return None # Si todo está OK, no retorna nada
 
+def parsear_turno(fecha_str, hora_inicio_str):
+    """
+    Convierte la fecha ('YYYY-MM-DD') y la hora de inicio ('HH:MM') recibidas a
+    tipos nativos y calcula la hora de fin (los turnos son de 1 hora).
+    Lanza ValueError si el formato es inválido o la hora no es un turno operativo.
+    """
+    fecha = datetime.strptime(fecha_str, '%Y-%m-%d').date()
+    hora_inicio = datetime.strptime(hora_inicio_str, '%H:%M').time()
+    if hora_inicio.minute != 0 or not HORA_APERTURA <= hora_inicio.hour < HORA_CIERRE:
+        raise ValueError(f'El turno debe comenzar en punto, entre las {HORA_APERTURA}:00 y las {HORA_CIERRE - 1}:00.')
+    hora_fin = (datetime.combine(fecha, hora_inicio) + timedelta(hours=1)).time()
+    return fecha, hora_inicio, hora_fin
+
+@contextmanager
+def cronometro(tiempos, nombre):
+    """Mide lo que tarda el bloque 'with' y lo guarda en tiempos[nombre] (ms)."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        tiempos[nombre] = (time.perf_counter() - inicio) * 1000
+
+@contextmanager
+def contar_consultas():
+    """
+    Cuenta las sentencias SQL que ejecuta este hilo dentro del bloque 'with'.
+    Devuelve un dict que se completa al ejecutar: {'total': n, 'sentencias': [...]}.
+    """
+    contador = {'total': 0, 'sentencias': []}
+    hilo = threading.get_ident()
+
+    def al_ejecutar(conexion, cursor, sentencia, parametros, contexto, executemany):
+        if threading.get_ident() == hilo:
+            contador['total'] += 1
+            contador['sentencias'].append(sentencia)
+
+    motor = db.engine
+    event.listen(motor, 'before_cursor_execute', al_ejecutar)
+    try:
+        yield contador
+    finally:
+        event.remove(motor, 'before_cursor_execute', al_ejecutar)
+
+class PresupuestoConsultasExcedido(AssertionError):
+    """Una ruta o bloque hizo más consultas SQL que su presupuesto declarado."""
+
+@contextmanager
+def limitar_consultas(maximo, nombre='bloque'):
+    """
+    Como contar_consultas, pero al salir lanza PresupuestoConsultasExcedido si
+    el bloque hizo más de 'maximo' consultas (el mensaje lista las sentencias).
+    """
+    with contar_consultas() as contador:
+        yield contador
+    if contador['total'] > maximo:
+        sentencias = '\n'.join(f"  {i}. {sentencia}" for i, sentencia in enumerate(contador['sentencias'], 1))
+        raise PresupuestoConsultasExcedido(
+            f"{nombre}: {contador['total']} consultas SQL (presupuesto: {maximo})\n{sentencias}")
+
+def presupuesto_consultas(maximo):
+    """
+    Decorador de rutas: declara cuántas consultas SQL puede hacer la ruta como
+    máximo (con las cachés frías, plantilla incluida). Sólo se controla con
+    VERIFICAR_PRESUPUESTO_CONSULTAS activo; en producción no agrega costo.
+    """
+    def decorador(vista):
+        @wraps(vista)
+        def envoltura(*args, **kwargs):
+            if not app.config['VERIFICAR_PRESUPUESTO_CONSULTAS']:
+                return vista(*args, **kwargs)
+            with limitar_consultas(maximo, request.endpoint):
+                return vista(*args, **kwargs)
+        envoltura.presupuesto_consultas = maximo
+        return envoltura
+    return decorador
+
+def registrar_tiempos(ruta, tiempos):
+    """
+    Registra en el log los tiempos parciales de una ruta, como advertencia si
+    el total supera REPORTES_UMBRAL_MS, para detectar regresiones.
+    """
+    total = sum(tiempos.values())
+    detalle = ', '.join(f"{nombre}={ms:.1f}ms" for nombre, ms in tiempos.items())
+    nivel = logging.WARNING if total > app.config['REPORTES_UMBRAL_MS'] else logging.INFO
+    app.logger.log(nivel, f"{ruta}: total={total:.1f}ms ({detalle})")
+
+def formatear_hora(hora):
+    """Formatea una hora (time) como 'HH:MM' para las plantillas y el JSON."""
+    return hora.strftime('%H:%M')
+
+def insertar_reserva(usuario_id, cancha_id, fecha, hora_inicio, hora_fin, monto):
+    """
+    Inserta una reserva activa con un único INSERT, sin consultar antes.
+    La exclusión la garantiza el índice único 'uq_reservas_turno_activo', por lo
+    que dos workers concurrentes nunca pueden reservar el mismo turno.
+    También suma la reserva al resumen diario y marca el cambio de versión de
+    la fecha, en la misma transacción.
+    Devuelve el id de la nueva reserva, o None si el turno ya estaba ocupado
+    (en ese caso la sesión queda revertida). No hace commit.
+    """
+    try:
+        resultado = db.session.execute(insert(Reserva).values(
+            usuario_id=usuario_id,
+            cancha_id=cancha_id,
+            fecha=fecha,
+            hora_inicio=hora_inicio,
+            hora_fin=hora_fin,
+            monto=monto,
+            estado='activa'
+        ))
+    except IntegrityError as e:
+        db.session.rollback()
+        # MySQL informa el nombre del índice; SQLite, las columnas involucradas
+        mensaje = str(e.orig)
+        if 'uq_reservas_turno_activo' in mensaje or 'reservas.turno_activo' in mensaje:
+            metricas.incrementar('reservas_conflictos')
+            return None
+        raise
+    acumular_resumen(fecha, cancha_id, ingresos=monto, reservas_activas=1)
+    marcar_cambio(f'reservas:{fecha.isoformat()}')
+    contar_al_confirmar('reservas_creadas')
+    avisar_turno('ocupado', cancha_id, fecha, hora_inicio)
+    return resultado.inserted_primary_key[0]
+
+def cancelar_reserva(reserva):
+    """
+    Pasa una reserva de 'activa' a 'cancelada' y descuenta su monto del resumen
+    diario. El UPDATE es condicional, así dos cancelaciones simultáneas de la
+    misma reserva no la descuentan dos veces.
+    Devuelve False si la reserva ya no estaba activa. No hace commit.
+    """
+    resultado = db.session.execute(
+        update(Reserva).where(Reserva.id == reserva.id, Reserva.estado == 'activa').values(estado='cancelada')
+    )
+    if resultado.rowcount == 0:
+        return False
+    acumular_resumen(reserva.fecha, reserva.cancha_id, ingresos=-reserva.monto,
+                     reservas_activas=-1, reservas_canceladas=1)
+    marcar_cambio(f'reservas:{reserva.fecha.isoformat()}')
+    contar_al_confirmar('reservas_canceladas')
+    avisar_turno('liberado', reserva.cancha_id, reserva.fecha, reserva.hora_inicio)
+    return True
+
+def reserva_a_json(reserva_id, cancha, fecha, hora_inicio, hora_fin, monto, estado):
+    """Datos de una reserva para las respuestas de /api/reservas ('cancha' es un CanchaInfo)."""
+    return {
+        'id': reserva_id,
+        'cancha_id': cancha.id,
+        'cancha_nombre': cancha.nombre,
+        'fecha': fecha.isoformat(),
+        'hora_inicio': formatear_hora(hora_inicio),
+        'hora_fin': formatear_hora(hora_fin),
+        'monto': monto,
+        'estado': estado,
+    }
+
+def reservar_turnos_usuario(usuario_id, pedidos):
+    """
+    Reserva uno o más turnos para el usuario en una sola transacción: o se
+    reservan todos, o ninguno. 'pedidos' es una lista de (cancha, fecha, hora_inicio)
+    tal como llegan (texto). La usan el formulario y la API, a través de
+    ejecutar_idempotente.
+    Devuelve un resultado serializable: {'estado': 201, 'reservas': [...]} o
+    {'estado': 400/404/409, 'error': mensaje}; en un lote, el error indica
+    además la posición del pedido que falló ('indice').
+    """
+    def error(estado, mensaje, indice):
+        resultado = {'estado': estado, 'error': mensaje}
+        if len(pedidos) > 1:
+            resultado['indice'] = indice
+        return resultado
+
+    # 1. Validar todos los pedidos antes de escribir nada. Se verifica la
+    # versión del catálogo (una vez por lote): se cobra siempre el precio vigente
+    canchas = {cancha.id: cancha for cancha in catalogo_canchas.todas(verificar=True)}
+    turnos = []
+    for indice, (cancha, fecha_str, hora_inicio_str) in enumerate(pedidos):
+        # Sólo enteros (no bool, que en Python es un int) o texto con dígitos: int()
+        # aceptaría también true o 2.9 del JSON y reservaría otra cancha
+        if isinstance(cancha, int) and not isinstance(cancha, bool):
+            cancha_id = cancha
+        elif isinstance(cancha, str) and cancha.isascii() and cancha.isdigit():
+            cancha_id = int(cancha)
+        else:
+            return error(400, 'Cancha inválida.', indice)
+        try:
+            fecha, hora_inicio, hora_fin = parsear_turno(fecha_str, hora_inicio_str)
+        except ValueError as e:
+            return error(400, f'Turno inválido: {e}', indice)
+        if cancha_id not in canchas:
+            return error(404, 'Cancha no encontrada.', indice)
+        turnos.append((canchas[cancha_id], fecha, hora_inicio, hora_fin))
+
+    # 2. Un INSERT atómico por turno: si otro usuario tomó alguno (aunque sea en
+    # el mismo instante, o el mismo turno se repite en el lote), el índice único
+    # de la DB rechaza el duplicado y se revierte todo el lote
+    reservas = []
+    for indice, (cancha, fecha, hora_inicio, hora_fin) in enumerate(turnos):
+        nueva_reserva_id = insertar_reserva(usuario_id, cancha.id, fecha, hora_inicio, hora_fin, cancha.monto)
+        if nueva_reserva_id is None:
+            ocupacion_turnos.invalidar(fecha) # Nuestra copia en memoria estaba desactualizada
+            return error(409, 'Lo sentimos, el turno seleccionado ya ha sido reservado.', indice)
+        reservas.append(reserva_a_json(nueva_reserva_id, cancha, fecha, hora_inicio, hora_fin, cancha.monto, 'activa'))
+
+    versiones = versiones_de_cambios([fecha for _, fecha, _, _ in turnos])
+    db.session.commit()
+    for (cancha, fecha, hora_inicio, _), version in zip(turnos, versiones):
+        ocupacion_turnos.marcar(fecha, cancha.id, hora_inicio, version)
+    for fecha in {fecha for _, fecha, _, _ in turnos}:
+        invalidar_kpis_reserva(fecha)
+    return {'estado': 201, 'reservas': reservas}
+
+def consulta_reservas_activas(reservas_ids, usuario_id=None):
+    """Reservas activas (objetos Reserva) entre 'reservas_ids'; con 'usuario_id', sólo las de ese usuario."""
+    consulta = select(Reserva).where(Reserva.id.in_(reservas_ids), Reserva.estado == 'activa')
+    if usuario_id is not None:
+        consulta = consulta.where(Reserva.usuario_id == usuario_id)
+    return consulta
+
+def cancelar_turnos_usuario(usuario_id, reservas_ids):
+    """
+    Cancela una o más reservas activas del usuario en una sola transacción: si
+    alguna no existe, no es suya o ya estaba cancelada, no se cancela ninguna.
+    Devuelve {'estado': 200, 'reservas': [...]} o {'estado': 404, 'error': mensaje,
+    'ids': [ids que no se pudieron cancelar]}.
+    """
+    reservas_ids = list(dict.fromkeys(reservas_ids)) # Sin repetidos, en el orden pedido
+    encontradas = {reserva.id: reserva for reserva in
+                   db.session.execute(consulta_reservas_activas(reservas_ids, usuario_id)).scalars()}
+    faltantes = [reserva_id for reserva_id in reservas_ids if reserva_id not in encontradas]
+    if faltantes:
+        return {'estado': 404, 'error': 'No se pudo encontrar o cancelar el turno.', 'ids': faltantes}
+
+    # Se leen los datos antes del commit (el commit expira los objetos)
+    canceladas = [encontradas[reserva_id] for reserva_id in reservas_ids]
+    reservas = [reserva_a_json(r.id, catalogo_canchas.obtener(r.cancha_id), r.fecha, r.hora_inicio, r.hora_fin,
+                               r.monto, 'cancelada') for r in canceladas]
+    turnos = [(r.fecha, r.cancha_id, r.hora_inicio) for r in canceladas]
+    for reserva in canceladas:
+        # Otra request la canceló entre la consulta y el UPDATE
+        if not cancelar_reserva(reserva):
+            db.session.rollback()
+            return {'estado': 404, 'error': 'No se pudo encontrar o cancelar el turno.', 'ids': [reserva.id]}
+
+    versiones = versiones_de_cambios([fecha for fecha, _, _ in turnos])
+    db.session.commit()
+    for turno, version in zip(turnos, versiones):
+        ocupacion_turnos.liberar(*turno, version)
+    for fecha in {fecha for fecha, _, _ in turnos}:
+        invalidar_kpis_reserva(fecha)
+    return {'estado': 200, 'reservas': reservas}
+
 # --- Rutas de Autenticación y Públicas ---
 
 @app.route('/')
@@ -180,6 +2016,8 @@ def crear_administrador():
         try:
             db.session.add(nuevo_admin)
             db.session.commit()
+            cache_admins.invalidar('ids')
+            cache_login_inexistentes.delete(clave_login(Administrador, nombre_usuario))
             flash('Administrador creado exitosamente.', 'success')
             return redirect(url_for('iniciar_sesion_administrador'))
         except Exception as e:
@@ -225,6 +2063,8 @@ def crear_usuario():
         try:
             db.session.add(nuevo_usuario)
             db.session.commit()
+            cache_kpis.invalidar('total_usuarios')
+            cache_login_inexistentes.delete(clave_login(Usuario, nombre_usuario))
             
             # Autenticación automática post-registro
             session.permanent = True
@@ -267,11 +2107,10 @@ def iniciar_sesion_usuario():
         nombre_usuario = request.form['nombre_usuario']
         contrasena = request.form['contrasena']
         
-        # Buscar al usuario en la DB
-        user = Usuario.query.filter_by(nombre_usuario=nombre_usuario).first()
+        # Límite de intentos, búsqueda del usuario y verificación del hash (fuera del worker)
+        user, motivo = autenticar(Usuario, nombre_usuario, contrasena)
 
-        # Verificar la contraseña con el hash
-        if user and user.check_password(contrasena):
+        if user:
             session.permanent = True
             session['rol'] = 'usuario'
             session['user_id'] = user.id
@@ -281,7 +2120,7 @@ def iniciar_sesion_usuario():
             flash(f'¡Bienvenido, {user.nombre_usuario}!', 'success')
             return redirect(url_for('panel_usuario'))
         else:
-            flash('Nombre de usuario o contraseña incorrectos.', 'error')
+            flash(MENSAJES_LOGIN[motivo], 'error')
             return redirect(url_for('iniciar_sesion_usuario'))
             
     return render_template('iniciar_sesion_usuario.html')
@@ -297,19 +2136,19 @@ def iniciar_sesion_administrador():
         nombre_usuario = request.form['nombre_usuario']
         contrasena = request.form['contrasena']
         
-        # Buscar al admin en la DB
-        admin = Administrador.query.filter_by(nombre_usuario=nombre_usuario).first()
+        # Límite de intentos, búsqueda del admin y verificación del hash (fuera del worker)
+        admin, motivo = autenticar(Administrador, nombre_usuario, contrasena)
 
-        # Verificar la contraseña con el hash
-        if admin and admin.check_password(contrasena):
+        if admin:
             session.permanent = True
             session['rol'] = 'administrador'
             session['user_id'] = admin.id
+            session['admin_epoca'] = app.config['ADMIN_EPOCA']
             session['nombre_usuario'] = admin.nombre_usuario
             flash(f'¡Bienvenido, Administrador {admin.nombre_usuario}!', 'success')
             return redirect(url_for('panel_administrador'))
         else:
-            flash('Nombre de usuario o contraseña incorrectos.', 'error')
+            flash(MENSAJES_LOGIN[motivo], 'error')
             return redirect(url_for('iniciar_sesion_administrador'))
             
     return render_template('iniciar_sesion_administrador.html')
@@ -326,7 +2165,16 @@ def cerrar_sesion():
 
 # --- Rutas del Panel de Administrador ---
 
+def consulta_reservas_del_dia(fecha):
+    """Cantidad de reservas activas de una fecha (KPI del panel del admin)."""
+    return select(func.count(Reserva.id)).where(Reserva.fecha == fecha, Reserva.estado == 'activa')
+
+def consulta_ingresos_periodo(desde, hasta):
+    """Ingresos del resumen diario entre dos fechas (KPI del panel del admin)."""
+    return select(func.sum(ResumenDiario.ingresos)).where(ResumenDiario.fecha.between(desde, hasta))
+
 @app.route('/panel_administrador')
+@presupuesto_consultas(5)
 def panel_administrador():
     """
     RUTA: Dashboard principal del Administrador.
@@ -337,31 +2185,31 @@ def panel_administrador():
     error_redirect = verificar_admin()
     if error_redirect: return error_redirect
     
-    # 2. Calcular KPIs (consultas SQL de agregación)
-    total_canchas = db.session.query(func.count(Cancha.id)).scalar()
-    total_usuarios = db.session.query(func.count(Usuario.id)).scalar()
-    
-    hoy = datetime.now().strftime('%Y-%m-%d')
-    total_reservas_hoy = db.session.query(func.count(Reserva.id)).filter(
-        Reserva.fecha == hoy,
-        Reserva.estado == 'activa'
-    ).scalar()
+    # 2. Calcular KPIs (consultas SQL de agregación, servidas desde la caché)
+    hoy = datetime.now().date()
     
     # Calcular ingresos del mes actual
     mes_actual = datetime.now().month
     anio_actual = datetime.now().year
-    inicio_mes = f"{anio_actual}-{mes_actual:02d}-01"
+    inicio_mes = datetime(anio_actual, mes_actual, 1).date()
     
     if mes_actual == 12: # Manejo del fin de año
-        fin_mes = f"{anio_actual}-12-31"
+        fin_mes = datetime(anio_actual, 12, 31).date()
     else:
-        fin_mes_dt = datetime(anio_actual, mes_actual + 1, 1) - timedelta(days=1)
-        fin_mes = fin_mes_dt.strftime('%Y-%m-%d')
+        fin_mes = (datetime(anio_actual, mes_actual + 1, 1) - timedelta(days=1)).date()
 
-    ingresos_mensuales = db.session.query(func.sum(Reserva.monto)).filter(
-        Reserva.estado == 'activa',
-        Reserva.fecha.between(inicio_mes, fin_mes)
-    ).scalar() or 0.0 # 'or 0.0' para evitar que 'None' rompa la plantilla
+    def contar_reservas_hoy():
+        return db.session.execute(consulta_reservas_del_dia(hoy)).scalar()
+
+    def sumar_ingresos_mes():
+        return db.session.execute(consulta_ingresos_periodo(inicio_mes, fin_mes)).scalar() or 0.0 # 'or 0.0' para evitar que 'None' rompa la plantilla
+
+    total_canchas = cache_kpis.obtener(
+        'total_canchas', lambda: len(catalogo_canchas.todas()))
+    total_usuarios = cache_kpis.obtener(
+        'total_usuarios', lambda: db.session.query(func.count(Usuario.id)).scalar())
+    total_reservas_hoy = cache_kpis.obtener(f'reservas_dia:{hoy.isoformat()}', contar_reservas_hoy)
+    ingresos_mensuales = cache_kpis.obtener(f'ingresos_mes:{inicio_mes:%Y-%m}', sumar_ingresos_mes)
 
     # 3. Renderizar plantilla con los datos
     return render_template(
@@ -374,6 +2222,7 @@ def panel_administrador():
     )
 
 @app.route('/gestionar_canchas')
+@presupuesto_consultas(2)
 def gestionar_canchas():
     """
     RUTA: Ver lista de canchas (Admin).
@@ -383,10 +2232,11 @@ def gestionar_canchas():
     error_redirect = verificar_admin()
     if error_redirect: return error_redirect
     
-    canchas = Cancha.query.all()
+    canchas = catalogo_canchas.todas()
     return render_template('gestionar_canchas.html', canchas=canchas)
 
 @app.route('/agregar_cancha', methods=['GET', 'POST'])
+@presupuesto_consultas(3)
 def agregar_cancha():
     """
     RUTA: Añadir una nueva cancha (Admin).
@@ -420,7 +2270,11 @@ def agregar_cancha():
             nombre=nombre, tipo=tipo, condicion=condicion, monto=monto
         )
         db.session.add(nueva_cancha)
+        marcar_cambio('canchas')
+        publicar_al_confirmar(CANAL_TODAS, {'tipo': 'recargar'})
         db.session.commit()
+        catalogo_canchas.invalidar()
+        cache_kpis.invalidar('total_canchas')
         
         flash('Cancha agregada exitosamente.', 'success')
         return redirect(url_for('gestionar_canchas'))
@@ -467,14 +2321,21 @@ def editar_cancha(cancha_id):
         cancha_a_editar.tipo = nuevo_tipo
         cancha_a_editar.condicion = nueva_condicion
         cancha_a_editar.monto = nuevo_monto
+        marcar_cambio('canchas')
+        publicar_al_confirmar(CANAL_TODAS, {'tipo': 'recargar'})
         
         db.session.commit()
+        catalogo_canchas.invalidar()
         flash('Cancha actualizada exitosamente.', 'success')
         return redirect(url_for('gestionar_canchas'))
     
     # Muestra el formulario con los datos precargados
     return render_template('editar_cancha.html', cancha=cancha_a_editar)
 
+def consulta_reservas_de_cancha(cancha_id):
+    """Alguna reserva (de cualquier estado) de la cancha: si existe, la cancha no se puede eliminar."""
+    return select(Reserva.id).where(Reserva.cancha_id == cancha_id).limit(1)
+
 @app.route('/eliminar_cancha/<int:cancha_id>')
 def eliminar_cancha(cancha_id):
     """
@@ -489,14 +2350,18 @@ def eliminar_cancha(cancha_id):
     
     try:
         # Validación de integridad: No eliminar canchas con historial de reservas
-        reservas_asociadas = Reserva.query.filter_by(cancha_id=cancha_id).first()
+        reservas_asociadas = db.session.execute(consulta_reservas_de_cancha(cancha_id)).first()
         if reservas_asociadas:
             flash('Error: No se puede eliminar la cancha porque tiene reservas asociadas.', 'error')
             return redirect(url_for('gestionar_canchas'))
 
         # Si no hay reservas, se elimina
         db.session.delete(cancha_a_eliminar)
+        marcar_cambio('canchas')
+        publicar_al_confirmar(CANAL_TODAS, {'tipo': 'recargar'})
         db.session.commit()
+        catalogo_canchas.invalidar()
+        cache_kpis.invalidar('total_canchas')
         flash('Cancha eliminada exitosamente.', 'success')
     except Exception as e:
         db.session.rollback()
@@ -504,45 +2369,140 @@ def eliminar_cancha(cancha_id):
         
     return redirect(url_for('gestionar_canchas'))
 
+# --- Listados de turnos del admin (paginación por cursor) ---
+
+# Orden de cada listado como (columna, descendente). El id desempata, así el
+# cursor (fecha, hora_inicio, id) identifica una única posición en el listado.
+ORDEN_LISTADOS_TURNOS = {
+    'activa': ((Reserva.fecha, True), (Reserva.hora_inicio, True), (Reserva.id, True)),
+    # Cancelados: días más recientes primero, pero horas más tempranas primero dentro del día
+    'cancelada': ((Reserva.fecha, True), (Reserva.hora_inicio, False), (Reserva.id, False)),
+}
+
+def codificar_cursor(fecha, hora_inicio, reserva_id):
+    """Arma el cursor 'YYYY-MM-DD,HH:MM,id' que apunta a la última fila entregada."""
+    return f"{fecha.isoformat()},{formatear_hora(hora_inicio)},{reserva_id}"
+
+def decodificar_cursor(cursor):
+    """Inversa de codificar_cursor. Lanza ValueError si el cursor es inválido."""
+    fecha_str, hora_str, reserva_id = cursor.split(',')
+    return (datetime.strptime(fecha_str, '%Y-%m-%d').date(),
+            datetime.strptime(hora_str, '%H:%M').time(),
+            int(reserva_id))
+
+def condicion_despues_de(orden, valores):
+    """
+    Condición SQL "fila posterior al cursor" para un orden de varias columnas
+    con sentidos mixtos: (a > x) OR (a = x AND b > y) OR ... La primera
+    condición (a >= x) se repite aparte para que la DB use el índice por rango.
+    """
+    alternativas = []
+    for i, ((columna, descendente), valor) in enumerate(zip(orden, valores)):
+        iguales = [c == v for (c, _), v in zip(orden[:i], valores[:i])]
+        alternativas.append(and_(*iguales, columna < valor if descendente else columna > valor))
+    primera, descendente = orden[0]
+    rango = primera <= valores[0] if descendente else primera >= valores[0]
+    return and_(rango, or_(*alternativas))
+
+def filtros_listado_turnos(argumentos):
+    """
+    Traduce los filtros de la query string (desde, hasta, cancha, usuario) a
+    condiciones SQL. Lanza ValueError si alguno tiene un formato inválido.
+    """
+    filtros = []
+    if argumentos.get('desde'):
+        filtros.append(Reserva.fecha >= datetime.strptime(argumentos['desde'], '%Y-%m-%d').date())
+    if argumentos.get('hasta'):
+        filtros.append(Reserva.fecha <= datetime.strptime(argumentos['hasta'], '%Y-%m-%d').date())
+    if argumentos.get('cancha'):
+        filtros.append(Reserva.cancha_id == int(argumentos['cancha']))
+    if argumentos.get('usuario'):
+        filtros.append(Usuario.nombre_usuario.startswith(argumentos['usuario'].strip(), autoescape=True))
+    return filtros
+
+def consulta_pagina_turnos(estado, filtros, cursor, limite):
+    """Una página del listado de turnos del admin, más una fila para saber si hay otra."""
+    orden = ORDEN_LISTADOS_TURNOS[estado]
+    consulta = select(
+        Reserva.id, Reserva.fecha, Reserva.hora_inicio, Reserva.hora_fin, Reserva.monto,
+        Reserva.cancha_id, Usuario.nombre_usuario
+    ).select_from(Reserva).join(Usuario).where(Reserva.estado == estado, *filtros)
+    if cursor:
+        consulta = consulta.where(condicion_despues_de(orden, cursor))
+    return consulta.order_by(
+        *(columna.desc() if descendente else columna.asc() for columna, descendente in orden)
+    ).limit(limite + 1)
+
+def pagina_turnos_por_dia(estado, filtros, cursor=None):
+    """
+    Devuelve una página del listado de turnos en 'estado', agrupada por día:
+    ([(fecha, [turno, ...]), ...], cursor_siguiente). La página se corta en un
+    límite de día, salvo que un solo día supere TURNOS_POR_PAGINA (en ese caso
+    la página siguiente continúa el mismo día). cursor_siguiente es None si no
+    quedan más turnos.
+    """
+    limite = app.config['TURNOS_POR_PAGINA']
+    filas = db.session.execute(consulta_pagina_turnos(estado, filtros, cursor, limite)).all()
+    hay_mas = len(filas) > limite
+    filas = filas[:limite]
+
+    # Si quedan más filas, el último día de la página puede estar incompleto:
+    # se deja entero para la página siguiente
+    if hay_mas and filas[0].fecha != filas[-1].fecha:
+        ultimo_dia = filas[-1].fecha
+        filas = [fila for fila in filas if fila.fecha != ultimo_dia]
+
+    # El nombre de la cancha sale del catálogo en memoria (sin JOIN)
+    nombres_canchas = catalogo_canchas.nombres()
+    reservas_por_dia = []
+    for fila in filas:
+        if not reservas_por_dia or reservas_por_dia[-1][0] != fila.fecha:
+            reservas_por_dia.append((fila.fecha, []))
+        reservas_por_dia[-1][1].append({
+            'id': fila.id,
+            'hora_inicio': formatear_hora(fila.hora_inicio),
+            'hora_fin': formatear_hora(fila.hora_fin),
+            'cancha_nombre': nombres_canchas.get(fila.cancha_id, f'Cancha {fila.cancha_id}'),
+            'usuario': fila.nombre_usuario,
+            'monto_total': fila.monto
+        })
+
+    siguiente = codificar_cursor(filas[-1].fecha, filas[-1].hora_inicio, filas[-1].id) if hay_mas else None
+    return reservas_por_dia, siguiente
+
+def renderizar_listado_turnos(plantilla, estado):
+    """Renderiza la primera página de un listado de turnos del admin, con los filtros pedidos."""
+    try:
+        filtros = filtros_listado_turnos(request.args)
+    except ValueError:
+        flash('Filtro inválido: revisa las fechas (AAAA-MM-DD) y la cancha.', 'error')
+        filtros = []
+    reservas_por_dia, siguiente = pagina_turnos_por_dia(estado, filtros)
+    canchas = catalogo_canchas.ordenadas_por_nombre()
+    return render_template(plantilla, reservas_por_dia=reservas_por_dia, siguiente=siguiente,
+                           canchas=canchas, filtros=request.args)
+
 @app.route('/ver_turnos_administrador')
+@presupuesto_consultas(3)
 def ver_turnos_administrador():
     """
     RUTA: Ver todos los turnos activos (Admin).
     Protegida por 'verificar_admin()'.
-    Muestra un listado de todas las reservas activas, agrupadas por día.
+    Muestra las reservas activas agrupadas por día. Se renderiza la primera
+    página; el resto se pide a /api/turnos_administrador al hacer scroll.
     """
     try:
         error_redirect = verificar_admin()
         if error_redirect: return error_redirect
 
-        # Consulta que une Reservas, Usuarios y Canchas para obtener todos los datos
-        reservas_db = db.session.query(Reserva, Usuario, Cancha).join(Usuario).join(Cancha).filter(
-            Reserva.estado == 'activa'
-        ).order_by(Reserva.fecha.desc(), Reserva.hora_inicio.desc()).all()
-
-        # Agrupar por fecha usando un defaultdict para el template
-        reservas_por_dia = defaultdict(list)
-        for reserva, usuario, cancha in reservas_db:
-            turno = {
-                'id': reserva.id,
-                'fecha': reserva.fecha,
-                'hora_inicio': reserva.hora_inicio,
-                'hora_fin': reserva.hora_fin,
-                'cancha_nombre': cancha.nombre,
-                'usuario': usuario.nombre_usuario,
-                'monto_total': reserva.monto
-            }
-            reservas_por_dia[reserva.fecha].append(turno)
-
-        # Ordenar los grupos de días (el más reciente primero)
-        return render_template('ver_turnos_administrador.html',
-                           reservas_por_dia=sorted(reservas_por_dia.items(), reverse=True))
+        return renderizar_listado_turnos('ver_turnos_administrador.html', 'activa')
 
     except Exception as e:
         flash('Error interno al mostrar los turnos', 'error')
-        return render_template('ver_turnos_administrador.html', reservas_por_dia=[])
+        return render_template('ver_turnos_administrador.html', reservas_por_dia=[], canchas=[], filtros={})
 
 @app.route('/cancelar_turno_admin/<int:reserva_id>')
+@presupuesto_consultas(7)
 def cancelar_turno_admin(reserva_id):
     """
     RUTA: Cancelar un turno desde el panel de Admin.
@@ -554,15 +2514,21 @@ def cancelar_turno_admin(reserva_id):
         if error_redirect: return error_redirect
 
         # Buscar la reserva activa
-        reserva_a_cancelar = Reserva.query.filter_by(id=reserva_id, estado='activa').first()
+        reserva_a_cancelar = db.session.execute(consulta_reservas_activas([reserva_id])).scalars().first()
         
         if not reserva_a_cancelar:
             flash('Turno no encontrado o ya estaba cancelado', 'error')
             return redirect(url_for('ver_turnos_administrador'))
 
         # Cambiar estado
-        reserva_a_cancelar.estado = 'cancelada'
+        turno = (reserva_a_cancelar.fecha, reserva_a_cancelar.cancha_id, reserva_a_cancelar.hora_inicio)
+        if not cancelar_reserva(reserva_a_cancelar):
+            flash('Turno no encontrado o ya estaba cancelado', 'error')
+            return redirect(url_for('ver_turnos_administrador'))
+        version, = versiones_de_cambios([turno[0]])
         db.session.commit()
+        ocupacion_turnos.liberar(*turno, version)
+        invalidar_kpis_reserva(turno[0])
 
         flash(f'Turno cancelado exitosamente (ID: {reserva_id})', 'success')
         return redirect(url_for('ver_turnos_administrador'))
@@ -573,6 +2539,7 @@ def cancelar_turno_admin(reserva_id):
         return redirect(url_for('ver_turnos_administrador'))
 
 @app.route('/gestionar_usuarios')
+@presupuesto_consultas(3)
 def gestionar_usuarios():
     """
     RUTA: Ver lista de usuarios (Admin).
@@ -582,150 +2549,181 @@ def gestionar_usuarios():
     error_redirect = verificar_admin()
     if error_redirect: return error_redirect
     
-    usuarios_normales = Usuario.query.all()
-    administradores = Administrador.query.all()
+    # Sólo el nombre de usuario (la plantilla no usa el resto, ni los hashes)
+    usuarios_normales = db.session.query(Usuario.nombre_usuario).order_by(Usuario.id).all()
+    administradores = db.session.query(Administrador.nombre_usuario).order_by(Administrador.id).all()
 
     return render_template('gestionar_usuarios.html', usuarios=usuarios_normales, administradores=administradores)
 
 @app.route('/ver_turnos_cancelados_administrador')
+@presupuesto_consultas(3)
 def ver_turnos_cancelados_administrador():
     """
     RUTA: Ver historial de turnos cancelados (Admin).
     Protegida por 'verificar_admin()'.
-    Muestra un listado de todas las reservas con estado 'cancelada'.
+    Muestra las reservas con estado 'cancelada' agrupadas por día (más reciente
+    primero, horas más tempranas primero). Paginado igual que los activos.
     """
     try:
         error_redirect = verificar_admin()
         if error_redirect: return error_redirect
 
-        # Consulta similar a ver_turnos, pero filtrando por 'cancelada'
-        reservas_db = db.session.query(Reserva, Usuario, Cancha).join(Usuario).join(Cancha).filter(
-            Reserva.estado == 'cancelada'
-        ).order_by(Reserva.fecha.desc(), Reserva.hora_inicio.desc()).all()
-
-        reservas_por_dia = defaultdict(list)
-        for reserva, usuario, cancha in reservas_db:
-            turno = {
-                'fecha': reserva.fecha,
-                'hora_inicio': reserva.hora_inicio,
-                'hora_fin': reserva.hora_fin,
-                'cancha_nombre': cancha.nombre,
-                'usuario': usuario.nombre_usuario,
-                'monto_total': reserva.monto
-            }
-            reservas_por_dia[reserva.fecha].append(turno)
-        
-        # Ordenar días (más reciente primero)
-        reservas_por_dia_ordenadas = dict(sorted(reservas_por_dia.items(), reverse=True))
-        
-        # Ordenar horas dentro de cada día (más temprano primero)
-        for fecha in reservas_por_dia_ordenadas:
-            reservas_por_dia_ordenadas[fecha].sort(key=lambda x: x['hora_inicio'])
-
-        return render_template('ver_turnos_cancelados_administrador.html',
-                           reservas_por_dia=reservas_por_dia_ordenadas.items())
+        return renderizar_listado_turnos('ver_turnos_cancelados_administrador.html', 'cancelada')
 
     except Exception as e:
         flash('Error al cargar turnos cancelados', 'error')
         return render_template('ver_turnos_cancelados_administrador.html',
-                           reservas_por_dia=[])
+                           reservas_por_dia=[], canchas=[], filtros={})
     
+def expresiones_periodo(columna_fecha):
+    """
+    Devuelve las expresiones SQL (año, mes, trimestre, semana ISO y día de la
+    semana) para agrupar 'columna_fecha' por período, según el motor en uso.
+    """
+    if db.engine.dialect.name == 'mysql':
+        return {
+            'anio': func.year(columna_fecha),
+            'mes': func.month(columna_fecha),
+            'trimestre': func.quarter(columna_fecha),
+            # Modo 3 = semana ISO 8601 (igual que date.isocalendar())
+            'semana': func.week(columna_fecha, literal_column('3')),
+            'dia_semana': func.weekday(columna_fecha), # Lunes=0, Domingo=6
+        }
+    # SQLite: no tiene YEAR()/WEEK(), se calcula con strftime()
+    mes = cast(func.strftime('%m', columna_fecha), Integer)
+    # La semana ISO es la del jueves de esa semana: (día del año del jueves + 6) / 7
+    dia_jueves = cast(func.strftime('%j', func.date(columna_fecha, '-3 days', 'weekday 4')), Integer)
+    return {
+        'anio': cast(func.strftime('%Y', columna_fecha), Integer),
+        'mes': mes,
+        'trimestre': (mes + 2) // 3,
+        'semana': (dia_jueves + 6) // 7,
+        # %w cuenta desde el domingo (0); se corre para que Lunes=0, Domingo=6
+        'dia_semana': (cast(func.strftime('%w', columna_fecha), Integer) + 6) % 7,
+    }
+
+GRANULARIDADES = ('diario', 'semanal', 'mensual', 'trimestral', 'anual')
+
+def consultas_por_periodo(columna_fecha, columna_monto, filtros, hoy, granularidades=GRANULARIDADES):
+    """
+    Consultas de sumar_por_periodo: {granularidad: (consulta, etiqueta)}, donde
+    'etiqueta' arma el nombre del período con las columnas de agrupación.
+    """
+    periodo = expresiones_periodo(columna_fecha)
+    total = func.sum(columna_monto)
+    agrupaciones = {
+        'semanal': ((periodo['anio'], periodo['semana']), lambda a, s: f"{a}-Sem {s:02d}"),
+        'mensual': ((periodo['anio'], periodo['mes']), lambda a, m: f"{a}-{m:02d}"),
+        'trimestral': ((periodo['anio'], periodo['trimestre']), lambda a, t: f"{a}-T{t}"),
+        'anual': ((periodo['anio'],), lambda a: str(a)),
+    }
+
+    consultas = {}
+    for granularidad, (columnas, etiqueta) in agrupaciones.items():
+        if granularidad in granularidades:
+            consultas[granularidad] = (select(*columnas, total).where(*filtros).group_by(*columnas), etiqueta)
+
+    if 'diario' in granularidades:
+        # El detalle diario sólo cubre el mes en curso
+        inicio_mes = hoy.replace(day=1)
+        fin_mes = (inicio_mes + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        consultas['diario'] = (
+            select(columna_fecha, total).where(*filtros, columna_fecha.between(inicio_mes, fin_mes))
+            .group_by(columna_fecha),
+            lambda fecha: fecha.isoformat()
+        )
+    return consultas
+
+def sumar_por_periodo(columna_fecha, columna_monto, filtros, hoy, granularidades=GRANULARIDADES):
+    """
+    Suma 'columna_monto' agrupando en SQL por día (sólo el mes actual), semana,
+    mes, trimestre y año. Devuelve {granularidad: {período: total}} con las
+    mismas etiquetas que muestra el informe financiero.
+    """
+    totales = {}
+    for granularidad, (consulta, etiqueta) in consultas_por_periodo(
+            columna_fecha, columna_monto, filtros, hoy, granularidades).items():
+        filas = db.session.execute(consulta).all()
+        totales[granularidad] = {etiqueta(*fila[:-1]): float(fila[-1]) for fila in filas}
+    return totales
+
+# Montos que suman los informes por período sobre el resumen diario, como
+# (columna, filtros): sólo cuentan los días con alguna reserva activa o algún gasto
+SUMAS_RESUMEN = {
+    'ingresos': (ResumenDiario.ingresos, [ResumenDiario.reservas_activas > 0]),
+    'egresos': (ResumenDiario.egresos, [ResumenDiario.cantidad_gastos > 0]),
+}
+
+def calcular_informe_financiero(hoy=None):
+    """
+    Arma los reportes de Ingresos, Egresos y Balance Neto por período.
+    Suma sobre la tabla 'resumen_diario' (una fila por día); aquí únicamente
+    se combinan ingresos y egresos y se ordenan. Sólo se listan los períodos
+    con alguna reserva activa o algún gasto, como en el detalle original.
+    """
+    hoy = hoy or datetime.now().date()
+    ingresos = sumar_por_periodo(ResumenDiario.fecha, *SUMAS_RESUMEN['ingresos'], hoy)
+    egresos = sumar_por_periodo(ResumenDiario.fecha, *SUMAS_RESUMEN['egresos'], hoy)
+
+    reportes = {}
+    for granularidad in GRANULARIDADES:
+        periodos = ingresos[granularidad].keys() | egresos[granularidad].keys()
+        lista_final = []
+        for periodo in periodos:
+            datos = {
+                'ingresos': ingresos[granularidad].get(periodo, 0.0),
+                'egresos': egresos[granularidad].get(periodo, 0.0),
+            }
+            datos['balance'] = datos['ingresos'] - datos['egresos']
+            lista_final.append((periodo, datos))
+        # Ordenar por período (clave, ej: '2025-11') de forma descendente
+        reportes[granularidad] = sorted(lista_final, key=lambda item: item[0], reverse=True)
+    return reportes
+
 @app.route('/informe_financiero_administrador')
+@presupuesto_consultas(12)
 def informe_financiero_administrador():
     """
     RUTA: Informe financiero detallado (Admin).
-    ¡VERSIÓN ACTUALIZADA!
     Calcula Ingresos, Egresos y Balance Neto agrupados por período.
+    La agregación se hace en SQL (ver calcular_informe_financiero).
     """
     try:
         error_redirect = verificar_admin()
         if error_redirect: return error_redirect
 
-        # --- 1. Contenedores de datos ---
-        # Usamos defaultdict para inicializar automáticamente los períodos que no existan
-        balance_diario = defaultdict(lambda: {'ingresos': 0.0, 'egresos': 0.0, 'balance': 0.0})
-        balance_semanal = defaultdict(lambda: {'ingresos': 0.0, 'egresos': 0.0, 'balance': 0.0})
-        balance_mensual = defaultdict(lambda: {'ingresos': 0.0, 'egresos': 0.0, 'balance': 0.0})
-        balance_trimestral = defaultdict(lambda: {'ingresos': 0.0, 'egresos': 0.0, 'balance': 0.0})
-        balance_anual = defaultdict(lambda: {'ingresos': 0.0, 'egresos': 0.0, 'balance': 0.0})
-        
-        hoy = datetime.now()
-        mes_actual = hoy.month
-        anio_actual = hoy.year
-
-        # --- 2. Procesar INGRESOS (Reservas) ---
-        reservas_activas = Reserva.query.filter_by(estado='activa').all()
-        for r in reservas_activas:
-            try:
-                monto = float(r.monto)
-                fecha = datetime.strptime(r.fecha, '%Y-%m-%d')
-                
-                # Definir períodos
-                fecha_str = r.fecha
-                semana = f"{fecha.year}-Sem {fecha.isocalendar()[1]:02d}"
-                mes = f"{fecha.year}-{fecha.month:02d}"
-                trimestre = f"{fecha.year}-T{(fecha.month-1)//3 + 1}"
-                anio = str(fecha.year)
-
-                # Sumar a ingresos
-                if fecha.month == mes_actual and fecha.year == anio_actual:
-                    balance_diario[fecha_str]['ingresos'] += monto
-                balance_semanal[semana]['ingresos'] += monto
-                balance_mensual[mes]['ingresos'] += monto
-                balance_trimestral[trimestre]['ingresos'] += monto
-                balance_anual[anio]['ingresos'] += monto
-            except (ValueError, KeyError):
-                continue
-        
-        # --- 3. Procesar EGRESOS (Gastos) ---
-        todos_los_gastos = Gasto.query.all()
-        for g in todos_los_gastos:
-            try:
-                monto = float(g.monto)
-                fecha = datetime.strptime(g.fecha, '%Y-%m-%d')
-                
-                # Definir períodos
-                fecha_str = g.fecha
-                semana = f"{fecha.year}-Sem {fecha.isocalendar()[1]:02d}"
-                mes = f"{fecha.year}-{fecha.month:02d}"
-                trimestre = f"{fecha.year}-T{(fecha.month-1)//3 + 1}"
-                anio = str(fecha.year)
-
-                # Sumar a egresos
-                if fecha.month == mes_actual and fecha.year == anio_actual:
-                    balance_diario[fecha_str]['egresos'] += monto
-                balance_semanal[semana]['egresos'] += monto
-                balance_mensual[mes]['egresos'] += monto
-                balance_trimestral[trimestre]['egresos'] += monto
-                balance_anual[anio]['egresos'] += monto
-            except (ValueError, KeyError):
-                continue
-
-        # --- 4. Calcular Balances y preparar para el template ---
-        
-        def calcular_y_ordenar(balance_dict):
-            lista_final = []
-            for periodo, datos in balance_dict.items():
-                datos['balance'] = datos['ingresos'] - datos['egresos']
-                lista_final.append((periodo, datos))
-            # Ordenar por período (clave, ej: '2025-11') de forma descendente
-            return sorted(lista_final, key=lambda item: item[0], reverse=True)
-
-        reportes = {
-            'diario': calcular_y_ordenar(balance_diario),
-            'semanal': calcular_y_ordenar(balance_semanal),
-            'mensual': calcular_y_ordenar(balance_mensual),
-            'trimestral': calcular_y_ordenar(balance_trimestral),
-            'anual': calcular_y_ordenar(balance_anual)
-        }
+        # El detalle diario depende de la fecha de hoy: también va en el ETag
+        no_modificado, _ = respuesta_condicional(
+            'informe_financiero_administrador', claves=('reconstruccion',), prefijos=('reservas:', 'gastos:'),
+            extra=datetime.now().date().isoformat())
+        if no_modificado: return no_modificado
 
+        reportes = calcular_informe_financiero()
         return render_template('informe_financiero_administrador.html', reportes=reportes)
 
     except Exception as e:
         flash(f'Error al generar el informe financiero: {e}', 'error')
         return render_template('informe_financiero_administrador.html', reportes={})
 
+
+def consulta_reservas_por_usuario():
+    """Reservas activas y canceladas de cada usuario, en un único recorrido agrupado."""
+    es_activa = Reserva.estado == 'activa'
+    return select(
+        Reserva.usuario_id,
+        func.sum(case((es_activa, 1), else_=0)),
+        func.sum(case((es_activa, 0), else_=1))
+    ).group_by(Reserva.usuario_id)
+
+def consulta_demanda_turnos():
+    """Reservas activas agrupadas por (cancha, hora de inicio, día de la semana; Lunes=0)."""
+    dia_semana = expresiones_periodo(Reserva.fecha)['dia_semana']
+    return select(
+        Reserva.cancha_id, Reserva.hora_inicio, dia_semana, func.count()
+    ).where(Reserva.estado == 'activa').group_by(Reserva.cancha_id, Reserva.hora_inicio, dia_semana)
+
 @app.route('/panel_reportes')
+@presupuesto_consultas(6)
 def panel_reportes():
     """
     RUTA: Panel de estadísticas y reportes de negocio (Admin).
@@ -735,63 +2733,62 @@ def panel_reportes():
     error_redirect = verificar_admin()
     if error_redirect: return error_redirect
 
+    no_modificado, versiones = respuesta_condicional(
+        'panel_reportes', claves=('canchas', 'reconstruccion'), prefijos=('reservas:',))
+    if no_modificado: return no_modificado
+
     try:
-        # Reporte 1: Top 5 Usuarios con más reservas activas
-        top_usuarios_reservas = db.session.query(
-            Usuario.nombre_usuario, func.count(Reserva.id).label('total_reservas')
-        ).join(Reserva).filter(Reserva.estado == 'activa').group_by(Usuario.id).order_by(
-            func.count(Reserva.id).desc()
-        ).limit(5).all()
-
-        # Reporte 2: Top 5 Usuarios con más cancelaciones
-        top_usuarios_cancelan = db.session.query(
-            Usuario.nombre_usuario, func.count(Reserva.id).label('total_canceladas')
-        ).join(Reserva).filter(Reserva.estado == 'cancelada').group_by(Usuario.id).order_by(
-            func.count(Reserva.id).desc()
-        ).limit(5).all()
-
-        # Reporte 3: Canchas más reservadas (ranking)
-        top_canchas = db.session.query(
-            Cancha.nombre, func.count(Reserva.id).label('total_reservas')
-        ).join(Reserva).filter(Reserva.estado == 'activa').group_by(Cancha.id).order_by(
-            func.count(Reserva.id).desc()
-        ).all()
-
-        # Reporte 4: Demanda por franja horaria
-        query_horarios = db.session.query(
-            Reserva.hora_inicio, func.count(Reserva.id).label('total')
-        ).filter(Reserva.estado == 'activa').group_by(Reserva.hora_inicio).order_by(
-            func.count(Reserva.id).desc()
-        ).all()
-        
-        # Rellenar horarios vacíos (los que tienen 0 reservas)
-        contador_horarios = {h: c for h, c in query_horarios}
-        for hora in range(HORA_APERTURA, HORA_CIERRE):
-            hora_str = f"{hora:02d}:00"
-            if hora_str not in contador_horarios:
-                contador_horarios[hora_str] = 0
-        
-        horarios_demanda = sorted(contador_horarios.items(), key=lambda item: item[1], reverse=True)
-        horarios_mas_demanda = horarios_demanda[:5]
-        horarios_menos_demanda = horarios_demanda[::-1][:5]
+        tiempos = {}
+
+        # Reportes 1 y 2: Top 5 Usuarios con más reservas activas / más cancelaciones.
+        # Un único recorrido agrupado por usuario cuenta ambos estados a la vez.
+        with cronometro(tiempos, 'usuarios'):
+            por_usuario = db.session.execute(consulta_reservas_por_usuario()).all()
+
+            top_activas = sorted((f for f in por_usuario if f[1]), key=lambda f: f[1], reverse=True)[:5]
+            top_canceladas = sorted((f for f in por_usuario if f[2]), key=lambda f: f[2], reverse=True)[:5]
+
+            # Sólo se buscan los nombres de los (a lo sumo 10) usuarios del ranking
+            ids_ranking = {f[0] for f in top_activas + top_canceladas}
+            nombres = dict(db.session.query(Usuario.id, Usuario.nombre_usuario)
+                           .filter(Usuario.id.in_(ids_ranking)).all()) if ids_ranking else {}
+            top_usuarios_reservas = [(nombres[f[0]], int(f[1])) for f in top_activas]
+            top_usuarios_cancelan = [(nombres[f[0]], int(f[2])) for f in top_canceladas]
+
+        # Reportes 3, 4 y 5: Canchas, franjas horarias y días de la semana.
+        # Un único recorrido de las reservas activas agrupado por (cancha, hora, día
+        # de la semana), resuelto sólo con el índice ix_reservas_estado_cancha_hora.
+        with cronometro(tiempos, 'demanda'):
+            demanda = db.session.execute(consulta_demanda_turnos()).all()
+
+            por_cancha, por_hora, por_dia = Counter(), Counter(), Counter()
+            for cancha_id, hora_inicio, dia_idx, total in demanda:
+                por_cancha[cancha_id] += total
+                por_hora[formatear_hora(hora_inicio)] += total
+                por_dia[int(dia_idx)] += total # Lunes=0, Domingo=6
+
+        with cronometro(tiempos, 'rankings'):
+            # Reporte 3: Canchas más reservadas (ranking)
+            nombres_canchas = catalogo_canchas.nombres(versiones['canchas'])
+            top_canchas = [(nombres_canchas[cancha_id], total) for cancha_id, total in por_cancha.most_common()]
+
+            # Reporte 4: Demanda por franja horaria
+            # Rellenar horarios vacíos (los que tienen 0 reservas)
+            contador_horarios = dict(por_hora)
+            for hora in range(HORA_APERTURA, HORA_CIERRE):
+                hora_str = f"{hora:02d}:00"
+                if hora_str not in contador_horarios:
+                    contador_horarios[hora_str] = 0
 
-        # Reporte 5: Días de la semana con más reservas
-        mapa_dias = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
-        lista_dias_semana = []
-        
-        # Traer solo las fechas (optimizado)
-        reservas_fechas = db.session.query(Reserva.fecha).filter_by(estado='activa').all()
-        
-        for r in reservas_fechas:
-            try:
-                fecha_dt = datetime.strptime(r.fecha, '%Y-%m-%d')
-                dia_idx = fecha_dt.weekday() # Lunes=0, Domingo=6
-                lista_dias_semana.append(mapa_dias[dia_idx])
-            except (ValueError, KeyError):
-                continue
-        
-        # Usar Counter para contar la frecuencia de cada día
-        top_dias_semana = Counter(lista_dias_semana).most_common()
+            horarios_demanda = sorted(contador_horarios.items(), key=lambda item: item[1], reverse=True)
+            horarios_mas_demanda = horarios_demanda[:5]
+            horarios_menos_demanda = horarios_demanda[::-1][:5]
+
+            # Reporte 5: Días de la semana con más reservas
+            mapa_dias = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
+            top_dias_semana = [(mapa_dias[dia_idx], total) for dia_idx, total in por_dia.most_common()]
+
+        registrar_tiempos('panel_reportes', tiempos)
 
         # Renderizar la plantilla con todos los reportes
         return render_template('panel_reportes.html',
@@ -808,7 +2805,17 @@ def panel_reportes():
     
 # --- INICIO: NUEVA RUTA PARA REPORTE DE GASTOS ---
 
+def consulta_gastos_por_categoria():
+    """Total gastado por categoría, de mayor a menor."""
+    total_gastado = func.sum(Gasto.monto).label('total_gastado')
+    return select(Gasto.categoria, total_gastado).group_by(Gasto.categoria).order_by(total_gastado.desc())
+
+def consulta_gastos_mas_caros(limite=10):
+    """Los 'limite' gastos individuales más caros (objetos Gasto)."""
+    return select(Gasto).order_by(Gasto.monto.desc()).limit(limite)
+
 @app.route('/reporte_gastos')
+@presupuesto_consultas(7)
 def reporte_gastos():
     """
     RUTA: Muestra un informe financiero y estadístico de los gastos.
@@ -817,58 +2824,34 @@ def reporte_gastos():
     error_redirect = verificar_admin()
     if error_redirect: return error_redirect
 
+    no_modificado, _ = respuesta_condicional(
+        'reporte_gastos', claves=('reconstruccion',), prefijos=('gastos:',), extra=datetime.now().date().isoformat())
+    if no_modificado: return no_modificado
+
     try:
         # --- 1. CÁLCULOS FINANCIEROS (Agrupación por tiempo) ---
         
-        # Consultar todos los gastos para procesarlos en Python
-        # (Para gastos, suele ser más fácil procesar fechas así que con SQL puro)
-        todos_los_gastos = Gasto.query.all()
-        
-        egresos = {
-            'mensuales': defaultdict(float),
-            'trimestrales': defaultdict(float),
-            'anuales': defaultdict(float)
-        }
-
-        for gasto in todos_los_gastos:
-            try:
-                monto = float(gasto.monto)
-                fecha = datetime.strptime(gasto.fecha, '%Y-%m-%d')
-                
-                # Agrupación por mes
-                mes = f"{fecha.year}-{fecha.month:02d}"
-                egresos['mensuales'][mes] += monto
-                
-                # Agrupación por trimestre
-                trimestre = f"{fecha.year}-T{(fecha.month-1)//3 + 1}"
-                egresos['trimestrales'][trimestre] += monto
-                
-                # Agrupación por año
-                egresos['anuales'][str(fecha.year)] += monto
-            except (ValueError, KeyError):
-                continue
+        # Se suma sobre el resumen diario (una fila por día con gastos)
+        egresos = sumar_por_periodo(ResumenDiario.fecha, *SUMAS_RESUMEN['egresos'], datetime.now().date(),
+                                    granularidades=('mensual', 'trimestral', 'anual'))
         
         # Convertir a listas ordenadas para el template
         reportes_financieros = {
-            'mensual': sorted(egresos['mensuales'].items(), reverse=True),
-            'trimestral': sorted(egresos['trimestrales'].items(), reverse=True),
-            'anual': sorted(egresos['anuales'].items(), reverse=True)
+            'mensual': sorted(egresos['mensual'].items(), reverse=True),
+            'trimestral': sorted(egresos['trimestral'].items(), reverse=True),
+            'anual': sorted(egresos['anual'].items(), reverse=True)
         }
 
         # --- 2. CÁLCULOS ESTADÍSTICOS (Rankings) ---
         
         # Reporte 1: Total gastado por Categoría
-        gastos_por_categoria = db.session.query(
-            Gasto.categoria, func.sum(Gasto.monto).label('total_gastado')
-        ).group_by(Gasto.categoria).order_by(
-            func.sum(Gasto.monto).desc()
-        ).all()
+        gastos_por_categoria = db.session.execute(consulta_gastos_por_categoria()).all()
 
         # Reporte 2: Top 10 Gastos Individuales más caros
-        top_10_gastos = Gasto.query.order_by(Gasto.monto.desc()).limit(10).all()
+        top_10_gastos = db.session.execute(consulta_gastos_mas_caros(10)).scalars().all()
 
         # Reporte 3: Meses con más gastos (basado en lo ya calculado)
-        meses_mas_gastos = sorted(egresos['mensuales'].items(), key=lambda item: item[1], reverse=True)[:5]
+        meses_mas_gastos = sorted(egresos['mensual'].items(), key=lambda item: item[1], reverse=True)[:5]
 
 
         return render_template('reporte_gastos.html',
@@ -887,7 +2870,12 @@ def reporte_gastos():
 
 # --- INICIO: RUTAS PARA LA GESTIÓN DE GASTOS (ADMIN) ---
 
+def consulta_listado_gastos():
+    """Todos los gastos (objetos Gasto), del más reciente al más antiguo."""
+    return select(Gasto).order_by(Gasto.fecha.desc())
+
 @app.route('/gestionar_gastos')
+@presupuesto_consultas(2)
 def gestionar_gastos():
     """
     RUTA: Ver lista de gastos (Admin).
@@ -899,8 +2887,7 @@ def gestionar_gastos():
     
     # Consultar todos los gastos
     try:
-        # Esta línea ahora funcionará porque 'Gasto' está definido arriba
-        gastos = Gasto.query.order_by(Gasto.fecha.desc()).all()
+        gastos = db.session.execute(consulta_listado_gastos()).scalars().all()
     except Exception as e:
         flash(f'Error al consultar gastos: {e}', 'error')
         gastos = []
@@ -909,6 +2896,7 @@ def gestionar_gastos():
     return render_template('gestionar_gastos.html', gastos=gastos, now=now)
 
 @app.route('/cargar_gasto', methods=['GET', 'POST'])
+@presupuesto_consultas(3)
 def cargar_gasto():
     """
     RUTA: Cargar un nuevo gasto (Admin).
@@ -931,13 +2919,19 @@ def cargar_gasto():
                 flash('Todos los campos obligatorios deben completarse.', 'error')
                 return redirect(url_for('cargar_gasto'))
             
+            try:
+                fecha_gasto = datetime.strptime(fecha, '%Y-%m-%d').date()
+            except ValueError:
+                flash('La fecha debe tener el formato AAAA-MM-DD.', 'error')
+                return redirect(url_for('cargar_gasto'))
+
             monto = float(monto_str)
             if monto <= 0:
                 flash('El monto debe ser un número positivo.', 'error')
                 return redirect(url_for('cargar_gasto'))
 
             nuevo_gasto = Gasto(
-                fecha=fecha,
+                fecha=fecha_gasto,
                 monto=monto,
                 categoria=categoria,
                 concepto=concepto,
@@ -945,6 +2939,8 @@ def cargar_gasto():
             )
             
             db.session.add(nuevo_gasto)
+            acumular_resumen(fecha_gasto, egresos=monto, cantidad_gastos=1)
+            marcar_cambio(f'gastos:{fecha_gasto.isoformat()}')
             db.session.commit()
             
             flash('Gasto cargado exitosamente.', 'success')
@@ -963,10 +2959,170 @@ def cargar_gasto():
 
 # --- FIN: RUTAS PARA LA GESTIÓN DE GASTOS ---
 
+# --- INICIO: Exportaciones CSV (streaming) ---
+
+# Filas que se traen de la DB por vez al exportar (cursor del lado del servidor en MySQL)
+FILAS_POR_TANDA_EXPORTACION = 2000
+
+def respuesta_csv(nombre_archivo, encabezado, consulta, comprimir=False):
+    """
+    Devuelve una Response que genera el CSV a medida que lee las filas de
+    'consulta' (un select de Core), de a FILAS_POR_TANDA_EXPORTACION. La
+    memoria no depende de la cantidad de filas y el encabezado sale enseguida.
+    Con 'comprimir' el CSV se envía como .csv.gz, comprimido sobre la marcha.
+    """
+    def lineas():
+        buffer = io.StringIO()
+        escritor = csv.writer(buffer)
+        buffer.write('\ufeff') # BOM: Excel abre el archivo como UTF-8 (acentos)
+        escritor.writerow(encabezado)
+        yield buffer.getvalue()
+
+        resultado = db.session.execute(consulta.execution_options(yield_per=FILAS_POR_TANDA_EXPORTACION))
+        for tanda in resultado.partitions():
+            buffer.seek(0)
+            buffer.truncate()
+            escritor.writerows(tanda)
+            yield buffer.getvalue()
+
+    def comprimidas():
+        compresor = zlib.compressobj(wbits=31) # 31 = formato gzip
+        for texto in lineas():
+            # SYNC_FLUSH por tanda: cada parte sale apenas se genera
+            yield compresor.compress(texto.encode('utf-8')) + compresor.flush(zlib.Z_SYNC_FLUSH)
+        yield compresor.flush()
+
+    if comprimir:
+        cuerpo, tipo, nombre_archivo = comprimidas(), 'application/gzip', nombre_archivo + '.gz'
+    else:
+        cuerpo, tipo = lineas(), 'text/csv; charset=utf-8'
+    return Response(stream_with_context(cuerpo), mimetype=tipo, headers={
+        'Content-Disposition': f'attachment; filename="{nombre_archivo}"',
+        'X-Accel-Buffering': 'no', # Que un proxy (nginx) no acumule la respuesta entera
+    })
+
+@app.route('/exportar/reservas.csv')
+@presupuesto_consultas(1) # Sólo la verificación del admin: la consulta corre mientras se envía el archivo
+def exportar_reservas_csv():
+    """
+    RUTA (Admin): Descarga todas las reservas en CSV, generado en streaming.
+    Filtros opcionales: desde, hasta, cancha, usuario (los de los listados)
+    y estado ('activa' o 'cancelada'); con comprimir=1 se descarga en .csv.gz.
+    """
+    error_redirect = verificar_admin()
+    if error_redirect: return error_redirect
+
+    estado = request.args.get('estado')
+    try:
+        filtros = filtros_listado_turnos(request.args)
+        if estado not in (None, '', 'activa', 'cancelada'):
+            raise ValueError(estado)
+    except ValueError:
+        flash('Filtro inválido: revisa las fechas (AAAA-MM-DD), la cancha y el estado.', 'error')
+        return redirect(url_for('ver_turnos_administrador'))
+    if estado:
+        filtros.append(Reserva.estado == estado)
+
+    # Por id (clave primaria): la DB entrega las filas en orden sin tener que ordenarlas antes
+    consulta = (
+        select(Reserva.id, Reserva.fecha, Reserva.hora_inicio, Reserva.hora_fin, Cancha.nombre,
+               Usuario.nombre_usuario, Reserva.monto, Reserva.estado)
+        .join(Cancha, Reserva.cancha_id == Cancha.id)
+        .join(Usuario, Reserva.usuario_id == Usuario.id)
+        .where(*filtros)
+        .order_by(Reserva.id)
+    )
+    return respuesta_csv('reservas.csv',
+                         ['id', 'fecha', 'hora_inicio', 'hora_fin', 'cancha', 'usuario', 'monto', 'estado'],
+                         consulta, comprimir=request.args.get('comprimir') == '1')
+
+@app.route('/exportar/gastos.csv')
+@presupuesto_consultas(1) # Sólo la verificación del admin: la consulta corre mientras se envía el archivo
+def exportar_gastos_csv():
+    """
+    RUTA (Admin): Descarga todos los gastos en CSV, generado en streaming.
+    Filtros opcionales: desde, hasta y categoria; con comprimir=1 se
+    descarga en .csv.gz.
+    """
+    error_redirect = verificar_admin()
+    if error_redirect: return error_redirect
+
+    filtros = []
+    try:
+        if request.args.get('desde'):
+            filtros.append(Gasto.fecha >= datetime.strptime(request.args['desde'], '%Y-%m-%d').date())
+        if request.args.get('hasta'):
+            filtros.append(Gasto.fecha <= datetime.strptime(request.args['hasta'], '%Y-%m-%d').date())
+    except ValueError:
+        flash('Filtro inválido: revisa las fechas (AAAA-MM-DD).', 'error')
+        return redirect(url_for('gestionar_gastos'))
+    if request.args.get('categoria'):
+        filtros.append(Gasto.categoria == request.args['categoria'])
+
+    consulta = (
+        select(Gasto.id, Gasto.fecha, Gasto.categoria, Gasto.concepto, Gasto.descripcion, Gasto.monto)
+        .where(*filtros)
+        .order_by(Gasto.id)
+    )
+    return respuesta_csv('gastos.csv', ['id', 'fecha', 'categoria', 'concepto', 'descripcion', 'monto'],
+                         consulta, comprimir=request.args.get('comprimir') == '1')
+
+# --- FIN: Exportaciones CSV ---
+
+@app.route('/admin/rendimiento')
+@presupuesto_consultas(1)
+def rendimiento_administrador():
+    """
+    RUTA (Admin): Rendimiento de las últimas requests atendidas por este worker
+    (consultas SQL, tiempo en SQL y en plantillas), agregado por ruta.
+    """
+    error_redirect = verificar_admin()
+    if error_redirect: return error_redirect
+
+    return render_template('rendimiento_administrador.html',
+                           resumen=registro_rendimiento.resumen_por_ruta(),
+                           recientes=registro_rendimiento.muestras()[:50],
+                           umbral_consulta_lenta=app.config['CONSULTA_LENTA_MS'],
+                           pid=os.getpid())
+
+@app.route('/admin/hashes_contrasenas')
+@presupuesto_consultas(3)
+def hashes_contrasenas_administrador():
+    """
+    RUTA (Admin): Distribución de los métodos y costos de hash de contraseñas
+    de usuarios y administradores, frente a la política vigente.
+    """
+    error_redirect = verificar_admin()
+    if error_redirect: return error_redirect
+
+    filas = estadisticas_hashes()
+    return render_template('hashes_administrador.html',
+                           filas=filas,
+                           politica=app.config['METODO_HASH_CONTRASENAS'],
+                           vigente=prefijo_hash_vigente(app.config['METODO_HASH_CONTRASENAS']),
+                           desactualizadas=sum(f['cantidad'] for f in filas if not f['vigente']),
+                           pendientes=rehash_pendientes(),
+                           pid=os.getpid())
+
 
 # --- Rutas del Panel de Usuario ---
 
+def consulta_proximos_turnos(usuario_id, desde):
+    """Turnos activos del usuario desde una fecha, del más próximo al más lejano."""
+    return select(
+        Reserva.id, Reserva.fecha, Reserva.hora_inicio, Reserva.hora_fin, Reserva.monto, Reserva.cancha_id
+    ).where(
+        Reserva.usuario_id == usuario_id,
+        Reserva.estado == 'activa',
+        Reserva.fecha >= desde
+    ).order_by(Reserva.fecha, Reserva.hora_inicio)
+
+def consulta_total_turnos_usuario(usuario_id):
+    """Cantidad de turnos activos del usuario."""
+    return select(func.count(Reserva.id)).where(Reserva.usuario_id == usuario_id, Reserva.estado == 'activa')
+
 @app.route('/panel_usuario')
+@presupuesto_consultas(3)
 def panel_usuario():
     """
     RUTA: Dashboard principal del Usuario (Cliente).
@@ -979,38 +3135,36 @@ def panel_usuario():
         return redirect(url_for('iniciar_sesion_usuario'))
     
     usuario_id = session['user_id']
-    hoy_str = datetime.now().strftime('%Y-%m-%d')
-    ahora_str = datetime.now().strftime('%H:%M')
+    ahora = datetime.now()
+    hoy = ahora.date()
+    hora_actual = ahora.time()
 
     # 2. Obtener próximos turnos (Optimizado)
-    # Filtramos en la DB por fecha >= hoy para no traer historial innecesario
-    proximos_turnos_db = Reserva.query.filter(
-        Reserva.usuario_id == usuario_id,
-        Reserva.estado == 'activa',
-        Reserva.fecha >= hoy_str 
-    ).order_by(Reserva.fecha, Reserva.hora_inicio).all()
+    # Filtramos en la DB por fecha >= hoy para no traer historial innecesario, y
+    # los datos de la cancha salen del catálogo en memoria (sin JOIN)
+    proximos_turnos_db = db.session.execute(consulta_proximos_turnos(usuario_id, hoy)).all()
     
     proximos_turnos_con_cancha = []
     for turno in proximos_turnos_db:
         # Si el turno es hoy, verificamos que la hora no haya pasado
-        if turno.fecha == hoy_str and turno.hora_inicio < ahora_str:
+        if turno.fecha == hoy and turno.hora_inicio < hora_actual:
             continue # Omitir este turno, ya pasó
 
-        # 'turno.cancha' funciona gracias al 'backref' de SQLAlchemy
+        cancha = catalogo_canchas.obtener(turno.cancha_id)
         turno_data = {
             'id': turno.id,
             'fecha': turno.fecha,
-            'hora_inicio': turno.hora_inicio,
-            'hora_fin': turno.hora_fin,
+            'hora_inicio': formatear_hora(turno.hora_inicio),
+            'hora_fin': formatear_hora(turno.hora_fin),
             'monto': turno.monto,
-            'cancha_nombre': turno.cancha.nombre,
-            'cancha_tipo': turno.cancha.tipo,
-            'cancha_condicion': turno.cancha.condicion
+            'cancha_nombre': cancha.nombre,
+            'cancha_tipo': cancha.tipo,
+            'cancha_condicion': cancha.condicion
         }
         proximos_turnos_con_cancha.append(turno_data)
     
     # 3. Contar total de turnos activos para estadística
-    total_turnos = Reserva.query.filter_by(usuario_id=usuario_id, estado='activa').count()
+    total_turnos = db.session.execute(consulta_total_turnos_usuario(usuario_id)).scalar()
 
     # 4. Renderizar plantilla
     return render_template('panel_usuario.html', 
@@ -1019,12 +3173,15 @@ def panel_usuario():
                          total_turnos=total_turnos)
 
 @app.route('/reservar_turno', methods=['GET', 'POST'])
+@presupuesto_consultas(6)
 def reservar_turno():
     """
     RUTA: Reservar un turno (Usuario).
     Protegido por sesión de 'usuario'.
     GET: Muestra el formulario de reserva (calendario y canchas).
-    POST: Procesa la reserva, validando la disponibilidad.
+    POST: Procesa la reserva, validando la disponibilidad. Un envío repetido
+    del mismo formulario (misma clave de idempotencia) recibe el resultado del
+    primero sin volver a reservar.
     """
     if 'rol' not in session or session['rol'] != 'usuario' or 'user_id' not in session:
         flash('Debes iniciar sesión como usuario para reservar un turno.', 'error')
@@ -1032,48 +3189,18 @@ def reservar_turno():
     
     if request.method == 'POST':
         try:
-            # 1. Recoger datos del formulario
-            fecha_str = request.form['fecha']
-            hora_inicio_str = request.form['hora_inicio']
-            cancha_id = int(request.form['cancha'])
-            usuario_id = session['user_id']
-            
-            # 2. Obtener datos de la cancha (para el precio)
-            cancha_seleccionada = Cancha.query.get(cancha_id)
-            if not cancha_seleccionada:
-                flash('Cancha no encontrada.', 'error')
-                return redirect(url_for('reservar_turno'))
-
-            # 3. Calcular hora de fin (asumimos 1 hora)
-            hora_inicio_dt = datetime.strptime(hora_inicio_str, '%H:%M')
-            hora_fin_dt = hora_inicio_dt + timedelta(hours=1)
-            hora_fin_str = hora_fin_dt.strftime('%H:%M')
-
-            # 4. Validación CRÍTICA: Verificar que el turno no esté ocupado
-            reserva_existente = Reserva.query.filter_by(
-                fecha=fecha_str,
-                hora_inicio=hora_inicio_str,
-                cancha_id=cancha_id,
-                estado='activa' # Solo importa si está activa
-            ).first()
-            
-            if reserva_existente:
-                flash('Lo sentimos, el turno seleccionado ya ha sido reservado.', 'error')
-                return redirect(url_for('reservar_turno'))
-            
-            # 5. Crear la reserva en la DB
-            nueva_reserva = Reserva(
-                usuario_id=usuario_id,
-                cancha_id=cancha_id,
-                fecha=fecha_str,
-                hora_inicio=hora_inicio_str,
-                hora_fin=hora_fin_str,
-                monto=cancha_seleccionada.monto,
-                estado='activa'
+            # 1. Recoger datos del formulario y la clave que identifica este envío
+            datos = {campo: request.form.get(campo) for campo in ('cancha', 'fecha', 'hora_inicio')}
+            clave = request.headers.get('Idempotency-Key') or request.form.get('clave_idempotencia')
+
+            # 2. Reservar (o recuperar el resultado del envío original)
+            resultado, _ = ejecutar_idempotente(
+                session['user_id'], clave, datos,
+                lambda: reservar_turnos_usuario(session['user_id'], [(datos['cancha'], datos['fecha'], datos['hora_inicio'])])
             )
-            
-            db.session.add(nueva_reserva)
-            db.session.commit()
+            if resultado['estado'] != 201:
+                flash(resultado['error'], 'error')
+                return redirect(url_for('reservar_turno'))
             
             flash('Turno reservado exitosamente.', 'success')
             return redirect(url_for('mis_turnos'))
@@ -1083,11 +3210,22 @@ def reservar_turno():
             flash(f'Error en la reserva. Por favor, revisa los datos: {e}', 'error')
             return redirect(url_for('reservar_turno'))
 
-    # Método GET: Cargar canchas para el formulario
-    canchas = Cancha.query.all()
-    return render_template('reservar_turno.html', canchas=canchas)
+    # Método GET: Cargar canchas para el formulario. Cada formulario lleva su
+    # propia clave: los reenvíos del mismo formulario se reconocen como repetidos
+    canchas = catalogo_canchas.todas()
+    return render_template('reservar_turno.html', canchas=canchas, clave_idempotencia=uuid.uuid4().hex)
+
+def consulta_historial_turnos(usuario_id):
+    """Todos los turnos del usuario (activos y cancelados), del más reciente al más antiguo."""
+    return select(
+        Reserva.id, Reserva.fecha, Reserva.hora_inicio, Reserva.hora_fin, Reserva.monto, Reserva.estado,
+        Reserva.cancha_id
+    ).where(
+        Reserva.usuario_id == usuario_id
+    ).order_by(Reserva.fecha.desc(), Reserva.hora_inicio.desc())
 
 @app.route('/mis_turnos')
+@presupuesto_consultas(2)
 def mis_turnos():
     """
     RUTA: Ver historial de turnos (Usuario).
@@ -1100,19 +3238,19 @@ def mis_turnos():
 
     usuario_id = session['user_id']
     
-    # Consulta que une Reservas y Canchas para el usuario logueado
-    mis_reservas_db = db.session.query(Reserva, Cancha).join(Cancha).filter(
-        Reserva.usuario_id == usuario_id
-    ).order_by(Reserva.fecha.desc(), Reserva.hora_inicio.desc()).all()
+    # Reservas del usuario logueado; los datos de la cancha salen del catálogo en memoria.
+    # Sólo se traen las columnas que muestra la plantilla (sin armar objetos ORM)
+    mis_reservas_db = db.session.execute(consulta_historial_turnos(usuario_id)).all()
 
     # Formatear los datos para el template
     mis_reservas_list = []
-    for reserva, cancha in mis_reservas_db:
+    for reserva in mis_reservas_db:
+        cancha = catalogo_canchas.obtener(reserva.cancha_id)
         mis_reservas_list.append({
             'id': reserva.id,
             'fecha': reserva.fecha,
-            'hora_inicio': reserva.hora_inicio,
-            'hora_fin': reserva.hora_fin,
+            'hora_inicio': formatear_hora(reserva.hora_inicio),
+            'hora_fin': formatear_hora(reserva.hora_fin),
             'monto': reserva.monto,
             'estado': reserva.estado,
             'cancha_nombre': cancha.nombre,
@@ -1123,6 +3261,7 @@ def mis_turnos():
     return render_template('mis_turnos.html', mis_turnos=mis_reservas_list)
 
 @app.route('/cancelar_turno/<int:reserva_id>')
+@presupuesto_consultas(7)
 def cancelar_turno(reserva_id):
     """
     RUTA: Cancelar un turno (Usuario).
@@ -1133,33 +3272,24 @@ def cancelar_turno(reserva_id):
         flash('Debes iniciar sesión como usuario para cancelar un turno.', 'error')
         return redirect(url_for('iniciar_sesion_usuario'))
     
-    usuario_id = session['user_id']
-    
-    # Buscar la reserva, asegurando que sea del usuario y esté activa
-    reserva_a_cancelar = Reserva.query.filter_by(
-        id=reserva_id,
-        usuario_id=usuario_id,
-        estado='activa' 
-    ).first()
-    
-    if reserva_a_cancelar:
-        try:
-            # Lógica de cancelación: solo se cambia el estado
-            reserva_a_cancelar.estado = 'cancelada'
-            db.session.commit()
+    try:
+        # Sólo se cancela si la reserva es del usuario y está activa (si no se
+        # encuentra, es porque no existe, ya estaba cancelada o no es del usuario)
+        resultado = cancelar_turnos_usuario(session['user_id'], [reserva_id])
+        if resultado['estado'] == 200:
             flash('Turno cancelado exitosamente.', 'success')
-        except Exception as e:
-            db.session.rollback()
-            flash(f'Error al cancelar el turno: {e}', 'error')
-    else:
-        # Si no se encuentra, es porque no existe, ya estaba cancelada o no es del usuario
-        flash('No se pudo encontrar o cancelar el turno.', 'error')
+        else:
+            flash(resultado['error'], 'error')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error al cancelar el turno: {e}', 'error')
         
     return redirect(url_for('mis_turnos'))
 
 # --- Rutas de API (para JavaScript/Frontend) ---
 
 @app.route('/api/turnos_disponibles/<fecha>')
+@presupuesto_consultas(3)
 def api_turnos_disponibles(fecha):
     """
     API ENDPOINT: Obtener horarios disponibles para una fecha específica.
@@ -1171,45 +3301,37 @@ def api_turnos_disponibles(fecha):
         if 'rol' not in session or session['rol'] != 'usuario':
             return jsonify({'error': 'No autorizado'}), 403
 
-        # 1. Obtener todas las canchas
-        canchas = Cancha.query.all()
-        
-        # 2. Obtener reservas activas para esa fecha
-        reservas_en_fecha = Reserva.query.filter_by(
-            fecha=fecha,
-            estado='activa'
-        ).all()
+        # Validar el formato para no cargar fechas inválidas en el motor
+        try:
+            fecha = datetime.strptime(fecha, '%Y-%m-%d').date()
+        except ValueError:
+            return jsonify({'error': 'Formato de fecha inválido (YYYY-MM-DD)'}), 400
 
-        # 3. Crear un 'set' (conjunto) de horarios ocupados para búsqueda rápida
-        # Guardamos tuplas (id_cancha, hora_inicio)
-        horarios_ocupados = set()
-        for r in reservas_en_fecha:
-            horarios_ocupados.add( (r.cancha_id, r.hora_inicio) )
+        # Si nada cambió en la fecha desde la última respuesta al cliente, 304
+        no_modificado, versiones = respuesta_condicional(
+            'api_turnos_disponibles', claves=(f'reservas:{fecha.isoformat()}', 'canchas', 'reconstruccion'))
+        if no_modificado: return no_modificado
+
+        # 1. Obtener todas las canchas (del catálogo en memoria, con la versión ya leída para el ETag)
+        canchas = catalogo_canchas.todas(versiones['canchas'])
+        
+        # 2. Obtener la ocupación de la fecha desde el motor en memoria
+        # (sólo consulta la DB si la fecha no está cargada, expiró o cambió su versión)
+        ocupacion = ocupacion_turnos.obtener(fecha, version_fecha(versiones, fecha))
 
-        # 4. Preparar la respuesta JSON
+        # 3. Preparar la respuesta JSON
         canchas_json = [
             {'id': c.id, 'nombre': c.nombre, 'tipo': c.tipo, 'condicion': c.condicion, 'monto': c.monto} 
             for c in canchas
         ]
         
-        horarios_disponibles = {}
-        for cancha in canchas:
-            cancha_id = cancha.id
-            horarios_disponibles[cancha_id] = []
-            
-            # 5. Iterar sobre el rango de horas operativas (definido en constantes)
-            for hora in range(HORA_APERTURA, HORA_CIERRE):
-                hora_inicio = f"{hora:02d}:00"
-                hora_fin = f"{hora+1:02d}:00"
-                
-                # Si el turno (cancha, hora) NO está en el set de ocupados, está libre
-                if (cancha_id, hora_inicio) not in horarios_ocupados:
-                    horarios_disponibles[cancha_id].append({
-                        'hora_inicio': hora_inicio,
-                        'hora_fin': hora_fin
-                    })
-
-        # 6. Devolver la respuesta JSON
+        # 4. Un turno está libre si su bit no está encendido en el bitmap de la cancha
+        horarios_disponibles = {
+            cancha.id: horarios_libres(ocupacion.get(cancha.id, 0))
+            for cancha in canchas
+        }
+
+        # 5. Devolver la respuesta JSON
         return jsonify({
             'canchas': canchas_json,
             'horarios_disponibles': horarios_disponibles
@@ -1219,6 +3341,340 @@ def api_turnos_disponibles(fecha):
         app.logger.error(f"Error en api_turnos_disponibles: {str(e)}")
         return jsonify({'error': 'Error interno del servidor'}), 500
 
+@app.route('/api/turnos_disponibles')
+@presupuesto_consultas(3)
+def api_turnos_disponibles_rango():
+    """
+    API ENDPOINT: Obtener horarios disponibles para un rango de fechas.
+    Parámetros: ?desde=YYYY-MM-DD&hasta=YYYY-MM-DD (máximo MAX_DIAS_RANGO días).
+    Usado por el calendario para precargar todo el mes visible en una sola request.
+    Devuelve, por día, los horarios libres de cada cancha y la cantidad de turnos libres.
+    """
+    try:
+        # Seguridad: Solo usuarios logueados pueden consultar la API
+        if 'rol' not in session or session['rol'] != 'usuario':
+            return jsonify({'error': 'No autorizado'}), 403
+
+        # 1. Validar el rango solicitado
+        try:
+            desde = datetime.strptime(request.args['desde'], '%Y-%m-%d').date()
+            hasta = datetime.strptime(request.args['hasta'], '%Y-%m-%d').date()
+        except (KeyError, ValueError):
+            return jsonify({'error': 'Parámetros desde/hasta inválidos (YYYY-MM-DD)'}), 400
+
+        cantidad_dias = (hasta - desde).days + 1
+        if cantidad_dias < 1 or cantidad_dias > MAX_DIAS_RANGO:
+            return jsonify({'error': f'El rango debe tener entre 1 y {MAX_DIAS_RANGO} días'}), 400
+
+        fechas = [desde + timedelta(days=i) for i in range(cantidad_dias)]
+
+        # Si nada cambió en el rango desde la última respuesta al cliente, 304
+        no_modificado, versiones = respuesta_condicional(
+            'api_turnos_disponibles_rango',
+            claves=[f'reservas:{fecha.isoformat()}' for fecha in fechas] + ['canchas', 'reconstruccion'])
+        if no_modificado: return no_modificado
+
+        # 2. Canchas y ocupación de todo el rango (una sola consulta para las fechas faltantes)
+        canchas = catalogo_canchas.todas(versiones['canchas'])
+        ocupacion_por_fecha = ocupacion_turnos.obtener_varias(
+            fechas, {fecha: version_fecha(versiones, fecha) for fecha in fechas})
+
+        canchas_json = [
+            {'id': c.id, 'nombre': c.nombre, 'tipo': c.tipo, 'condicion': c.condicion, 'monto': c.monto} 
+            for c in canchas
+        ]
+
+        # 3. Armar la respuesta por día
+        dias = {}
+        for fecha in fechas:
+            ocupacion = ocupacion_por_fecha[fecha]
+            horarios_disponibles = {
+                cancha.id: horarios_libres(ocupacion.get(cancha.id, 0))
+                for cancha in canchas
+            }
+            dias[fecha.isoformat()] = {
+                'horarios_disponibles': horarios_disponibles,
+                'turnos_libres': sum(len(libres) for libres in horarios_disponibles.values())
+            }
+
+        return jsonify({
+            'canchas': canchas_json,
+            'turnos_por_dia': len(canchas) * len(HORARIOS_OPERATIVOS),
+            'dias': dias
+        })
+
+    except Exception as e:
+        app.logger.error(f"Error en api_turnos_disponibles_rango: {str(e)}")
+        return jsonify({'error': 'Error interno del servidor'}), 500
+
+@app.route('/api/turnos_stream')
+@presupuesto_consultas(0)
+def api_turnos_stream():
+    """
+    API ENDPOINT (Server-Sent Events): avisa en vivo los turnos de una fecha
+    que se ocupan o se liberan, apenas se confirma la reserva o cancelación.
+    Usado por JavaScript para actualizar la grilla de turnos sin recargarla.
+    Eventos: 'ocupado' / 'liberado' ({fecha, cancha_id, hora_inicio}) y
+    'recargar' (cambiaron las canchas o se perdieron avisos: pedir todo de nuevo).
+    """
+    # Seguridad: Solo usuarios logueados pueden consultar la API
+    if 'rol' not in session or session['rol'] != 'usuario':
+        return jsonify({'error': 'No autorizado'}), 403
+
+    try:
+        fecha = datetime.strptime(request.args.get('fecha', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'error': 'Parámetro fecha inválido (YYYY-MM-DD)'}), 400
+
+    # Cada conexión ocupa un hilo: pasado el límite el cliente sigue sin avisos en vivo
+    if not conexiones_en_vivo.acquire(blocking=False):
+        return jsonify({'error': 'Demasiadas conexiones en vivo, intente más tarde'}), 503
+
+    def generar():
+        # La suscripción se abre antes del primer envío: cuando el navegador
+        # recibe la respuesta (y vuelve a pedir la disponibilidad) ya no se
+        # pierde ningún aviso posterior
+        with eventos_turnos.suscribir(fecha.isoformat(), CANAL_TODAS) as suscripcion:
+            yield 'retry: 3000\n\n'
+            fin = time.monotonic() + app.config['EVENTOS_DURACION_MAX_S']
+            while time.monotonic() < fin:
+                mensaje = suscripcion.esperar(app.config['EVENTOS_KEEPALIVE_S'])
+                if mensaje is None:
+                    yield ': sin novedades\n\n'
+                else:
+                    yield f"event: {mensaje['tipo']}\ndata: {json.dumps(mensaje)}\n\n"
+
+    respuesta = Response(generar(), mimetype='text/event-stream')
+    # El servidor cierra la respuesta siempre, aunque el cliente se vaya antes
+    # del primer envío (en ese caso el generador nunca llega a ejecutarse)
+    respuesta.call_on_close(conexiones_en_vivo.release)
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    respuesta.headers['X-Accel-Buffering'] = 'no' # Sin buffer en nginx: cada aviso sale al instante
+    return respuesta
+
+# --- API de reservas (app móvil, mostrador) ---
+
+# Un lote hace las mismas escrituras que una reserva o cancelación suelta por cada
+# turno (INSERT/UPDATE, dos filas de resumen y la versión de la fecha), más la
+# verificación del catálogo, al cancelar la lectura de las reservas y, antes del
+# commit, la de las versiones que quedan (para el motor de ocupación)
+PRESUPUESTO_LOTE_RESERVAS = 3 + 4 * app.config['API_RESERVAS_MAX_LOTE']
+
+def respuesta_api_reservas(resultado, repetido, lote):
+    """
+    Arma la respuesta JSON de un resultado de reservar_turnos_usuario o
+    cancelar_turnos_usuario: {'reserva': ...} (o {'reservas': [...]} en un lote)
+    o {'error': mensaje} con 'indice' / 'ids' si el resultado los trae.
+    """
+    if 'error' in resultado:
+        cuerpo = {campo: resultado[campo] for campo in ('error', 'indice', 'ids') if campo in resultado}
+    elif lote:
+        cuerpo = {'reservas': resultado['reservas']}
+    else:
+        cuerpo = {'reserva': resultado['reservas'][0]}
+    respuesta = jsonify(cuerpo)
+    respuesta.status_code = resultado['estado']
+    if repetido:
+        respuesta.headers['Idempotent-Replayed'] = 'true'
+    return respuesta
+
+# Orden de GET /api/reservas: de la más próxima a la más lejana; el id desempata
+ORDEN_API_RESERVAS = ((Reserva.fecha, False), (Reserva.hora_inicio, False), (Reserva.id, False))
+
+def consulta_pagina_reservas_usuario(usuario_id, estado, filtros, cursor, limite):
+    """Una página de las reservas del usuario para la API, más una fila para saber si hay otra."""
+    consulta = select(
+        Reserva.id, Reserva.cancha_id, Reserva.fecha, Reserva.hora_inicio, Reserva.hora_fin, Reserva.monto
+    ).where(Reserva.usuario_id == usuario_id, Reserva.estado == estado, *filtros)
+    if cursor:
+        consulta = consulta.where(condicion_despues_de(ORDEN_API_RESERVAS, cursor))
+    return consulta.order_by(*(columna for columna, _ in ORDEN_API_RESERVAS)).limit(limite + 1)
+
+@app.route('/api/reservas', methods=['GET'])
+@presupuesto_consultas(2)
+def api_listar_reservas():
+    """
+    API ENDPOINT: Reservas del usuario logueado, de la más próxima a la más
+    lejana, paginadas por cursor (TURNOS_POR_PAGINA por página).
+    Filtros opcionales: estado ('activa' por defecto, o 'cancelada'), desde,
+    hasta (YYYY-MM-DD), cancha y cursor (el 'siguiente' de la página anterior).
+    """
+    # Seguridad: Solo usuarios logueados pueden consultar sus reservas
+    if 'rol' not in session or session['rol'] != 'usuario' or 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 403
+
+    estado = request.args.get('estado', 'activa')
+    if estado not in ('activa', 'cancelada'):
+        return jsonify({'error': 'Estado inválido'}), 400
+    try:
+        filtros = filtros_listado_turnos({campo: request.args.get(campo) for campo in ('desde', 'hasta', 'cancha')})
+        cursor = decodificar_cursor(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError:
+        return jsonify({'error': 'Filtro o cursor inválido'}), 400
+
+    limite = app.config['TURNOS_POR_PAGINA']
+    filas = db.session.execute(
+        consulta_pagina_reservas_usuario(session['user_id'], estado, filtros, cursor, limite)).all()
+
+    siguiente = None
+    if len(filas) > limite:
+        filas = filas[:limite]
+        siguiente = codificar_cursor(filas[-1].fecha, filas[-1].hora_inicio, filas[-1].id)
+    return jsonify({
+        'reservas': [reserva_a_json(r.id, catalogo_canchas.obtener(r.cancha_id), r.fecha, r.hora_inicio, r.hora_fin,
+                                    r.monto, estado) for r in filas],
+        'siguiente': siguiente
+    })
+
+@app.route('/api/reservas', methods=['POST'])
+@presupuesto_consultas(PRESUPUESTO_LOTE_RESERVAS)
+def api_crear_reserva():
+    """
+    API ENDPOINT: Reservar turnos (Usuario).
+    Recibe un JSON {cancha_id, fecha: 'YYYY-MM-DD', hora_inicio: 'HH:MM'} o un
+    lote {reservas: [{...}, ...]} de hasta API_RESERVAS_MAX_LOTE turnos, que se
+    reservan todos o ninguno. Opcionalmente, el encabezado Idempotency-Key:
+    reintentar con la misma clave devuelve el resultado original (con
+    'Idempotent-Replayed: true') sin volver a reservar.
+    Respuestas: 201 con {'reserva'} o {'reservas'}; 400/404/409/422 con
+    {'error': mensaje} (en un lote, 'indice' indica el turno que falló).
+    """
+    # Seguridad: Solo usuarios logueados pueden reservar
+    if 'rol' not in session or session['rol'] != 'usuario' or 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 403
+
+    cuerpo = request.get_json(silent=True)
+    if not isinstance(cuerpo, dict):
+        return jsonify({'error': 'Se esperaba un objeto JSON'}), 400
+    lote = 'reservas' in cuerpo
+    turnos = cuerpo['reservas'] if lote else [cuerpo]
+    if not isinstance(turnos, list) or not 0 < len(turnos) <= app.config['API_RESERVAS_MAX_LOTE']:
+        return jsonify({'error': f"'reservas' debe tener entre 1 y {app.config['API_RESERVAS_MAX_LOTE']} turnos"}), 400
+    if not all(isinstance(t, dict) and isinstance(t.get('fecha'), str) and isinstance(t.get('hora_inicio'), str)
+               for t in turnos):
+        return jsonify({'error': 'Cada turno necesita cancha_id, fecha y hora_inicio'}), 400
+    pedidos = [(t.get('cancha_id'), t['fecha'], t['hora_inicio']) for t in turnos]
+
+    try:
+        resultado, repetido = ejecutar_idempotente(
+            session['user_id'], request.headers.get('Idempotency-Key'), {'reservar': pedidos, 'lote': lote},
+            lambda: reservar_turnos_usuario(session['user_id'], pedidos)
+        )
+    except Exception as e:
+        db.session.rollback()
+        app.logger.exception(f"Error en /api/reservas: {e}")
+        return jsonify({'error': 'Error interno al reservar'}), 500
+    return respuesta_api_reservas(resultado, repetido, lote)
+
+@app.route('/api/reservas', methods=['DELETE'])
+@app.route('/api/reservas/<int:reserva_id>', methods=['DELETE'])
+@presupuesto_consultas(PRESUPUESTO_LOTE_RESERVAS)
+def api_cancelar_reservas(reserva_id=None):
+    """
+    API ENDPOINT: Cancelar reservas (Usuario).
+    DELETE /api/reservas/<id> cancela una; DELETE /api/reservas con un JSON
+    {ids: [...]} cancela un lote de hasta API_RESERVAS_MAX_LOTE, todas o ninguna.
+    Acepta Idempotency-Key igual que el alta.
+    Respuestas: 200 con {'reserva'} o {'reservas'}; 404 con {'error', 'ids'}
+    (las reservas que no existen, no son del usuario o ya estaban canceladas).
+    """
+    # Seguridad: Solo usuarios logueados pueden cancelar
+    if 'rol' not in session or session['rol'] != 'usuario' or 'user_id' not in session:
+        return jsonify({'error': 'No autorizado'}), 403
+
+    lote = reserva_id is None
+    if lote:
+        cuerpo = request.get_json(silent=True)
+        ids = cuerpo.get('ids') if isinstance(cuerpo, dict) else None
+        if (not isinstance(ids, list) or not 0 < len(ids) <= app.config['API_RESERVAS_MAX_LOTE']
+                or not all(type(i) is int for i in ids)):
+            return jsonify({'error': f"'ids' debe ser una lista de 1 a {app.config['API_RESERVAS_MAX_LOTE']} ids"}), 400
+    else:
+        ids = [reserva_id]
+
+    try:
+        resultado, repetido = ejecutar_idempotente(
+            session['user_id'], request.headers.get('Idempotency-Key'), {'cancelar': ids, 'lote': lote},
+            lambda: cancelar_turnos_usuario(session['user_id'], ids)
+        )
+    except Exception as e:
+        db.session.rollback()
+        app.logger.exception(f"Error en /api/reservas (DELETE): {e}")
+        return jsonify({'error': 'Error interno al cancelar'}), 500
+    return respuesta_api_reservas(resultado, repetido, lote)
+
+@app.route('/api/turnos_administrador/<estado>')
+@presupuesto_consultas(3)
+def api_turnos_administrador(estado):
+    """
+    RUTA API (Admin): Página siguiente de un listado de turnos ('activa' o
+    'cancelada'), para la carga progresiva al hacer scroll.
+    Recibe el 'cursor' devuelto por la página anterior y los mismos filtros
+    que la vista (desde, hasta, cancha, usuario).
+    """
+    error_redirect = verificar_admin()
+    if error_redirect: return error_redirect
+
+    if estado not in ORDEN_LISTADOS_TURNOS:
+        return jsonify({'error': 'Estado inválido'}), 404
+    try:
+        filtros = filtros_listado_turnos(request.args)
+        cursor = decodificar_cursor(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError:
+        return jsonify({'error': 'Filtro o cursor inválido'}), 400
+
+    try:
+        reservas_por_dia, siguiente = pagina_turnos_por_dia(estado, filtros, cursor)
+        return jsonify({
+            'dias': [{'fecha': fecha.isoformat(), 'turnos': turnos} for fecha, turnos in reservas_por_dia],
+            'siguiente': siguiente
+        })
+    except Exception as e:
+        app.logger.error(f"Error en api_turnos_administrador: {str(e)}")
+        return jsonify({'error': 'Error interno del servidor'}), 500
+
+@app.route('/api/estadisticas_cache')
+@presupuesto_consultas(1)
+def api_estadisticas_cache():
+    """
+    RUTA API (Admin): Aciertos, fallos e invalidaciones de las cachés de este
+    proceso (worker), para evaluar si el TTL configurado es el adecuado.
+    """
+    error_redirect = verificar_admin()
+    if error_redirect: return error_redirect
+
+    return jsonify({
+        'pid': os.getpid(),
+        'kpis': cache_kpis.estadisticas(),
+        'administradores': cache_admins.estadisticas()
+    })
+
+@app.route('/api/rendimiento')
+@presupuesto_consultas(1)
+def api_rendimiento():
+    """
+    RUTA API (Admin): Mediciones de rendimiento de este worker en JSON: el
+    resumen por ruta y las últimas requests (hasta RENDIMIENTO_MUESTRAS).
+    """
+    error_redirect = verificar_admin()
+    if error_redirect: return error_redirect
+
+    return jsonify({
+        'pid': os.getpid(),
+        'consulta_lenta_ms': app.config['CONSULTA_LENTA_MS'],
+        'resumen': registro_rendimiento.resumen_por_ruta(),
+        'recientes': registro_rendimiento.muestras()
+    })
+
+@app.route('/metrics')
+@presupuesto_consultas(0)
+def metricas_prometheus():
+    """
+    RUTA (Monitoreo): Métricas en formato de texto de Prometheus: latencia y
+    requests por ruta, y contadores de reservas, cancelaciones y conflictos.
+    Con METRICAS_DIR suma los valores de todos los workers.
+    """
+    return Response(metricas.exportar(), mimetype='text/plain; version=0.0.4; charset=utf-8')
 
 # --- Final de la aplicación ---
 if __name__ == '__main__':
@@ -0,0 +1,1171 @@
+"""
+Benchmarks de las rutas críticas del sistema de reservas.
+
+Se ejecuta contra la base configurada en app.py (o la indicada en la
+variable de entorno DATABASE_URL, ej: sqlite:///bench.db).
+
+Uso:
+    python benchmark.py disponibilidad --fecha 2025-11-20 --iteraciones 500
+    python benchmark.py estres_reserva --fecha 2030-01-15 --hora 20:00 --cancha 1 --concurrencia 300
+    python benchmark.py informe --iteraciones 20
+    python benchmark.py reportes --iteraciones 50
+    python benchmark.py consultas_admin
+    python benchmark.py presupuestos        # para CI: falla si una ruta supera su presupuesto de consultas
+    python benchmark.py etag --fecha 2030-01-16  # para CI: un ETag nunca sobrevive a una escritura
+    python benchmark.py metricas --iteraciones 200000
+    python benchmark.py login --atacantes 16  # reservas durante una ola de logins fallidos
+    python benchmark.py idempotencia --fecha 2030-01-17  # envíos repetidos reservan una sola vez
+    python benchmark.py api_reservas --turnos 60  # formulario vs API JSON (de a uno y en lotes)
+
+Suite de carga (sobre una base vacía, ej: DATABASE_URL=sqlite:///carga.db):
+    python benchmark.py sembrar --usuarios 2000 --canchas 6 --anios 3 --semilla 42
+    python benchmark.py carga --concurrencia 8 --pedidos 300 --salida antes.json
+    python benchmark.py comparar antes.json despues.json
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import defaultdict, Counter
+from datetime import datetime, timedelta, time as dt_time
+
+from sqlalchemy import func, insert
+from werkzeug.security import generate_password_hash
+
+# --- IMPORTANTE: Importamos la app, la DB y los modelos ---
+from app import (app, db, Administrador, Usuario, Cancha, Reserva, Gasto, ocupacion_turnos, horarios_libres, parsear_turno,
+                 formatear_hora, calcular_informe_financiero, contar_consultas, HORA_APERTURA, HORA_CIERRE,
+                 cache_kpis, cache_admins, BackendMemoria, PresupuestoConsultasExcedido, percentil,
+                 MetricasProceso, reconstruir_resumen_diario, insertar_reserva, metricas,
+                 VerificadorContrasenas, LimitadorIntentos, catalogo_canchas)
+import app as modulo_app # Para reemplazar el verificador de contraseñas en 'login'
+
+
+def medir(funcion, iteraciones, *args):
+    """Ejecuta 'funcion' N veces y devuelve las latencias en milisegundos."""
+    muestras = []
+    for _ in range(iteraciones):
+        inicio = time.perf_counter()
+        funcion(*args)
+        muestras.append((time.perf_counter() - inicio) * 1000)
+        # Sesión limpia en cada iteración, como en una request real
+        db.session.remove()
+    return muestras
+
+def mostrar_resultado(nombre, muestras):
+    """Imprime p50/p99 de una serie de muestras."""
+    print(f"  {nombre:<22} p50={percentil(muestras, 50):8.3f} ms   "
+          f"p99={percentil(muestras, 99):8.3f} ms   (n={len(muestras)})")
+
+
+# --- Benchmark: /api/turnos_disponibles ---
+
+def disponibilidad_por_consulta(fecha):
+    """
+    Camino original de api_turnos_disponibles: consulta las reservas activas
+    de la fecha, arma un set de ocupados y recorre todas las horas.
+    """
+    canchas = Cancha.query.all()
+    reservas_en_fecha = Reserva.query.filter_by(fecha=fecha, estado='activa').all()
+    horarios_ocupados = {(r.cancha_id, formatear_hora(r.hora_inicio)) for r in reservas_en_fecha}
+
+    horarios_disponibles = {}
+    for cancha in canchas:
+        horarios_disponibles[cancha.id] = []
+        for hora in range(HORA_APERTURA, HORA_CIERRE):
+            hora_inicio = f"{hora:02d}:00"
+            if (cancha.id, hora_inicio) not in horarios_ocupados:
+                horarios_disponibles[cancha.id].append({
+                    'hora_inicio': hora_inicio,
+                    'hora_fin': f"{hora+1:02d}:00"
+                })
+    return horarios_disponibles
+
+def disponibilidad_por_bitmap(fecha):
+    """Camino nuevo: lee la ocupación desde el motor en memoria."""
+    canchas = Cancha.query.all()
+    ocupacion = ocupacion_turnos.obtener(fecha)
+    return {cancha.id: horarios_libres(ocupacion.get(cancha.id, 0)) for cancha in canchas}
+
+def benchmark_disponibilidad(args):
+    """Compara la latencia del camino por consulta contra el bitmap en memoria."""
+    fecha = datetime.strptime(args.fecha, '%Y-%m-%d').date()
+    with app.app_context():
+        # Verificación: ambos caminos deben devolver lo mismo
+        if disponibilidad_por_consulta(fecha) != disponibilidad_por_bitmap(fecha):
+            print("ERROR: el bitmap y la consulta devuelven resultados distintos.")
+            return 1
+
+        print(f"Disponibilidad para {args.fecha} ({args.iteraciones} iteraciones):")
+        mostrar_resultado('consulta (original)', medir(disponibilidad_por_consulta, args.iteraciones, fecha))
+        mostrar_resultado('bitmap en memoria', medir(disponibilidad_por_bitmap, args.iteraciones, fecha))
+    return 0
+
+
+# --- Prueba de estrés: reservas concurrentes sobre el mismo turno ---
+
+def benchmark_estres_reserva(args):
+    """
+    Dispara N POST simultáneos a /reservar_turno para el mismo turno, cada uno
+    desde un cliente y un usuario distintos, y verifica que exactamente uno gane.
+    El turno elegido debe estar libre (se recomienda una fecha futura sin uso).
+    """
+    fecha, hora_inicio, _ = parsear_turno(args.fecha, args.hora)
+    with app.app_context():
+        ocupado = Reserva.query.filter_by(
+            fecha=fecha, hora_inicio=hora_inicio, cancha_id=args.cancha, estado='activa'
+        ).first()
+        if ocupado:
+            print(f"ERROR: el turno {args.fecha} {args.hora} (cancha {args.cancha}) ya está reservado. Elige otro.")
+            return 1
+        usuarios_ids = [u.id for u in Usuario.query.limit(args.concurrencia).all()]
+        db.session.remove()
+    if not usuarios_ids:
+        print("ERROR: no hay usuarios en la base. Ejecuta 'python crear_usuarios.py' primero.")
+        return 1
+
+    barrera = threading.Barrier(args.concurrencia)
+    resultados = []
+    lock_resultados = threading.Lock()
+
+    def reservar(usuario_id):
+        cliente = app.test_client()
+        with cliente.session_transaction() as sesion:
+            sesion['rol'] = 'usuario'
+            sesion['user_id'] = usuario_id
+            sesion['nombre_usuario'] = f'estres{usuario_id}'
+        barrera.wait() # Todos los hilos salen a la vez
+        respuesta = cliente.post('/reservar_turno', data={
+            'fecha': args.fecha, 'hora_inicio': args.hora, 'cancha': str(args.cancha)
+        })
+        exito = respuesta.status_code == 302 and respuesta.location.endswith('/mis_turnos')
+        with lock_resultados:
+            resultados.append(exito)
+
+    hilos = [
+        threading.Thread(target=reservar, args=(usuarios_ids[i % len(usuarios_ids)],))
+        for i in range(args.concurrencia)
+    ]
+    inicio = time.perf_counter()
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    duracion = time.perf_counter() - inicio
+
+    with app.app_context():
+        activas = Reserva.query.filter_by(
+            fecha=fecha, hora_inicio=hora_inicio, cancha_id=args.cancha, estado='activa'
+        ).count()
+
+    exitos = sum(resultados)
+    print(f"{args.concurrencia} POST concurrentes en {duracion:.2f} s: "
+          f"{exitos} exitosos, {len(resultados) - exitos} rechazados, {activas} reservas activas en la DB.")
+    if exitos != 1 or activas != 1:
+        print("ERROR: se esperaba exactamente una reserva exitosa.")
+        return 1
+    print("OK: exactamente una reserva ganó el turno.")
+    return 0
+
+
+# --- Benchmark y paridad: /informe_financiero_administrador ---
+
+def informe_por_filas(hoy):
+    """
+    Camino original del informe financiero: trae todas las reservas activas y
+    todos los gastos como objetos y agrupa cada fila en Python.
+    """
+    balances = {g: defaultdict(lambda: {'ingresos': 0.0, 'egresos': 0.0, 'balance': 0.0})
+                for g in ('diario', 'semanal', 'mensual', 'trimestral', 'anual')}
+
+    def acumular(filas, campo):
+        for fila in filas:
+            monto = float(fila.monto)
+            fecha = fila.fecha
+            if fecha.month == hoy.month and fecha.year == hoy.year:
+                balances['diario'][fecha.isoformat()][campo] += monto
+            balances['semanal'][f"{fecha.year}-Sem {fecha.isocalendar()[1]:02d}"][campo] += monto
+            balances['mensual'][f"{fecha.year}-{fecha.month:02d}"][campo] += monto
+            balances['trimestral'][f"{fecha.year}-T{(fecha.month-1)//3 + 1}"][campo] += monto
+            balances['anual'][str(fecha.year)][campo] += monto
+
+    acumular(Reserva.query.filter_by(estado='activa').all(), 'ingresos')
+    acumular(Gasto.query.all(), 'egresos')
+
+    reportes = {}
+    for granularidad, balance in balances.items():
+        for datos in balance.values():
+            datos['balance'] = datos['ingresos'] - datos['egresos']
+        reportes[granularidad] = sorted(balance.items(), key=lambda item: item[0], reverse=True)
+    return reportes
+
+def redondear_informe(reportes):
+    """Redondea los montos a centavos: el orden de las sumas en SQL puede variar el último decimal."""
+    return {
+        granularidad: [(periodo, {k: round(v, 2) for k, v in datos.items()}) for periodo, datos in filas]
+        for granularidad, filas in reportes.items()
+    }
+
+def benchmark_informe(args):
+    """Verifica que la agregación en SQL coincida con la original y compara latencias."""
+    hoy = datetime.strptime(args.hoy, '%Y-%m-%d').date()
+    with app.app_context():
+        original = redondear_informe(informe_por_filas(hoy))
+        agregado = redondear_informe(calcular_informe_financiero(hoy))
+        if original != agregado:
+            for granularidad in original:
+                if original[granularidad] != agregado.get(granularidad):
+                    print(f"ERROR: el informe '{granularidad}' no coincide entre ambos caminos.")
+            return 1
+        periodos = sum(len(filas) for filas in agregado.values())
+        print(f"OK: ambos caminos devuelven el mismo informe ({periodos} períodos).")
+
+        print(f"Informe financiero ({args.iteraciones} iteraciones):")
+        mostrar_resultado('filas en Python', medir(informe_por_filas, args.iteraciones, hoy))
+        mostrar_resultado('resumen diario (SQL)', medir(calcular_informe_financiero, args.iteraciones, hoy))
+    return 0
+
+
+# --- Benchmark: rutas del administrador ---
+
+# Rutas GET del panel de administración (sin efectos sobre los datos)
+RUTAS_ADMIN = [
+    '/panel_administrador',
+    '/gestionar_canchas',
+    '/agregar_cancha',
+    '/gestionar_usuarios',
+    '/ver_turnos_administrador',
+    '/ver_turnos_cancelados_administrador',
+    '/api/turnos_administrador/activa',
+    '/api/turnos_administrador/cancelada',
+    '/informe_financiero_administrador',
+    '/panel_reportes',
+    '/reporte_gastos',
+    '/gestionar_gastos',
+    '/cargar_gasto',
+    '/api/estadisticas_cache',
+    '/admin/rendimiento',
+    '/api/rendimiento',
+    '/admin/hashes_contrasenas',
+]
+
+def cliente_administrador():
+    """Devuelve un test_client con una sesión de administrador válida, o None si no hay admins."""
+    with app.app_context():
+        administrador = Administrador.query.first()
+        db.session.remove()
+    if not administrador:
+        print("ERROR: no hay administradores en la base. Crea uno desde /crear_administrador.")
+        return None
+
+    cliente = app.test_client()
+    with cliente.session_transaction() as sesion:
+        sesion['rol'] = 'administrador'
+        sesion['user_id'] = administrador.id
+        sesion['nombre_usuario'] = administrador.nombre_usuario
+        sesion['admin_epoca'] = app.config['ADMIN_EPOCA']
+    return cliente
+
+def cliente_usuario():
+    """Devuelve un test_client con la sesión del primer usuario, o None si no hay usuarios."""
+    with app.app_context():
+        usuario = Usuario.query.first()
+        db.session.remove()
+    if not usuario:
+        print("ERROR: no hay usuarios en la base. Ejecuta 'python crear_usuarios.py' primero.")
+        return None
+
+    cliente = app.test_client()
+    with cliente.session_transaction() as sesion:
+        sesion['rol'] = 'usuario'
+        sesion['user_id'] = usuario.id
+        sesion['nombre_usuario'] = usuario.nombre_usuario
+    return cliente
+
+def benchmark_reportes(args):
+    """Latencia de punta a punta (consultas + render) de /panel_reportes."""
+    cliente = cliente_administrador()
+    if not cliente:
+        return 1
+    with app.app_context():
+        reservas = db.session.query(func.count(Reserva.id)).scalar()
+        db.session.remove()
+
+    def pedir_reportes():
+        respuesta = cliente.get('/panel_reportes')
+        if respuesta.status_code != 200:
+            raise RuntimeError(f"/panel_reportes respondió {respuesta.status_code}")
+
+    print(f"/panel_reportes con {reservas} reservas ({args.iteraciones} iteraciones):")
+    with app.app_context():
+        mostrar_resultado('panel_reportes', medir(pedir_reportes, args.iteraciones))
+    return 0
+
+def benchmark_consultas_admin(args):
+    """
+    Cantidad de consultas SQL por request en cada ruta del administrador,
+    verificando al admin contra la DB en cada request (antes) y con la caché
+    de administradores válidos (ahora). Cada ruta se pide una vez antes de
+    medir, para que las cachés de la app estén cargadas como en uso normal.
+    """
+    cliente = cliente_administrador()
+    if not cliente:
+        return 1
+
+    def consultas_por_ruta():
+        resultado = {}
+        with app.app_context():
+            for ruta in RUTAS_ADMIN:
+                cliente.get(ruta)
+                with contar_consultas() as contador:
+                    respuesta = cliente.get(ruta)
+                resultado[ruta] = (respuesta.status_code, contador['total'])
+        return resultado
+
+    ttl_original = app.config['ADMIN_CACHE_TTL']
+    app.config['ADMIN_CACHE_TTL'] = 0 # Sin caché: una consulta de verificación por request
+    antes = consultas_por_ruta()
+    app.config['ADMIN_CACHE_TTL'] = ttl_original
+    ahora = consultas_por_ruta()
+
+    print(f"  {'ruta':<42} {'estado':>6} {'antes':>6} {'ahora':>6}")
+    for ruta in RUTAS_ADMIN:
+        estado, consultas_antes = antes[ruta]
+        print(f"  {ruta:<42} {estado:>6} {consultas_antes:>6} {ahora[ruta][1]:>6}")
+    print(f"  {'TOTAL':<42} {'':>6} {sum(c for _, c in antes.values()):>6} {sum(c for _, c in ahora.values()):>6}")
+    return 0
+
+# --- Verificación de presupuestos de consultas (N+1) ---
+
+def vaciar_caches():
+    """Deja frías todas las cachés de la app (peor caso de consultas por request)."""
+    cache_kpis.backend = BackendMemoria()
+    cache_admins.backend = BackendMemoria()
+    ocupacion_turnos.invalidar()
+    catalogo_canchas.invalidar()
+
+def benchmark_presupuestos(args):
+    """
+    Pide cada ruta GET de usuario y de administrador con las cachés frías y
+    VERIFICAR_PRESUPUESTO_CONSULTAS activo. Falla (código 1) si alguna supera
+    el presupuesto declarado con @presupuesto_consultas o no declara uno.
+    """
+    usuario, administrador = cliente_usuario(), cliente_administrador()
+    if not usuario or not administrador:
+        return 1
+
+    hoy = datetime.now().date()
+    rutas = [(usuario, ruta) for ruta in (
+        '/panel_usuario',
+        '/reservar_turno',
+        '/mis_turnos',
+        f'/api/turnos_disponibles/{hoy.isoformat()}',
+        f'/api/turnos_disponibles?desde={hoy.isoformat()}&hasta={hoy.replace(day=28).isoformat()}',
+        '/api/reservas',
+        '/metrics',
+    )] + [(administrador, ruta) for ruta in RUTAS_ADMIN]
+
+    app.config['VERIFICAR_PRESUPUESTO_CONSULTAS'] = True
+    app.config['PROPAGATE_EXCEPTIONS'] = True # El error llega hasta acá en lugar de un 500
+    fallas = 0
+    with app.app_context():
+        for cliente, ruta in rutas:
+            vaciar_caches()
+            vista = app.view_functions[app.url_map.bind('').match(ruta.split('?')[0])[0]]
+            presupuesto = getattr(vista, 'presupuesto_consultas', None)
+            try:
+                with contar_consultas() as contador:
+                    estado = cliente.get(ruta).status_code
+            except PresupuestoConsultasExcedido as e:
+                print(f"[FALLA] {e}")
+                fallas += 1
+                continue
+            if presupuesto is None:
+                print(f"[FALLA] {ruta}: no declara @presupuesto_consultas ({contador['total']} consultas)")
+                fallas += 1
+                continue
+            print(f"[OK] {ruta} ({estado}): {contador['total']}/{presupuesto} consultas")
+
+    if fallas:
+        print(f"{fallas} ruta(s) fuera de presupuesto.")
+        return 1
+    print("Todas las rutas respetan su presupuesto de consultas.")
+    return 0
+
+# --- Verificación de GET condicional (ETag): nunca un 304 con datos viejos ---
+
+def benchmark_etag(args):
+    """
+    Verifica que después de cada tipo de escritura (reserva, cancelación,
+    gasto, edición de cancha, reconstrucción masiva y una reserva hecha por
+    otro worker) el ETag anterior deja de valer y la respuesta trae el dato
+    nuevo, y que sin cambios se responde 304 sin leer las tablas de datos.
+    Usa un turno libre de --fecha (se recomienda una fecha futura sin uso).
+    """
+    usuario, administrador = cliente_usuario(), cliente_administrador()
+    if not usuario or not administrador:
+        return 1
+    fecha, hora_inicio, hora_fin = parsear_turno(args.fecha, args.hora)
+    with app.app_context():
+        cancha = db.session.get(Cancha, args.cancha)
+        ocupado = Reserva.query.filter_by(fecha=fecha, hora_inicio=hora_inicio,
+                                          cancha_id=args.cancha, estado='activa').first()
+        usuario_id = Usuario.query.first().id
+        db.session.remove()
+    if not cancha or ocupado:
+        print(f"ERROR: la cancha {args.cancha} no existe o el turno {args.fecha} {args.hora} ya está reservado.")
+        return 1
+
+    url_dia = f'/api/turnos_disponibles/{args.fecha}'
+    url_rango = f'/api/turnos_disponibles?desde={args.fecha}&hasta={args.fecha}'
+    fallas = []
+
+    def turno_libre(respuesta):
+        datos = respuesta.get_json()
+        libres = datos['horarios_disponibles'] if 'horarios_disponibles' in datos else \
+            datos['dias'][args.fecha]['horarios_disponibles']
+        return any(h['hora_inicio'] == args.hora for h in libres[str(args.cancha)])
+
+    def pedir(cliente, url, etag=None):
+        encabezados = {'If-None-Match': f'"{etag}"'} if etag else {}
+        with contar_consultas() as contador:
+            respuesta = cliente.get(url, headers=encabezados)
+        return respuesta, contador
+
+    def comprobar(condicion, descripcion):
+        print(f"[{'OK' if condicion else 'FALLA'}] {descripcion}")
+        if not condicion:
+            fallas.append(descripcion)
+
+    def etags_actuales():
+        return {url: pedir(cliente, url)[0].get_etag()[0] for cliente, url in rutas}
+
+    rutas = [(usuario, url_dia), (usuario, url_rango), (administrador, '/informe_financiero_administrador'),
+             (administrador, '/panel_reportes'), (administrador, '/reporte_gastos')]
+
+    def verificar_cambio(descripcion, antes, urls_que_cambian):
+        for cliente, url in rutas:
+            respuesta, _ = pedir(cliente, url, antes[url])
+            if url in urls_que_cambian:
+                comprobar(respuesta.status_code == 200, f"{descripcion}: {url} responde 200 con el ETag anterior")
+            else:
+                comprobar(respuesta.status_code == 304, f"{descripcion}: {url} sigue respondiendo 304")
+
+    # Las escrituras siguen la redirección, como el navegador, para que los
+    # mensajes flash se muestren y no dejen la sesión con mensajes pendientes
+    with app.app_context():
+        # 1. Sin cambios: 304 leyendo sólo las versiones
+        antes = etags_actuales()
+        for cliente, url in rutas:
+            respuesta, contador = pedir(cliente, url, antes[url])
+            comprobar(respuesta.status_code == 304 and contador['total'] <= 2,
+                      f"sin cambios: {url} responde {respuesta.status_code} con {contador['total']} consultas")
+        comprobar(turno_libre(pedir(usuario, url_dia)[0]), "el turno de prueba figura libre")
+
+        # 2. Reserva desde la app
+        usuario.post('/reservar_turno', data={'fecha': args.fecha, 'hora_inicio': args.hora, 'cancha': str(args.cancha)},
+                      follow_redirects=True)
+        verificar_cambio("reserva", antes, {url_dia, url_rango, '/informe_financiero_administrador', '/panel_reportes'})
+        comprobar(not turno_libre(pedir(usuario, url_dia, antes[url_dia])[0]), "reserva: el turno ya no figura libre")
+
+        # 3. Cancelación desde la app
+        antes = etags_actuales()
+        reserva_id = db.session.query(Reserva.id).filter_by(
+            fecha=fecha, hora_inicio=hora_inicio, cancha_id=args.cancha, estado='activa').scalar()
+        db.session.remove()
+        usuario.get(f'/cancelar_turno/{reserva_id}', follow_redirects=True)
+        verificar_cambio("cancelación", antes, {url_dia, url_rango, '/informe_financiero_administrador', '/panel_reportes'})
+        comprobar(turno_libre(pedir(usuario, url_dia, antes[url_dia])[0]), "cancelación: el turno vuelve a figurar libre")
+
+        # 4. Reserva hecha por otro worker: la copia en memoria de este proceso no se entera
+        antes = etags_actuales()
+        with app.app_context():
+            insertar_reserva(usuario_id, args.cancha, fecha, hora_inicio, hora_fin, cancha.monto)
+            db.session.commit()
+        verificar_cambio("reserva de otro worker", antes,
+                         {url_dia, url_rango, '/informe_financiero_administrador', '/panel_reportes'})
+        comprobar(not turno_libre(pedir(usuario, url_dia, antes[url_dia])[0]),
+                  "reserva de otro worker: el turno ya no figura libre")
+
+        # 5. Gasto
+        antes = etags_actuales()
+        administrador.post('/cargar_gasto', data={'fecha': args.fecha, 'monto': '1234.50', 'categoria': 'Varios',
+                                                  'concepto': 'Prueba ETag', 'descripcion': ''},
+                           follow_redirects=True)
+        verificar_cambio("gasto", antes, {'/informe_financiero_administrador', '/reporte_gastos'})
+
+        # 6. Edición de cancha
+        antes = etags_actuales()
+        administrador.post(f'/editar_cancha/{args.cancha}', data={
+            'nombre': cancha.nombre, 'tipo': cancha.tipo or '', 'condicion': cancha.condicion or '',
+            'monto': str(cancha.monto)}, follow_redirects=True)
+        verificar_cambio("edición de cancha", antes, {url_dia, url_rango, '/panel_reportes'})
+
+        # 7. Carga masiva por fuera de la app + reconstruir_resumen
+        antes = etags_actuales()
+        with app.app_context():
+            reconstruir_resumen_diario(fecha, fecha)
+            db.session.commit()
+        verificar_cambio("reconstrucción", antes, {url for _, url in rutas})
+
+        # 8. Con mensajes flash pendientes la página no se etiqueta (tiene que mostrarlos)
+        etag = etags_actuales()['/panel_reportes']
+        with administrador.session_transaction() as sesion:
+            sesion['_flashes'] = [('success', 'mensaje de prueba')]
+        respuesta, _ = pedir(administrador, '/panel_reportes', etag)
+        comprobar(respuesta.status_code == 200 and not respuesta.get_etag()[0],
+                  "mensaje flash pendiente: 200 sin ETag")
+
+    if fallas:
+        print(f"{len(fallas)} verificación(es) fallida(s).")
+        return 1
+    print("OK: ningún ETag sobrevive a una escritura de los datos que representa.")
+    return 0
+
+# --- Benchmark: costo de las métricas de /metrics ---
+
+def benchmark_metricas(args):
+    """
+    Costo por request del registro de métricas (una observación de histograma
+    y contador) frente a la latencia de una ruta liviana, y costo de armar
+    la respuesta de /metrics.
+    """
+    registro = MetricasProceso(app.config['METRICAS_BUCKETS']) # Aparte, para no ensuciar el global
+    rutas = [f'ruta_{i}' for i in range(20)]
+    inicio = time.perf_counter()
+    for i in range(args.iteraciones):
+        registro.observar_request(rutas[i % 20], 'GET', 200, (i % 1000) / 10000)
+    por_observacion_us = (time.perf_counter() - inicio) / args.iteraciones * 1e6
+
+    usuario = cliente_usuario()
+    if not usuario:
+        return 1
+    fecha = datetime.now().date().isoformat()
+    with app.app_context():
+        usuario.get(f'/api/turnos_disponibles/{fecha}') # Carga el motor de ocupación
+        latencias = medir(lambda: usuario.get(f'/api/turnos_disponibles/{fecha}'), 500)
+        exportaciones = medir(registro.exportar, 200)
+
+    p50_ruta_us = percentil(latencias, 50) * 1000
+    print(f"  observar_request: {por_observacion_us:.2f} us por request (n={args.iteraciones})")
+    print(f"  /api/turnos_disponibles p50: {p50_ruta_us:.0f} us -> costo de métricas "
+          f"{por_observacion_us / p50_ruta_us * 100:.2f}% de la request")
+    mostrar_resultado('exportar (20 rutas)', exportaciones)
+    return 0
+
+# --- Benchmark: reservas durante una ola de logins fallidos ---
+
+def benchmark_login(args):
+    """
+    Latencia de POST /reservar_turno sin ataque y durante una ola de logins
+    fallidos (nombres existentes e inventados, desde muchas IPs), primero
+    verificando el hash en el hilo del worker y sin límites (como antes) y
+    después con el pool de procesos, la contrapresión y los límites de
+    intentos configurados. Crea, si faltan, --cuentas usuarios 'bench_login_N'
+    con el hash real de la app para que cada intento tenga su costo.
+    Conviene correrlo sobre una copia de la base: las reservas la modifican.
+    """
+    with app.app_context():
+        existentes = {n for (n,) in db.session.query(Usuario.nombre_usuario).filter(
+            Usuario.nombre_usuario.like('bench_login_%'))}
+        nuevas = [Usuario(nombre_usuario=f'bench_login_{i}', nombre='Bench', apellido='Login', dni=f'bl{i}',
+                          contrasena_hash=generate_password_hash(
+                              f'clave_{i}', method=app.config['METODO_HASH_CONTRASENAS']))
+                  for i in range(args.cuentas) if f'bench_login_{i}' not in existentes]
+        db.session.add_all(nuevas)
+        db.session.commit()
+        usuarios_ids = [i for (i,) in db.session.query(Usuario.id).order_by(Usuario.id).limit(args.concurrencia)]
+        canchas_ids = [i for (i,) in db.session.query(Cancha.id).order_by(Cancha.id)]
+        db.session.remove()
+    if not canchas_ids:
+        print("ERROR: no hay canchas en la base.")
+        return 1
+
+    original = (modulo_app.verificador_contrasenas, modulo_app.limite_login_ip, modulo_app.limite_login_usuario)
+    sin_limite = (10 ** 9, 1)
+    fases = [
+        ('sin ataque', None),
+        ('ataque, hash en el hilo', (VerificadorContrasenas(0, 10 ** 6, 60),
+                                     LimitadorIntentos(*sin_limite), LimitadorIntentos(*sin_limite))),
+        ('ataque, pool + límites', original),
+    ]
+    hoy = datetime.now().date()
+    print(f"Reservas: {args.concurrencia} hilos x {args.pedidos} pedidos. Ataque: {args.atacantes} hilos, "
+          f"{args.cuentas} cuentas, {args.ips} IPs. Pool: {app.config['LOGIN_PROCESOS_HASH']} procesos, "
+          f"{app.config['LOGIN_MAX_PENDIENTES']} pendientes por worker.")
+
+    for numero_fase, (nombre_fase, componentes) in enumerate(fases):
+        atacando = componentes is not None
+        if atacando:
+            (modulo_app.verificador_contrasenas, modulo_app.limite_login_ip,
+             modulo_app.limite_login_usuario) = componentes
+        latencias, logins = [], Counter()
+        lock = threading.Lock()
+        fin_reservas = threading.Event()
+        antes = metricas.instantanea()['negocio']
+
+        def reservar(numero):
+            rng = random.Random(args.semilla + numero)
+            cliente = app.test_client()
+            with cliente.session_transaction() as sesion:
+                sesion['rol'] = 'usuario'
+                sesion['user_id'] = usuarios_ids[numero % len(usuarios_ids)]
+                sesion['nombre_usuario'] = f'bench_{numero}'
+            propias = []
+            for _ in range(args.pedidos):
+                fecha = hoy + timedelta(days=3650 + numero_fase * 400 + rng.randrange(365))
+                datos = {'fecha': fecha.isoformat(), 'cancha': str(rng.choice(canchas_ids)),
+                         'hora_inicio': f'{rng.randrange(HORA_APERTURA, HORA_CIERRE):02d}:00'}
+                inicio = time.perf_counter()
+                cliente.post('/reservar_turno', data=datos)
+                propias.append((time.perf_counter() - inicio) * 1000)
+            with lock:
+                latencias.extend(propias)
+
+        def atacar(numero):
+            rng = random.Random(args.semilla * 1000 + numero)
+            cliente = app.test_client()
+            propios = 0
+            while not fin_reservas.is_set():
+                nombre = f'bench_login_{rng.randrange(args.cuentas)}' if rng.random() < 0.7 \
+                    else f'inventado_{rng.randrange(10 ** 6)}'
+                cliente.post('/iniciar_sesion_usuario', data={'nombre_usuario': nombre, 'contrasena': 'incorrecta'},
+                             environ_base={'REMOTE_ADDR': f'10.0.{rng.randrange(args.ips) // 256}.{rng.randrange(256)}'})
+                propios += 1
+            with lock:
+                logins['intentos'] += propios
+
+        atacantes = [threading.Thread(target=atacar, args=(n,)) for n in range(args.atacantes if atacando else 0)]
+        reservas = [threading.Thread(target=reservar, args=(n,)) for n in range(args.concurrencia)]
+        inicio = time.perf_counter()
+        for hilo in atacantes + reservas:
+            hilo.start()
+        for hilo in reservas:
+            hilo.join()
+        fin_reservas.set()
+        for hilo in atacantes:
+            hilo.join()
+        duracion = time.perf_counter() - inicio
+        (modulo_app.verificador_contrasenas, modulo_app.limite_login_ip, modulo_app.limite_login_usuario) = original
+
+        despues = metricas.instantanea()['negocio']
+        rechazos = {nombre: despues.get(nombre, 0) - antes.get(nombre, 0)
+                    for nombre in ('logins_limitados', 'logins_rechazados_ocupado')}
+        print(f"\n[{nombre_fase}]")
+        print(f"  reservas: p50 {percentil(latencias, 50):.1f} ms, p95 {percentil(latencias, 95):.1f} ms, "
+              f"p99 {percentil(latencias, 99):.1f} ms, máx {max(latencias):.1f} ms")
+        if atacando:
+            print(f"  logins: {logins['intentos']} intentos ({logins['intentos'] / duracion:.0f}/s); "
+                  f"rechazados por límite {rechazos['logins_limitados']}, "
+                  f"por falta de cupo {rechazos['logins_rechazados_ocupado']}")
+    return 0
+
+# --- Verificación de envíos repetidos (claves de idempotencia) ---
+
+def benchmark_idempotencia(args):
+    """
+    Dispara --concurrencia envíos simultáneos del mismo pedido con la misma
+    clave de idempotencia, por el formulario y por POST /api/reservas, y
+    verifica que se crea una sola reserva y que todos reciben el mismo
+    resultado. También verifica que un repetido posterior no hace consultas,
+    que la clave con otros datos se rechaza (422) y que un rechazo por turno
+    ocupado se repite igual. Usa dos turnos libres seguidos de --fecha.
+    Conviene correrlo sobre una copia de la base: las reservas la modifican.
+    """
+    fecha, hora_inicio, _ = parsear_turno(args.fecha, args.hora)
+    _, hora_siguiente, _ = parsear_turno(args.fecha, f'{hora_inicio.hour + 1:02d}:00')
+    with app.app_context():
+        ocupados = Reserva.query.filter(Reserva.fecha == fecha, Reserva.cancha_id == args.cancha,
+                                        Reserva.hora_inicio.in_([hora_inicio, hora_siguiente]),
+                                        Reserva.estado == 'activa').count()
+        usuarios_ids = [i for (i,) in db.session.query(Usuario.id).order_by(Usuario.id).limit(2)]
+        db.session.remove()
+    if ocupados or len(usuarios_ids) < 2:
+        print(f"ERROR: hacen falta dos usuarios y los turnos de las {args.hora} y la hora siguiente "
+              f"libres en la cancha {args.cancha} ({args.fecha}).")
+        return 1
+
+    def crear_cliente(usuario_id):
+        cliente = app.test_client()
+        with cliente.session_transaction() as sesion:
+            sesion['rol'] = 'usuario'
+            sesion['user_id'] = usuario_id
+            sesion['nombre_usuario'] = f'idempotencia{usuario_id}'
+        return cliente
+
+    def simultaneos(enviar):
+        """Ejecuta enviar(cliente) en --concurrencia hilos a la vez; devuelve las respuestas."""
+        barrera = threading.Barrier(args.concurrencia)
+        respuestas = [None] * args.concurrencia
+        def ejecutar(numero):
+            cliente = crear_cliente(usuarios_ids[0])
+            barrera.wait() # Todos los hilos salen a la vez
+            respuestas[numero] = enviar(cliente)
+        hilos = [threading.Thread(target=ejecutar, args=(n,)) for n in range(args.concurrencia)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        return respuestas
+
+    def reservas_activas(hora):
+        with app.app_context():
+            cantidad = Reserva.query.filter_by(fecha=fecha, hora_inicio=hora, cancha_id=args.cancha,
+                                               estado='activa').count()
+            db.session.remove()
+        return cantidad
+
+    fallas = []
+    def verificar(condicion, descripcion):
+        print(f"  [{'OK' if condicion else 'FALLA'}] {descripcion}")
+        if not condicion:
+            fallas.append(descripcion)
+
+    # 1. Formulario: el mismo envío repetido N veces a la vez
+    datos_formulario = {'fecha': args.fecha, 'hora_inicio': args.hora, 'cancha': str(args.cancha),
+                        'clave_idempotencia': 'bench-formulario-' + args.fecha}
+    antes = metricas.instantanea()['negocio'].get('reservas_repetidas', 0)
+    respuestas = simultaneos(lambda cliente: cliente.post('/reservar_turno', data=datos_formulario))
+    repetidas = metricas.instantanea()['negocio'].get('reservas_repetidas', 0) - antes
+    print(f"Formulario: {args.concurrencia} envíos simultáneos con la misma clave")
+    verificar(all(r.status_code == 302 and r.location.endswith('/mis_turnos') for r in respuestas),
+              "todos los envíos terminan en 'Turno reservado exitosamente'")
+    verificar(reservas_activas(hora_inicio) == 1, "se creó una sola reserva")
+    verificar(repetidas == args.concurrencia - 1, f"{repetidas} envíos respondidos con el resultado guardado")
+
+    # 2. API: lo mismo con el encabezado Idempotency-Key
+    cuerpo = {'cancha_id': args.cancha, 'fecha': args.fecha, 'hora_inicio': formatear_hora(hora_siguiente)}
+    encabezados = {'Idempotency-Key': 'bench-api-' + args.fecha}
+    respuestas = simultaneos(lambda cliente: cliente.post('/api/reservas', json=cuerpo, headers=encabezados))
+    print(f"API: {args.concurrencia} POST /api/reservas simultáneos con la misma clave")
+    verificar(all(r.status_code == 201 for r in respuestas), "todos responden 201")
+    verificar(len({r.get_json()['reserva']['id'] for r in respuestas}) == 1, "todos devuelven la misma reserva")
+    verificar(sum(r.headers.get('Idempotent-Replayed') == 'true' for r in respuestas) == args.concurrencia - 1,
+              "todos menos uno llevan 'Idempotent-Replayed: true'")
+    verificar(reservas_activas(hora_siguiente) == 1, "se creó una sola reserva")
+
+    # 3. Repetido posterior, clave reusada con otros datos y repetido de un rechazo
+    cliente, otro = crear_cliente(usuarios_ids[0]), crear_cliente(usuarios_ids[1])
+    with app.app_context():
+        with contar_consultas() as contador:
+            repetida = cliente.post('/api/reservas', json=cuerpo, headers=encabezados)
+    print("Repetidos posteriores")
+    verificar(repetida.status_code == 201 and contador['total'] == 0,
+              f"un repetido ya resuelto no consulta la DB ({contador['total']} consultas)")
+    otros_datos = dict(cuerpo, hora_inicio=args.hora)
+    verificar(cliente.post('/api/reservas', json=otros_datos, headers=encabezados).status_code == 422,
+              "la misma clave con otros datos responde 422")
+    encabezados_otro = {'Idempotency-Key': 'bench-ocupado-' + args.fecha}
+    rechazos = [otro.post('/api/reservas', json=cuerpo, headers=encabezados_otro) for _ in range(2)]
+    verificar([r.status_code for r in rechazos] == [409, 409]
+              and rechazos[1].headers.get('Idempotent-Replayed') == 'true',
+              "un rechazo por turno ocupado se repite igual (409)")
+    verificar(otro.post('/api/reservas', json=cuerpo).status_code == 409,
+              "sin clave, un segundo envío vuelve a intentar y choca con el turno ocupado")
+    verificar(reservas_activas(hora_inicio) == 1 and reservas_activas(hora_siguiente) == 1,
+              "siguen existiendo exactamente dos reservas")
+
+    if fallas:
+        print(f"{len(fallas)} verificación(es) fallaron.")
+        return 1
+    print("OK: cada clave de idempotencia reservó una sola vez.")
+    return 0
+
+# --- Benchmark: formulario vs API JSON de reservas ---
+
+def benchmark_api_reservas(args):
+    """
+    Costo por turno reservado por el formulario (POST, 302 y la página de
+    mis_turnos con todo el historial), por POST /api/reservas de a un turno y
+    por lotes de --lote turnos en una sola transacción. Reserva --turnos turnos
+    con cada camino, en fechas lejanas distintas, y los cancela en lote al final.
+    Conviene correrlo sobre una copia de la base: las reservas la modifican.
+    """
+    usuario = cliente_usuario()
+    if not usuario:
+        return 1
+    with app.app_context():
+        canchas_ids = [i for (i,) in db.session.query(Cancha.id).order_by(Cancha.id)]
+        db.session.remove()
+    if not canchas_ids:
+        print("ERROR: no hay canchas en la base.")
+        return 1
+
+    def turnos(numero_camino):
+        """Genera --turnos turnos libres (fechas a partir de 40 años + 5 por camino)."""
+        fecha = datetime.now().date().replace(year=datetime.now().year + 40 + 5 * numero_camino)
+        horas = range(HORA_APERTURA, HORA_CIERRE)
+        for i in range(args.turnos):
+            dia, resto = divmod(i, len(horas) * len(canchas_ids))
+            cancha, hora = divmod(resto, len(horas))
+            yield {'cancha_id': canchas_ids[cancha], 'fecha': (fecha + timedelta(days=dia)).isoformat(),
+                   'hora_inicio': f'{horas[hora]:02d}:00'}
+
+    def por_formulario(lista):
+        for turno in lista:
+            respuesta = usuario.post('/reservar_turno', follow_redirects=True, data={
+                'cancha': str(turno['cancha_id']), 'fecha': turno['fecha'], 'hora_inicio': turno['hora_inicio']})
+            assert respuesta.request.path == '/mis_turnos', "el formulario no reservó el turno"
+
+    def por_api(lista):
+        for turno in lista:
+            assert usuario.post('/api/reservas', json=turno).status_code == 201
+
+    def por_lotes(lista):
+        for desde in range(0, len(lista), args.lote):
+            assert usuario.post('/api/reservas', json={'reservas': lista[desde:desde + args.lote]}).status_code == 201
+
+    caminos = [('formulario', por_formulario), ('api, de a uno', por_api), (f'api, lotes de {args.lote}', por_lotes)]
+    print(f"{args.turnos} turnos por camino:")
+    creadas = []
+    with app.app_context():
+        for numero, (nombre, reservar) in enumerate(caminos):
+            lista = list(turnos(numero))
+            inicio = time.perf_counter()
+            reservar(lista)
+            duracion = time.perf_counter() - inicio
+            db.session.remove()
+            print(f"  {nombre:<22} {duracion / len(lista) * 1000:8.2f} ms por turno   "
+                  f"({len(lista) / duracion:7.0f} turnos/s)")
+            creadas.extend(lista)
+
+        # Limpieza: se cancelan en lotes los turnos creados (se listan con la API)
+        ids = []
+        cursor = ''
+        desde = min(t['fecha'] for t in creadas)
+        while cursor is not None:
+            datos = usuario.get(f'/api/reservas?desde={desde}&cursor={cursor}').get_json()
+            ids.extend(r['id'] for r in datos['reservas'])
+            cursor = datos['siguiente']
+        for inicio_lote in range(0, len(ids), app.config['API_RESERVAS_MAX_LOTE']):
+            lote = ids[inicio_lote:inicio_lote + app.config['API_RESERVAS_MAX_LOTE']]
+            assert usuario.delete('/api/reservas', json={'ids': lote}).status_code == 200
+    print(f"Se cancelaron las {len(ids)} reservas creadas.")
+    return 0
+
+# --- Suite de carga reproducible: sembrado determinista + tráfico mixto ---
+
+CONTRASENA_CARGA = 'carga123' # Contraseña de todos los usuarios sembrados
+
+def sembrar_base(usuarios, canchas, anios, hasta, semilla, ocupacion, cancelacion, tamano_lote=5000):
+    """
+    Carga en una base vacía un conjunto de datos determinista: los mismos
+    argumentos producen siempre las mismas filas. Devuelve un dict con los
+    conteos. Las reservas cubren 'anios' hacia atrás desde 'hasta' y 30 días
+    hacia adelante (para que haya turnos futuros que cancelar y consultar).
+    """
+    rng = random.Random(semilla)
+    # Un solo hash, con el método de la app: sembrar no mide el login, pero los
+    # logins posteriores sí y no deben rehashear ni costar distinto
+    hash_comun = generate_password_hash(CONTRASENA_CARGA, method=app.config['METODO_HASH_CONTRASENAS'])
+
+    db.session.execute(insert(Administrador), [{'nombre_usuario': 'carga_admin', 'contrasena_hash': hash_comun}])
+    db.session.execute(insert(Usuario), [{
+        'nombre_usuario': f'carga_{i:06d}', 'contrasena_hash': hash_comun,
+        'nombre': f'Usuario {i}', 'apellido': 'Carga', 'dni': str(90000000 + i),
+    } for i in range(usuarios)])
+    db.session.execute(insert(Cancha), [{
+        'nombre': f'Cancha {j + 1}',
+        'tipo': rng.choice(['Fútbol 5', 'Fútbol 7', 'Pádel']),
+        'condicion': rng.choice(['Techada', 'Aire libre']),
+        'monto': rng.choice([8000.0, 10000.0, 12000.0, 15000.0]),
+    } for j in range(canchas)])
+
+    usuarios_ids = [i for (i,) in db.session.query(Usuario.id).order_by(Usuario.id)]
+    canchas_db = db.session.query(Cancha.id, Cancha.monto).order_by(Cancha.id).all()
+
+    desde = hasta - timedelta(days=365 * anios)
+    total_reservas = 0
+    lote = []
+    fecha = desde
+    while fecha <= hasta + timedelta(days=30):
+        for cancha_id, monto in canchas_db:
+            for hora in range(HORA_APERTURA, HORA_CIERRE):
+                if rng.random() >= ocupacion:
+                    continue
+                lote.append({
+                    'usuario_id': rng.choice(usuarios_ids), 'cancha_id': cancha_id, 'fecha': fecha,
+                    'hora_inicio': dt_time(hora), 'hora_fin': dt_time(hora + 1), 'monto': monto,
+                    'estado': 'cancelada' if rng.random() < cancelacion else 'activa',
+                })
+        if len(lote) >= tamano_lote:
+            db.session.execute(insert(Reserva), lote)
+            total_reservas += len(lote)
+            lote = []
+        fecha += timedelta(days=1)
+    if lote:
+        db.session.execute(insert(Reserva), lote)
+        total_reservas += len(lote)
+
+    # Tres gastos por mes, para que el informe financiero y el de gastos tengan datos
+    gastos = []
+    mes = desde.replace(day=1)
+    while mes <= hasta:
+        for categoria in ('Servicios', 'Sueldos', 'Mantenimiento'):
+            gastos.append({'fecha': mes.replace(day=rng.randint(1, 28)), 'categoria': categoria,
+                           'concepto': f'{categoria} {mes:%m/%Y}', 'monto': round(rng.uniform(50000, 400000), 2)})
+        mes = (mes + timedelta(days=32)).replace(day=1)
+    db.session.execute(insert(Gasto), gastos)
+
+    dias = reconstruir_resumen_diario()
+    db.session.commit()
+    return {'usuarios': usuarios, 'canchas': canchas, 'reservas': total_reservas,
+            'gastos': len(gastos), 'dias_resumen': dias}
+
+def benchmark_sembrar(args):
+    """Crea el esquema (si falta) y siembra la base para las pruebas de carga."""
+    hasta = datetime.strptime(args.hasta, '%Y-%m-%d').date()
+    with app.app_context():
+        db.create_all()
+        if db.session.query(Usuario.id).first() or db.session.query(Reserva.id).first():
+            print("ERROR: la base ya tiene datos. La suite de carga necesita una base vacía "
+                  "(ej: DATABASE_URL=sqlite:///carga.db).")
+            return 1
+        inicio = time.perf_counter()
+        conteos = sembrar_base(args.usuarios, args.canchas, args.anios, hasta, args.semilla,
+                               args.ocupacion, args.cancelacion)
+    print(f"Base sembrada en {time.perf_counter() - inicio:.1f} s (semilla {args.semilla}): "
+          + ', '.join(f'{clave}={valor}' for clave, valor in conteos.items()))
+    return 0
+
+# Mezcla de tráfico: (nombre, peso, rol). Los pesos aproximan el uso real:
+# la disponibilidad domina, los reportes del admin son pocos pero caros.
+MEZCLA_CARGA = [
+    ('api_turnos_disponibles', 35, 'usuario'),
+    ('panel_usuario', 10, 'usuario'),
+    ('mis_turnos', 15, 'usuario'),
+    ('reservar_turno', 10, 'usuario'),
+    ('panel_administrador', 6, 'administrador'),
+    ('ver_turnos_administrador', 6, 'administrador'),
+    ('api_turnos_administrador', 8, 'administrador'),
+    ('informe_financiero_administrador', 5, 'administrador'),
+    ('panel_reportes', 3, 'administrador'),
+    ('reporte_gastos', 2, 'administrador'),
+]
+
+def armar_pedido(nombre, rng, hoy, canchas_ids):
+    """Devuelve (método, url, datos del formulario) para una operación de la mezcla."""
+    fecha = (hoy + timedelta(days=rng.randint(0, 30))).isoformat()
+    if nombre == 'api_turnos_disponibles':
+        return 'GET', f'/api/turnos_disponibles/{fecha}', None
+    if nombre == 'reservar_turno':
+        return 'POST', '/reservar_turno', {
+            'fecha': fecha, 'hora_inicio': f'{rng.randint(HORA_APERTURA, HORA_CIERRE - 1):02d}:00',
+            'cancha': str(rng.choice(canchas_ids)),
+        }
+    if nombre == 'api_turnos_administrador':
+        return 'GET', f'/api/turnos_administrador/activa?desde={fecha}', None
+    return 'GET', f'/{nombre}', None
+
+def benchmark_carga(args):
+    """
+    Tráfico mixto de usuarios y administradores con 'concurrencia' hilos, cada
+    uno con su propia sesión y su propio generador (semilla + n° de hilo), así
+    la secuencia de pedidos es la misma en cada corrida. Emite en JSON la
+    latencia p50/p95/p99 y el throughput por endpoint.
+    Conviene correrla sobre una copia recién sembrada: las reservas la modifican.
+    """
+    with app.app_context():
+        usuarios_ids = [i for (i,) in db.session.query(Usuario.id).order_by(Usuario.id).limit(args.concurrencia)]
+        canchas_ids = [i for (i,) in db.session.query(Cancha.id).order_by(Cancha.id)]
+        administrador = db.session.query(Administrador.id, Administrador.nombre_usuario).order_by(Administrador.id).first()
+        dialecto = db.engine.dialect.name
+        db.session.remove()
+    if not usuarios_ids or not canchas_ids or not administrador:
+        print("ERROR: faltan usuarios, canchas o administradores. Ejecuta 'python benchmark.py sembrar' primero.")
+        return 1
+
+    hoy = datetime.now().date()
+    nombres = [nombre for nombre, _, _ in MEZCLA_CARGA]
+    pesos = [peso for _, peso, _ in MEZCLA_CARGA]
+    roles = {nombre: rol for nombre, _, rol in MEZCLA_CARGA}
+    muestras = defaultdict(list) # nombre -> latencias (ms)
+    errores = Counter()
+    lock_muestras = threading.Lock()
+    barrera = threading.Barrier(args.concurrencia)
+
+    def hilo_de_carga(numero):
+        rng = random.Random(args.semilla + numero)
+        clientes = {'usuario': app.test_client(), 'administrador': app.test_client()}
+        with clientes['usuario'].session_transaction() as sesion:
+            sesion['rol'] = 'usuario'
+            sesion['user_id'] = usuarios_ids[numero % len(usuarios_ids)]
+            sesion['nombre_usuario'] = f'carga_{numero}'
+        with clientes['administrador'].session_transaction() as sesion:
+            sesion['rol'] = 'administrador'
+            sesion['user_id'], sesion['nombre_usuario'] = administrador
+            sesion['admin_epoca'] = app.config['ADMIN_EPOCA']
+
+        propias = defaultdict(list)
+        propios_errores = Counter()
+        barrera.wait()
+        for i in range(args.calentamiento + args.pedidos):
+            nombre = rng.choices(nombres, pesos)[0]
+            metodo, url, datos = armar_pedido(nombre, rng, hoy, canchas_ids)
+            inicio = time.perf_counter()
+            respuesta = clientes[roles[nombre]].open(url, method=metodo, data=datos)
+            duracion = (time.perf_counter() - inicio) * 1000
+            if i < args.calentamiento:
+                continue
+            propias[nombre].append(duracion)
+            if respuesta.status_code >= 400 and respuesta.status_code != 404:
+                propios_errores[nombre] += 1
+        with lock_muestras:
+            for nombre, latencias in propias.items():
+                muestras[nombre].extend(latencias)
+            errores.update(propios_errores)
+
+    hilos = [threading.Thread(target=hilo_de_carga, args=(n,)) for n in range(args.concurrencia)]
+    inicio = time.perf_counter()
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    duracion = time.perf_counter() - inicio
+
+    total = sum(len(latencias) for latencias in muestras.values())
+    resultado = {
+        'parametros': {'concurrencia': args.concurrencia, 'pedidos_por_hilo': args.pedidos,
+                       'calentamiento': args.calentamiento, 'semilla': args.semilla},
+        'base': dialecto,
+        'momento': datetime.now().isoformat(timespec='seconds'),
+        'duracion_s': round(duracion, 3),
+        'total_pedidos': total,
+        'throughput_rps': round(total / duracion, 1),
+        'endpoints': {
+            nombre: {
+                'pedidos': len(latencias),
+                'errores': errores[nombre],
+                'p50_ms': round(percentil(latencias, 50), 3),
+                'p95_ms': round(percentil(latencias, 95), 3),
+                'p99_ms': round(percentil(latencias, 99), 3),
+                'media_ms': round(sum(latencias) / len(latencias), 3),
+                'throughput_rps': round(len(latencias) / duracion, 1),
+            }
+            for nombre, latencias in sorted(muestras.items())
+        },
+    }
+
+    texto = json.dumps(resultado, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            f.write(texto + '\n')
+        print(f"{total} pedidos en {duracion:.1f} s ({resultado['throughput_rps']} req/s). Resultado en {args.salida}")
+    else:
+        print(texto)
+    return 1 if sum(errores.values()) else 0
+
+def benchmark_comparar(args):
+    """Compara dos resultados JSON de 'carga' (base contra nueva) endpoint por endpoint."""
+    with open(args.base, encoding='utf-8') as f:
+        base = json.load(f)
+    with open(args.nueva, encoding='utf-8') as f:
+        nueva = json.load(f)
+
+    def variacion(antes, despues):
+        return f"{(despues - antes) / antes * 100:+6.1f}%" if antes else '     -'
+
+    print(f"  {'endpoint':<34} {'p50 base':>9} {'p50 nueva':>9} {'Δ':>7} {'p95 base':>9} {'p95 nueva':>9} {'Δ':>7}")
+    for nombre in sorted(set(base['endpoints']) | set(nueva['endpoints'])):
+        a, b = base['endpoints'].get(nombre), nueva['endpoints'].get(nombre)
+        if not a or not b:
+            print(f"  {nombre:<34} (sólo en {'la base' if a else 'la nueva'})")
+            continue
+        print(f"  {nombre:<34} {a['p50_ms']:9.2f} {b['p50_ms']:9.2f} {variacion(a['p50_ms'], b['p50_ms'])} "
+              f"{a['p95_ms']:9.2f} {b['p95_ms']:9.2f} {variacion(a['p95_ms'], b['p95_ms'])}")
+    print(f"  {'throughput (req/s)':<34} {base['throughput_rps']:9.1f} {nueva['throughput_rps']:9.1f} "
+          f"{variacion(base['throughput_rps'], nueva['throughput_rps'])}")
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks del sistema de reservas de canchas.")
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+
+    p_disp = subparsers.add_parser('disponibilidad', help="Latencia de /api/turnos_disponibles (consulta vs bitmap).")
+    p_disp.add_argument('--fecha', default=time.strftime('%Y-%m-%d'), help="Fecha a consultar (YYYY-MM-DD).")
+    p_disp.add_argument('--iteraciones', type=int, default=500)
+    p_disp.set_defaults(funcion=benchmark_disponibilidad)
+
+    p_estres = subparsers.add_parser('estres_reserva', help="POST concurrentes al mismo turno; exactamente uno debe ganar.")
+    p_estres.add_argument('--fecha', required=True, help="Fecha del turno (YYYY-MM-DD), idealmente futura y libre.")
+    p_estres.add_argument('--hora', default='20:00', help="Hora de inicio (HH:MM).")
+    p_estres.add_argument('--cancha', type=int, default=1)
+    p_estres.add_argument('--concurrencia', type=int, default=300)
+    p_estres.set_defaults(funcion=benchmark_estres_reserva)
+
+    p_informe = subparsers.add_parser('informe', help="Paridad y latencia del informe financiero (Python vs SQL).")
+    p_informe.add_argument('--hoy', default=time.strftime('%Y-%m-%d'), help="Fecha de referencia para el detalle diario.")
+    p_informe.add_argument('--iteraciones', type=int, default=20)
+    p_informe.set_defaults(funcion=benchmark_informe)
+
+    p_reportes = subparsers.add_parser('reportes', help="Latencia de /panel_reportes (consultas + render).")
+    p_reportes.add_argument('--iteraciones', type=int, default=50)
+    p_reportes.set_defaults(funcion=benchmark_reportes)
+
+    p_consultas = subparsers.add_parser('consultas_admin', help="Consultas SQL por request en cada ruta del admin.")
+    p_consultas.set_defaults(funcion=benchmark_consultas_admin)
+
+    p_presupuestos = subparsers.add_parser('presupuestos', help="Falla si una ruta supera su presupuesto de consultas SQL.")
+    p_presupuestos.set_defaults(funcion=benchmark_presupuestos)
+
+    p_etag = subparsers.add_parser('etag', help="Verifica que tras cada escritura el ETag anterior deja de valer.")
+    p_etag.add_argument('--fecha', required=True, help="Fecha de un turno libre (YYYY-MM-DD), idealmente futura.")
+    p_etag.add_argument('--hora', default='20:00', help="Hora de inicio (HH:MM).")
+    p_etag.add_argument('--cancha', type=int, default=1)
+    p_etag.set_defaults(funcion=benchmark_etag)
+
+    p_metricas = subparsers.add_parser('metricas', help="Costo por request del registro de métricas de /metrics.")
+    p_metricas.add_argument('--iteraciones', type=int, default=200000)
+    p_metricas.set_defaults(funcion=benchmark_metricas)
+
+    p_login = subparsers.add_parser('login', help="Latencia de las reservas durante una ola de logins fallidos.")
+    p_login.add_argument('--concurrencia', type=int, default=4, help="Hilos que reservan.")
+    p_login.add_argument('--pedidos', type=int, default=100, help="Reservas por hilo y por fase.")
+    p_login.add_argument('--atacantes', type=int, default=16, help="Hilos que intentan logins fallidos.")
+    p_login.add_argument('--cuentas', type=int, default=20, help="Cuentas atacadas (con hash real).")
+    p_login.add_argument('--ips', type=int, default=1000, help="IPs distintas del ataque.")
+    p_login.add_argument('--semilla', type=int, default=42)
+    p_login.set_defaults(funcion=benchmark_login)
+
+    p_idempotencia = subparsers.add_parser('idempotencia', help="Envíos repetidos simultáneos con la misma clave reservan una vez.")
+    p_idempotencia.add_argument('--fecha', required=True, help="Fecha con dos turnos libres seguidos (YYYY-MM-DD).")
+    p_idempotencia.add_argument('--hora', default='20:00', help="Hora de inicio del primer turno (HH:MM).")
+    p_idempotencia.add_argument('--cancha', type=int, default=1)
+    p_idempotencia.add_argument('--concurrencia', type=int, default=20)
+    p_idempotencia.set_defaults(funcion=benchmark_idempotencia)
+
+    p_api = subparsers.add_parser('api_reservas', help="Costo por turno: formulario vs API JSON de a uno y en lotes.")
+    p_api.add_argument('--turnos', type=int, default=60, help="Turnos a reservar con cada camino.")
+    p_api.add_argument('--lote', type=int, default=20, help="Turnos por lote (hasta API_RESERVAS_MAX_LOTE).")
+    p_api.set_defaults(funcion=benchmark_api_reservas)
+
+    p_sembrar = subparsers.add_parser('sembrar', help="Siembra una base vacía con datos deterministas para la carga.")
+    p_sembrar.add_argument('--usuarios', type=int, default=2000)
+    p_sembrar.add_argument('--canchas', type=int, default=6)
+    p_sembrar.add_argument('--anios', type=int, default=3, help="Años de historial de reservas.")
+    p_sembrar.add_argument('--hasta', default=time.strftime('%Y-%m-%d'),
+                           help="Último día del historial (fijarlo para reproducir exactamente un sembrado).")
+    p_sembrar.add_argument('--semilla', type=int, default=42)
+    p_sembrar.add_argument('--ocupacion', type=float, default=0.35, help="Probabilidad de que un turno esté reservado.")
+    p_sembrar.add_argument('--cancelacion', type=float, default=0.1, help="Fracción de reservas canceladas.")
+    p_sembrar.set_defaults(funcion=benchmark_sembrar)
+
+    p_carga = subparsers.add_parser('carga', help="Tráfico mixto concurrente; latencias y throughput por endpoint en JSON.")
+    p_carga.add_argument('--concurrencia', type=int, default=8)
+    p_carga.add_argument('--pedidos', type=int, default=300, help="Pedidos medidos por hilo.")
+    p_carga.add_argument('--calentamiento', type=int, default=20, help="Pedidos por hilo que no se miden (cachés frías).")
+    p_carga.add_argument('--semilla', type=int, default=42)
+    p_carga.add_argument('--salida', help="Archivo donde guardar el JSON (si no, se imprime).")
+    p_carga.set_defaults(funcion=benchmark_carga)
+
+    p_comparar = subparsers.add_parser('comparar', help="Compara dos resultados JSON de 'carga'.")
+    p_comparar.add_argument('base')
+    p_comparar.add_argument('nueva')
+    p_comparar.set_defaults(funcion=benchmark_comparar)
+
+    args = parser.parse_args()
+    return args.funcion(args)
+
+if __name__ == '__main__':
+    raise SystemExit(main())
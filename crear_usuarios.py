@@ -1,96 +1,170 @@
+"""
+Crea usuarios automáticos (clientes) para pruebas y datos de ejemplo.
+
+Completa la tabla hasta el total pedido: si ya hay usuarios, sólo agrega los
+que faltan, así se puede correr varias veces (o retomar una carga cortada).
+
+Uso:
+    python crear_usuarios.py                          # 150 usuarios (hash seguro)
+    python crear_usuarios.py --total 100000 --hash rapido
+    python crear_usuarios.py --total 20000 --procesos 8
+"""
 import os
 import random
+import time
+import argparse
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
 
 # --- IMPORTANTE: Importamos la app, la DB y el modelo Usuario ---
 # Esto permite que este script se conecte a tu base de datos
 from app import app, db, Usuario
 
-def crear_usuarios_automaticos(num_usuarios=150):
+CONTRASENA_POR_DEFECTO = "Contraseña1!"
+
+# Perfiles de hash de contraseñas:
+# - 'seguro': el mismo método que usa la app al registrar (METODO_HASH_CONTRASENAS,
+#   lento a propósito); se reparte entre varios procesos.
+# - 'rapido': PBKDF2 con una sola iteración. check_password_hash lo acepta igual,
+#   pero NO es seguro: sólo para bases de prueba y de carga. Como no es la
+#   política vigente, cada cuenta se re-hashea sola en su primer login.
+METODOS_HASH = {
+    'seguro': app.config['METODO_HASH_CONTRASENAS'],
+    'rapido': 'pbkdf2:sha256:1',
+}
+
+# Listas de nombres y apellidos (de tu script original)
+NOMBRES = ["Juan", "María", "Carlos", "Ana", "Luis", "Laura", "Pedro", "Sofía", "José", "Elena",
+           "Miguel", "Isabel", "Javier", "Carmen", "Francisco", "Lucía", "Daniel", "Paula", "Jorge", "Martina",
+           "Alejandro", "Sara", "Manuel", "Claudia", "Ricardo", "Andrea", "Fernando", "Julia", "Pablo", "Valeria",
+           "Raúl", "Adriana", "Sergio", "Patricia", "Andrés", "Raquel", "Roberto", "Natalia", "Eduardo", "Verónica",
+           "Diego", "Olga", "Gabriel", "Diana", "Héctor", "Camila", "Joaquín", "Teresa", "Víctor", "Rosa"]
+
+APELLIDOS = ["García", "Rodríguez", "González", "Fernández", "López", "Martínez", "Sánchez", "Pérez", "Gómez", "Martín",
+             "Jiménez", "Ruiz", "Hernández", "Díaz", "Moreno", "Álvarez", "Romero", "Alonso", "Gutiérrez", "Navarro",
+             "Torres", "Domínguez", "Vázquez", "Ramos", "Gil", "Ramírez", "Serrano", "Blanco", "Molina", "Morales",
+             "Suárez", "Ortega", "Delgado", "Castro", "Ortiz", "Rubio", "Marín", "Sanz", "Iglesias", "Medina",
+             "Garrido", "Cortes", "Castillo", "Santos", "Lozano", "Guerrero", "Cano", "Prieto", "Méndez", "Cruz"]
+
+
+def hashear(contrasena, metodo):
+    """Hash de una contraseña (función de módulo para poder usarla en el pool de procesos)."""
+    return generate_password_hash(contrasena, method=metodo)
+
+def generar_datos(cantidad, nombres_usuario_existentes, dnis_existentes, rng):
     """
-    Crea 150 usuarios automáticos en la base de datos MySQL 
-    si la tabla de usuarios está vacía.
+    Genera 'cantidad' filas (sin hash) con nombre de usuario y DNI únicos,
+    evitando los que ya están en la base. Los nombres siguen la numeración
+    'usuarioN' a partir de la cantidad de usuarios existentes.
     """
-    print(f"Iniciando la creación de {num_usuarios} usuarios...")
-
-    # --- 1. VERIFICAMOS LA BASE DE DATOS (NO EL JSON) ---
-    if Usuario.query.count() > 0:
-        print(f"La tabla 'usuarios' ya tiene datos ({Usuario.query.count()} usuarios). No se agregarán nuevos.")
-        return
-
-    print(f"La tabla 'usuarios' está vacía. Generando {num_usuarios} usuarios...")
-
-    # Listas de nombres y apellidos (de tu script original)
-    nombres = ["Juan", "María", "Carlos", "Ana", "Luis", "Laura", "Pedro", "Sofía", "José", "Elena",
-               "Miguel", "Isabel", "Javier", "Carmen", "Francisco", "Lucía", "Daniel", "Paula", "Jorge", "Martina",
-               "Alejandro", "Sara", "Manuel", "Claudia", "Ricardo", "Andrea", "Fernando", "Julia", "Pablo", "Valeria",
-               "Raúl", "Adriana", "Sergio", "Patricia", "Andrés", "Raquel", "Roberto", "Natalia", "Eduardo", "Verónica",
-               "Diego", "Olga", "Gabriel", "Diana", "Héctor", "Camila", "Joaquín", "Teresa", "Víctor", "Rosa"]
-    
-    apellidos = ["García", "Rodríguez", "González", "Fernández", "López", "Martínez", "Sánchez", "Pérez", "Gómez", "Martín",
-                 "Jiménez", "Ruiz", "Hernández", "Díaz", "Moreno", "Álvarez", "Romero", "Alonso", "Gutiérrez", "Navarro",
-                 "Torres", "Domínguez", "Vázquez", "Ramos", "Gil", "Ramírez", "Serrano", "Blanco", "Molina", "Morales",
-                 "Suárez", "Ortega", "Delgado", "Castro", "Ortiz", "Rubio", "Marín", "Sanz", "Iglesias", "Medina",
-                 "Garrido", "Cortes", "Castillo", "Santos", "Lozano", "Guerrero", "Cano", "Prieto", "Méndez", "Cruz"]
-
-    dnis_existentes = set()
-    nombres_usuario_existentes = set()
-    
-    nuevos_usuarios_db = []
-    usuarios_creados = 0
-    
-    while usuarios_creados < num_usuarios:
-        # Generar datos aleatorios
-        nombre = random.choice(nombres)
-        apellido = random.choice(apellidos)
-        
+    filas = []
+    numero = len(nombres_usuario_existentes)
+    while len(filas) < cantidad:
+        numero += 1
+        nombre_usuario = f"usuario{numero}"
+        if nombre_usuario in nombres_usuario_existentes:
+            continue
+        nombres_usuario_existentes.add(nombre_usuario)
+
         # Generar DNI único de 8 dígitos
         while True:
-            dni = str(random.randint(10000000, 99999999))
+            dni = str(rng.randint(10000000, 99999999))
             if dni not in dnis_existentes:
                 dnis_existentes.add(dni)
                 break
-        
-        # Generar nombre de usuario único (como en tu script original)
-        base_usuario = f"usuario{usuarios_creados + 1}"
-        nombre_usuario = base_usuario
-        
-        contador = 1
-        while nombre_usuario in nombres_usuario_existentes:
-            nombre_usuario = f"{base_usuario}_{contador}"
-            contador += 1
-        
-        nombres_usuario_existentes.add(nombre_usuario)
-        
-        # --- 2. CREAR EL OBJETO DE BASE DE DATOS ---
-        # (El 'id' se asigna automáticamente por la DB)
-        nuevo_usuario = Usuario(
-            nombre=nombre,
-            apellido=apellido,
-            dni=dni,
-            nombre_usuario=nombre_usuario
-        )
-        
-        # --- 3. ASIGNAR Y HASHEAR LA CONTRASEÑA ---
-        # (Usa la función set_password que definimos en el modelo)
-        nuevo_usuario.set_password("Contraseña1!")
-        
-        nuevos_usuarios_db.append(nuevo_usuario)
-        usuarios_creados += 1
-        
-        print(f"Usuario {usuarios_creados}: {nombre_usuario} - {nombre} {apellido} - DNI: {dni}")
-
-    # --- 4. GUARDAR TODO EN LA BASE DE DATOS ---
+
+        filas.append({
+            'nombre_usuario': nombre_usuario,
+            'nombre': rng.choice(NOMBRES),
+            'apellido': rng.choice(APELLIDOS),
+            'dni': dni,
+        })
+    return filas
+
+def crear_usuarios_automaticos(total=150, contrasena=CONTRASENA_POR_DEFECTO, perfil_hash='seguro',
+                               procesos=None, tamano_lote=5000, semilla=None):
+    """
+    Completa la tabla 'usuarios' hasta 'total' usuarios. Los hashes se calculan
+    en un pool de procesos y las filas se insertan con INSERT masivos
+    (executemany) de 'tamano_lote' filas, con un commit por lote.
+    Devuelve la cantidad de usuarios creados.
+    """
+    existentes = db.session.query(Usuario.nombre_usuario, Usuario.dni).all()
+    faltantes = total - len(existentes)
+    if faltantes <= 0:
+        print(f"La tabla 'usuarios' ya tiene {len(existentes)} usuarios (objetivo: {total}). No se agregarán nuevos.")
+        return 0
+
+    print(f"Hay {len(existentes)} usuarios. Generando {faltantes} para llegar a {total} "
+          f"(hash '{perfil_hash}', lotes de {tamano_lote})...")
+
+    rng = random.Random(semilla)
+    filas = generar_datos(faltantes, {n for n, _ in existentes}, {d for _, d in existentes}, rng)
+    metodo = METODOS_HASH[perfil_hash]
+
+    inicio = time.perf_counter()
+    tiempo_hash = tiempo_insercion = 0.0
+    creados = 0
+    # Con el hash rápido no compensa levantar procesos
+    pool = ProcessPoolExecutor(max_workers=procesos) if perfil_hash == 'seguro' else None
     try:
-        db.session.add_all(nuevos_usuarios_db)
-        db.session.commit()
-        print(f"¡Proceso completado! Se han creado y guardado {usuarios_creados} usuarios en la base de datos.")
-        print("Todos los usuarios tienen la contraseña: Contraseña1!")
-    except Exception as e:
-        db.session.rollback()
-        print(f"Error al guardar usuarios en la base de datos: {e}")
+        for desde in range(0, len(filas), tamano_lote):
+            lote = filas[desde:desde + tamano_lote]
 
-if __name__ == '__main__':
-    # --- 5. ENVOLVER EN EL CONTEXTO DE LA APP ---
+            # --- 1. HASHEAR LAS CONTRASEÑAS (cada una con su propia sal) ---
+            inicio_hash = time.perf_counter()
+            if pool:
+                trozo = max(1, len(lote) // ((procesos or os.cpu_count() or 1) * 4))
+                hashes = pool.map(hashear, repeat(contrasena, len(lote)), repeat(metodo, len(lote)), chunksize=trozo)
+            else:
+                hashes = (hashear(contrasena, metodo) for _ in lote)
+            for fila, contrasena_hash in zip(lote, hashes):
+                fila['contrasena_hash'] = contrasena_hash
+            tiempo_hash += time.perf_counter() - inicio_hash
+
+            # --- 2. INSERTAR EL LOTE (un solo executemany) ---
+            inicio_insercion = time.perf_counter()
+            try:
+                db.session.execute(insert(Usuario), lote)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                print(f"Error al guardar usuarios en la base de datos: {e}")
+                break
+            tiempo_insercion += time.perf_counter() - inicio_insercion
+
+            creados += len(lote)
+            transcurrido = time.perf_counter() - inicio
+            print(f"  {creados}/{faltantes} usuarios ({creados / transcurrido:.0f} usuarios/s)")
+    finally:
+        if pool:
+            pool.shutdown()
+
+    duracion = time.perf_counter() - inicio
+    print(f"¡Proceso completado! Se crearon {creados} usuarios en {duracion:.1f} s "
+          f"({creados / duracion if duracion else 0:.0f} usuarios/s; hash {tiempo_hash:.1f} s, "
+          f"inserción {tiempo_insercion:.1f} s).")
+    print(f"Todos los usuarios nuevos tienen la contraseña: {contrasena}")
+    return creados
+
+def main():
+    parser = argparse.ArgumentParser(description="Crea usuarios automáticos hasta llegar a un total.")
+    parser.add_argument('--total', type=int, default=150, help="Cantidad total de usuarios que debe haber.")
+    parser.add_argument('--contrasena', default=CONTRASENA_POR_DEFECTO)
+    parser.add_argument('--hash', choices=sorted(METODOS_HASH), default='seguro',
+                        help="'rapido' sólo para bases de prueba: el hash no es seguro.")
+    parser.add_argument('--procesos', type=int, default=None, help="Procesos para hashear (por defecto, uno por CPU).")
+    parser.add_argument('--lote', type=int, default=5000, help="Filas por INSERT masivo.")
+    parser.add_argument('--semilla', type=int, default=None, help="Semilla para repetir los mismos nombres y DNIs.")
+    args = parser.parse_args()
+
+    # --- ENVOLVER EN EL CONTEXTO DE LA APP ---
     # (Necesario para que el script pueda hablar con la DB)
     with app.app_context():
-        crear_usuarios_automaticos(150)
\ No newline at end of file
+        crear_usuarios_automaticos(args.total, args.contrasena, args.hash, args.procesos, args.lote, args.semilla)
+
+if __name__ == '__main__':
+    main()
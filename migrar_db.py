@@ -0,0 +1,393 @@
+"""
+Migraciones del esquema de la base de datos.
+
+Cada paso es idempotente: inspecciona el esquema actual y sólo aplica los
+cambios que falten, así que el script se puede ejecutar todas las veces que
+sea necesario (por ejemplo, en cada deploy). Las tablas que no existen se
+crean directamente con el esquema actual de los modelos.
+
+Uso:
+    python migrar_db.py                     # aplica los pasos pendientes
+    python migrar_db.py --verificar-planes  # EXPLAIN de las consultas de cada ruta
+"""
+import sys
+from datetime import date, time, timedelta
+
+from sqlalchemy import inspect, text, Date
+from sqlalchemy.exc import OperationalError
+
+# --- IMPORTANTE: Importamos la app, la DB y los modelos ---
+from app import (app, db, Reserva, Gasto, ResumenDiario, reconstruir_resumen_diario, consulta_ocupacion,
+                 consulta_reservas_activas, consulta_reservas_del_dia, consulta_ingresos_periodo,
+                 consulta_reservas_de_cancha, consulta_pagina_turnos, consultas_por_periodo,
+                 consulta_reservas_por_usuario, consulta_demanda_turnos, consulta_gastos_por_categoria,
+                 consulta_gastos_mas_caros, consulta_listado_gastos, consulta_proximos_turnos,
+                 consulta_total_turnos_usuario, consulta_historial_turnos, consulta_pagina_reservas_usuario,
+                 SUMAS_RESUMEN)
+
+# Filas por lote al convertir datos existentes. Cada lote es una transacción
+# corta, así la tabla sigue disponible para la app mientras se migra.
+TAMANO_LOTE = 5000
+
+
+def es_mysql():
+    return db.engine.dialect.name == 'mysql'
+
+def columnas(tabla):
+    """Devuelve las columnas actuales de una tabla, indexadas por nombre."""
+    return {c['name']: c for c in inspect(db.engine).get_columns(tabla)}
+
+def indices(tabla):
+    """Devuelve los nombres de los índices actuales de una tabla."""
+    return {i['name'] for i in inspect(db.engine).get_indexes(tabla)}
+
+
+# --- Pasos de migración ---
+# Cada paso devuelve True si aplicó cambios y False si ya estaba aplicado.
+
+def paso_columna_turno_activo():
+    """Agrega a 'reservas' la columna generada 'turno_activo' (1 si activa, NULL si cancelada)."""
+    if 'turno_activo' in columnas('reservas'):
+        return False
+
+    tipo = 'TINYINT' if es_mysql() else 'INTEGER'
+    # VIRTUAL: no reescribe la tabla, el valor se calcula al leer/indexar
+    db.session.execute(text(
+        f"ALTER TABLE reservas ADD COLUMN turno_activo {tipo} "
+        "GENERATED ALWAYS AS (CASE WHEN estado = 'activa' THEN 1 ELSE NULL END) VIRTUAL"
+    ))
+    return True
+
+def paso_indice_turno_unico():
+    """Crea el índice único que impide dos reservas activas en el mismo turno."""
+    if 'uq_reservas_turno_activo' in indices('reservas'):
+        return False
+
+    # Si ya hay turnos duplicados el índice no se puede crear: se informan para resolverlos a mano
+    duplicados = db.session.execute(text(
+        "SELECT cancha_id, fecha, hora_inicio, COUNT(*) FROM reservas "
+        "WHERE estado = 'activa' GROUP BY cancha_id, fecha, hora_inicio HAVING COUNT(*) > 1"
+    )).all()
+    if duplicados:
+        print("  Hay turnos activos duplicados. Cancela los sobrantes y vuelve a ejecutar:")
+        for cancha_id, fecha, hora_inicio, cantidad in duplicados:
+            print(f"    - Cancha {cancha_id}, {fecha} {hora_inicio}: {cantidad} reservas activas")
+        raise RuntimeError("No se pudo crear el índice 'uq_reservas_turno_activo'.")
+
+    # En MySQL (InnoDB) CREATE INDEX se ejecuta en línea, sin bloquear escrituras
+    db.session.execute(text(
+        "CREATE UNIQUE INDEX uq_reservas_turno_activo "
+        "ON reservas (cancha_id, fecha, hora_inicio, turno_activo)"
+    ))
+    return True
+
+def alterar_en_linea(tabla, cambios, instantaneo=False):
+    """
+    ALTER TABLE que no detiene las lecturas ni las escrituras de la app:
+    ALGORITHM=INSTANT (sólo metadatos) si se pide y el servidor lo admite, si
+    no INPLACE con LOCK=NONE. Si algún cambio no se puede hacer así, MySQL
+    rechaza el ALTER en vez de bloquear la tabla.
+    """
+    sentencia = f"ALTER TABLE {tabla} " + ", ".join(cambios)
+    if instantaneo:
+        try:
+            db.session.execute(text(sentencia + ", ALGORITHM=INSTANT"))
+            db.session.commit()
+            return
+        except OperationalError:
+            db.session.rollback() # Versión sin INSTANT para estos cambios
+    db.session.execute(text(sentencia + ", ALGORITHM=INPLACE, LOCK=NONE"))
+    db.session.commit()
+
+def tipos_columnas_mysql(tabla):
+    """Devuelve la definición de tipo completa (ej: 'varchar(10)') de cada columna de una tabla."""
+    return dict(db.session.execute(text(
+        "SELECT COLUMN_NAME, COLUMN_TYPE FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :tabla"
+    ), {'tabla': tabla}).all())
+
+def convertir_columnas_mysql(tabla, conversiones):
+    """
+    Convierte columnas de texto a tipos nativos en MySQL sin bloquear la tabla:
+      1. Agrega columnas sombra '<columna>_nueva' (operación instantánea) y
+         triggers que las completan en cada INSERT/UPDATE de la app mientras
+         dura la migración (requieren el privilegio TRIGGER).
+      2. Completa las filas existentes por lotes de ids, en transacciones cortas.
+      3. En un ALTER en línea marca las columnas sombra NOT NULL, permite NULL
+         en las viejas y crea sobre las sombra una copia '<índice>_nueva' de
+         cada índice que usa las columnas viejas (incluido el único de turnos).
+      4. Elimina los triggers y, en un ALTER que sólo cambia metadatos, renombra
+         las columnas viejas a '<columna>_vieja' y las sombra a su nombre final,
+         y reemplaza cada índice por su copia. Un INSERT que llegue entre esas
+         dos sentencias falla (la sombra es NOT NULL) en vez de guardar una fila
+         sin convertir; la app nunca modifica fechas u horas ya guardadas.
+      5. Elimina las columnas '_vieja'.
+    conversiones: {columna: (tipo_sql, expresion_sql)}, donde la expresión usa
+    '{}' en lugar de la columna de origen (ej: 'CAST({} AS DATE)').
+    Si se interrumpe, al volver a ejecutarlo retoma desde donde quedó.
+    """
+    if not any(f"{c}_vieja" in columnas(tabla) for c in conversiones):
+        nuevas = [c for c in conversiones if f"{c}_nueva" not in columnas(tabla)]
+        if nuevas:
+            alterar_en_linea(tabla, [f"ADD COLUMN {c}_nueva {conversiones[c][0]} NULL" for c in nuevas],
+                             instantaneo=True)
+
+        triggers = [f"trg_{tabla}_migracion_insert", f"trg_{tabla}_migracion_update"]
+        asignaciones_trigger = ", ".join(
+            f"NEW.{c}_nueva = {expresion.format(f'NEW.{c}')}" for c, (_, expresion) in conversiones.items())
+        for nombre, evento in zip(triggers, ('INSERT', 'UPDATE')):
+            db.session.execute(text(f"DROP TRIGGER IF EXISTS {nombre}"))
+            db.session.execute(text(
+                f"CREATE TRIGGER {nombre} BEFORE {evento} ON {tabla} FOR EACH ROW SET {asignaciones_trigger}"))
+        db.session.commit()
+
+        asignaciones = ", ".join(f"{c}_nueva = {expresion.format(c)}" for c, (_, expresion) in conversiones.items())
+        pendientes = " OR ".join(f"{c}_nueva IS NULL" for c in conversiones)
+
+        # Desde acá los triggers cubren las filas nuevas: una sola pasada alcanza
+        max_id = db.session.execute(text(f"SELECT COALESCE(MAX(id), 0) FROM {tabla}")).scalar()
+        for desde in range(0, max_id + 1, TAMANO_LOTE):
+            db.session.execute(
+                text(f"UPDATE {tabla} SET {asignaciones} WHERE id >= :desde AND id < :hasta AND ({pendientes})"),
+                {'desde': desde, 'hasta': desde + TAMANO_LOTE}
+            )
+            db.session.commit()
+
+        # Preparación: todo lo que reconstruye la tabla o un índice se hace
+        # acá, en línea, mientras la app sigue usando las columnas viejas
+        actuales = columnas(tabla)
+        tipos = tipos_columnas_mysql(tabla)
+        previos = inspect(db.engine).get_indexes(tabla)
+        nombres_previos = {i['name'] for i in previos}
+        dependientes = [i for i in previos if set(i['column_names']) & set(conversiones)]
+        preparacion = [f"MODIFY COLUMN {c}_nueva {tipo} NOT NULL"
+                       for c, (tipo, _) in conversiones.items() if actuales[f"{c}_nueva"]['nullable']]
+        preparacion += [f"MODIFY COLUMN {c} {tipos[c]} NULL" for c in conversiones if not actuales[c]['nullable']]
+        preparacion += [
+            f"ADD {'UNIQUE ' if i['unique'] else ''}INDEX {i['name']}_nueva ("
+            + ", ".join(f"{c}_nueva" if c in conversiones else c for c in i['column_names']) + ")"
+            for i in dependientes if f"{i['name']}_nueva" not in nombres_previos
+        ]
+        if preparacion:
+            alterar_en_linea(tabla, preparacion)
+
+        # Reemplazo: sólo renombres y bajas de índices, sin copiar filas
+        for nombre in triggers:
+            db.session.execute(text(f"DROP TRIGGER IF EXISTS {nombre}"))
+        db.session.commit()
+        cambios = []
+        for c, (tipo, _) in conversiones.items():
+            cambios += [f"CHANGE COLUMN {c} {c}_vieja {tipos[c]} NULL", f"CHANGE COLUMN {c}_nueva {c} {tipo} NOT NULL"]
+        for i in dependientes:
+            cambios += [f"DROP INDEX {i['name']}", f"RENAME INDEX {i['name']}_nueva TO {i['name']}"]
+        alterar_en_linea(tabla, cambios)
+
+    viejas = [f"{c}_vieja" for c in conversiones if f"{c}_vieja" in columnas(tabla)]
+    if viejas:
+        alterar_en_linea(tabla, [f"DROP COLUMN {c}" for c in viejas], instantaneo=True)
+
+def conversion_pendiente(tabla, columna, tipo):
+    """True si la columna todavía no tiene el tipo nativo o quedó a medio convertir."""
+    actuales = columnas(tabla)
+    return not isinstance(actuales[columna]['type'], tipo) or f"{columna}_vieja" in actuales
+
+def convertir_horas_sqlite(tabla, columnas_hora):
+    """
+    SQLite no tiene tipos DATE/TIME reales: SQLAlchemy guarda las fechas como
+    'YYYY-MM-DD' (las existentes ya son compatibles) y las horas como
+    'HH:MM:SS.ffffff'. Se completan por lotes las horas guardadas como 'HH:MM'.
+    """
+    convertidas = 0
+    for columna in columnas_hora:
+        while True:
+            resultado = db.session.execute(text(
+                f"UPDATE {tabla} SET {columna} = {columna} || '\\:00.000000' WHERE id IN ("
+                f"SELECT id FROM {tabla} WHERE length({columna}) = 5 LIMIT {TAMANO_LOTE})"
+            ))
+            db.session.commit()
+            if resultado.rowcount == 0:
+                break
+            convertidas += resultado.rowcount
+    return convertidas > 0
+
+def paso_reservas_tipos_nativos():
+    """Convierte reservas.fecha a DATE y reservas.hora_inicio/hora_fin a TIME."""
+    if not es_mysql():
+        return convertir_horas_sqlite('reservas', ['hora_inicio', 'hora_fin'])
+
+    if not conversion_pendiente('reservas', 'fecha', Date):
+        return False
+    # La FK de cancha_id necesita un índice que empiece por esa columna, y el
+    # índice único se reemplaza junto con las columnas
+    if 'ix_reservas_cancha_id' not in indices('reservas'):
+        db.session.execute(text("CREATE INDEX ix_reservas_cancha_id ON reservas (cancha_id)"))
+        db.session.commit()
+    convertir_columnas_mysql('reservas', {
+        'fecha': ('DATE', 'CAST({} AS DATE)'),
+        'hora_inicio': ('TIME', 'CAST({} AS TIME)'),
+        'hora_fin': ('TIME', 'CAST({} AS TIME)'),
+    })
+    return True
+
+def paso_gastos_tipos_nativos():
+    """Convierte gastos.fecha a DATE (en SQLite los valores ya son compatibles)."""
+    if not es_mysql() or not conversion_pendiente('gastos', 'fecha', Date):
+        return False
+    convertir_columnas_mysql('gastos', {
+        'fecha': ('DATE', 'CAST({} AS DATE)'),
+    })
+    return True
+
+def paso_indices_compuestos():
+    """Crea los índices que usan las consultas de las rutas (disponibilidad, paneles, informes)."""
+    definiciones = {
+        'reservas': {
+            'ix_reservas_estado_fecha': '(estado, fecha)',
+            'ix_reservas_usuario_estado_fecha': '(usuario_id, estado, fecha)',
+            'ix_reservas_estado_cancha_hora': '(estado, cancha_id, hora_inicio, fecha)',
+        },
+        'gastos': {
+            'ix_gastos_fecha': '(fecha)',
+            'ix_gastos_categoria_monto': '(categoria, monto)',
+            'ix_gastos_monto': '(monto)',
+        },
+    }
+    aplicado = False
+    for tabla, indices_tabla in definiciones.items():
+        existentes = indices(tabla)
+        for nombre, columnas_indice in indices_tabla.items():
+            if nombre not in existentes:
+                db.session.execute(text(f"CREATE INDEX {nombre} ON {tabla} {columnas_indice}"))
+                aplicado = True
+    return aplicado
+
+def paso_resumen_diario():
+    """Carga 'resumen_diario' desde el historial si la tabla se acaba de crear (vacía)."""
+    if db.session.query(ResumenDiario.fecha).first() is not None:
+        return False
+    if db.session.query(Reserva.id).first() is None and db.session.query(Gasto.id).first() is None:
+        return False # Base nueva: la app lo irá completando
+    reconstruir_resumen_diario()
+    return True
+
+PASOS = [
+    paso_columna_turno_activo,
+    paso_reservas_tipos_nativos,
+    paso_gastos_tipos_nativos,
+    paso_indice_turno_unico,
+    paso_indices_compuestos,
+    paso_resumen_diario,
+]
+
+
+def migrar():
+    """Crea las tablas faltantes y aplica, en orden, los pasos pendientes."""
+    with app.app_context():
+        db.create_all() # No modifica tablas existentes, sólo crea las que faltan
+
+        for paso in PASOS:
+            try:
+                aplicado = paso()
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                print(f"[ERROR] {paso.__name__}: {e}")
+                return 1
+            estado = "aplicado" if aplicado else "ya estaba aplicado"
+            print(f"[OK] {paso.__name__}: {estado}")
+
+    print("Migración completada.")
+    return 0
+
+
+# --- Verificación de planes de ejecución ---
+
+def consultas_de_rutas():
+    """
+    Las consultas que ejecuta cada ruta, armadas con las mismas funciones que
+    usan las rutas y con valores de ejemplo. Todas deberían resolverse con un
+    índice, nunca recorriendo la tabla completa. Sólo quedan afuera las
+    exportaciones CSV, que leen la tabla entera a propósito (por id).
+    """
+    hoy = date.today()
+    cursor = (hoy, time(20, 0), 1000)
+    limite = app.config['TURNOS_POR_PAGINA']
+    consultas = {
+        'api_turnos_disponibles': consulta_ocupacion(hoy, hoy),
+        'api_turnos_disponibles_rango': consulta_ocupacion(hoy, hoy + timedelta(days=30)),
+        'panel_administrador (reservas de hoy)': consulta_reservas_del_dia(hoy),
+        'panel_administrador (ingresos del mes)': consulta_ingresos_periodo(hoy.replace(day=1), hoy),
+        'panel_usuario (próximos turnos)': consulta_proximos_turnos(1, hoy),
+        'panel_usuario (total de turnos)': consulta_total_turnos_usuario(1),
+        'mis_turnos': consulta_historial_turnos(1),
+        'cancelar_turno / api_cancelar_reservas': consulta_reservas_activas([1000, 1001], usuario_id=1),
+        'cancelar_turno_admin': consulta_reservas_activas([1000]),
+        'api_listar_reservas (página siguiente)': consulta_pagina_reservas_usuario(1, 'activa', [], cursor, limite),
+        'ver_turnos_administrador (página siguiente)': consulta_pagina_turnos('activa', [], cursor, limite),
+        'ver_turnos_cancelados_administrador (página siguiente)': consulta_pagina_turnos(
+            'cancelada', [], cursor, limite),
+        'eliminar_cancha (reservas asociadas)': consulta_reservas_de_cancha(1),
+        'panel_reportes (reservas por usuario)': consulta_reservas_por_usuario(),
+        'panel_reportes (demanda por cancha/hora/día)': consulta_demanda_turnos(),
+        'reporte_gastos (por categoría)': consulta_gastos_por_categoria(),
+        'reporte_gastos (más caros)': consulta_gastos_mas_caros(10),
+        'gestionar_gastos': consulta_listado_gastos(),
+    }
+    # Informe financiero (ingresos y egresos) y reporte de gastos (egresos, sin el detalle diario)
+    for nombre, (columna_monto, filtros) in SUMAS_RESUMEN.items():
+        for granularidad, (consulta, _) in consultas_por_periodo(
+                ResumenDiario.fecha, columna_monto, filtros, hoy).items():
+            consultas[f'informe_financiero_administrador ({nombre} {granularidad})'] = consulta
+    return consultas
+
+def explicar(consulta):
+    """Ejecuta EXPLAIN (MySQL) o EXPLAIN QUERY PLAN (SQLite) y devuelve las filas del plan."""
+    dialecto = db.engine.dialect
+    # render_postcompile: los IN (...) con listas se expanden a un parámetro por valor
+    compilada = consulta.compile(dialect=dialecto, compile_kwargs={'render_postcompile': True})
+
+    # Se aplican los conversores de tipo (ej: date/time -> texto en SQLite)
+    parametros = {}
+    for nombre, valor in compilada.construct_params().items():
+        parametro = compilada.binds[nombre if nombre in compilada.binds else nombre.rsplit('_', 1)[0]] # 'id_1_2' -> 'id_1'
+        procesador = parametro.type.dialect_impl(dialecto).bind_processor(dialecto)
+        parametros[nombre] = procesador(valor) if procesador else valor
+    if compilada.positional:
+        parametros = tuple(parametros[nombre] for nombre in compilada.positiontup)
+    prefijo = 'EXPLAIN ' if es_mysql() else 'EXPLAIN QUERY PLAN '
+    return db.session.connection().exec_driver_sql(prefijo + str(compilada), parametros).mappings().all()
+
+def es_recorrido_completo(fila):
+    """Indica si una fila del plan recorre completa la tabla 'reservas' o 'gastos'."""
+    if es_mysql():
+        return fila['table'] in ('reservas', 'gastos') and fila['type'] == 'ALL'
+    detalle = fila['detail']
+    return detalle.startswith(('SCAN reservas', 'SCAN gastos')) and 'INDEX' not in detalle
+
+def verificar_planes():
+    """
+    Prueba de regresión de planes: falla si alguna consulta de ruta deja de usar
+    un índice. Conviene correrla sobre una base con datos representativos, ya que
+    el optimizador de MySQL elige el plan según las estadísticas de cada tabla.
+    """
+    fallas = 0
+    with app.app_context():
+        for nombre, consulta in consultas_de_rutas().items():
+            plan = explicar(consulta)
+            completos = [fila for fila in plan if es_recorrido_completo(fila)]
+            print(f"[{'FALLA' if completos else 'OK'}] {nombre}")
+            for fila in plan:
+                print(f"    {dict(fila)}")
+            fallas += bool(completos)
+        db.session.rollback()
+
+    if fallas:
+        print(f"{fallas} consulta(s) recorren una tabla completa.")
+        return 1
+    print("Todas las consultas usan índices.")
+    return 0
+
+if __name__ == '__main__':
+    if '--verificar-planes' in sys.argv:
+        sys.exit(verificar_planes())
+    sys.exit(migrar())
@@ -0,0 +1,47 @@
+"""
+Reconstruye la tabla 'resumen_diario' (y su desglose por cancha) a partir de
+las tablas 'reservas' y 'gastos'.
+
+La app mantiene el resumen al día en cada reserva, cancelación o gasto; este
+script sirve para repararlo si se cargaron datos por fuera de la app (scripts
+de simulación, importaciones, correcciones manuales en la DB).
+
+Uso:
+    python reconstruir_resumen.py                                  # todo el historial
+    python reconstruir_resumen.py --desde 2025-01-01 --hasta 2025-12-31
+"""
+import argparse
+from datetime import datetime
+
+# --- IMPORTANTE: Importamos la app, la DB y la función de reconstrucción ---
+from app import app, db, reconstruir_resumen_diario
+
+
+def fecha_argumento(valor):
+    """Convierte un argumento 'YYYY-MM-DD' en date (para argparse)."""
+    try:
+        return datetime.strptime(valor, '%Y-%m-%d').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"fecha inválida '{valor}', se espera YYYY-MM-DD")
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconstruye el resumen diario de ingresos y egresos.")
+    parser.add_argument('--desde', type=fecha_argumento, help="Primera fecha a reconstruir (YYYY-MM-DD).")
+    parser.add_argument('--hasta', type=fecha_argumento, help="Última fecha a reconstruir (YYYY-MM-DD).")
+    args = parser.parse_args()
+
+    with app.app_context():
+        try:
+            dias = reconstruir_resumen_diario(args.desde, args.hasta)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error al reconstruir el resumen diario: {e}")
+            return 1
+
+    rango = f"del {args.desde or 'inicio'} al {args.hasta or 'final'}"
+    print(f"Resumen diario reconstruido {rango}: {dias} días con movimientos.")
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,12 +1,27 @@
+"""
+Simulación de gastos del negocio (egresos) a partir de los catálogos de abajo.
+
+Genera un rango de años, ajustando los montos por inflación mes a mes, y es
+idempotente: los meses que ya tienen gastos simulados se saltean, así que se
+puede volver a correr o ampliar el rango sin duplicar nada.
+
+Uso:
+    python simular_gastos.py                                  # año actual
+    python simular_gastos.py --desde-anio 2018 --hasta-anio 2025 --inflacion-anual 0.6 --semilla 3
+"""
 import sys
+import time
 import random
-from datetime import datetime
+import argparse
+from datetime import datetime, date
+
+from sqlalchemy import insert
 
 # --- IMPORTACIÓN CLAVE ---
 # Importamos la 'app' y la 'db' desde tu archivo principal app.py
 # También importamos el modelo 'Gasto' que debe estar definido en app.py
 try:
-    from app import app, db, Gasto
+    from app import app, db, Gasto, reconstruir_resumen_diario, expresiones_periodo
 except ImportError:
     print("Error: No se pudo encontrar 'app.py' o los modelos 'app', 'db', 'Gasto'.")
     print("Asegúrate de que este script esté en la misma carpeta que 'app.py' y que 'Gasto' esté definido.")
@@ -51,88 +66,136 @@ GASTOS_OCASIONALES = [
     {"cat": "Insumos", "con": "Rotura de Redes", "monto": 50000},
 ]
 
-def simular_gastos():
+# --- CALENDARIO DE CADA TIPO DE GASTO ---
+# (catálogo, meses en los que se paga, día de pago, descripción)
+CALENDARIO_GASTOS = [
+    (GASTOS_MENSUALES, range(1, 13), 15, "Gasto mensual simulado"),
+    (GASTOS_TRIMESTRALES, (3, 6, 9, 12), 10, "Gasto trimestral simulado"),
+    (GASTOS_SEMESTRALES, (6, 12), 20, "Gasto semestral simulado"),
+    (GASTOS_ANUALES, (1,), 25, "Gasto anual simulado"),
+]
+
+# Todas las descripciones terminan así: identifica los gastos generados por este script
+SUFIJO_SIMULADO = "simulado"
+
+def factor_inflacion(anio, mes, anio_base, inflacion_anual):
+    """
+    Multiplicador de precios para un mes: los montos del catálogo son los de
+    enero de 'anio_base' y se ajustan con interés compuesto mensual (hacia
+    atrás para años anteriores, hacia adelante para posteriores).
+    """
+    meses = (anio - anio_base) * 12 + (mes - 1)
+    return (1 + inflacion_anual) ** (meses / 12)
+
+def meses_ya_simulados(desde_anio, hasta_anio):
+    """Conjunto de (año, mes) del rango que ya tienen gastos simulados cargados."""
+    periodo = expresiones_periodo(Gasto.fecha)
+    filas = db.session.query(periodo['anio'], periodo['mes']).filter(
+        Gasto.fecha.between(date(desde_anio, 1, 1), date(hasta_anio, 12, 31)),
+        Gasto.descripcion.like(f"%{SUFIJO_SIMULADO}"),
+    ).distinct().all()
+    return {(int(anio), int(mes)) for anio, mes in filas}
+
+def generar_gastos_anio(anio, meses_omitidos, anio_base, inflacion_anual, variacion, semilla=None):
     """
-    Función principal que genera y guarda los gastos de un año.
+    Arma las filas de gastos de un año (sin insertarlas), salteando los meses
+    de 'meses_omitidos'. Cada monto se ajusta por inflación y se le aplica una
+    variación aleatoria de +/- 'variacion' (ej: 0.05 = 5%).
+    Cada mes (y los ocasionales del año) usa su propio generador aleatorio:
+    con 'semilla', un mes sale igual aunque el año se simule por partes.
     """
-    print("Iniciando simulación de gastos para un año...")
-    
-    # Usamos el año actual (2025) para la simulación
-    AÑO_ACTUAL = datetime.now().year 
-    
+    def generador(parte):
+        return random.Random(f"{semilla}-{anio}-{parte}") if semilla is not None else random.Random()
+
+    def monto(gasto_data, mes, rng):
+        base = gasto_data['monto'] * factor_inflacion(anio, mes, anio_base, inflacion_anual)
+        return round(base * rng.uniform(1 - variacion, 1 + variacion), 2)
+
+    filas = []
+    # --- 1. GASTOS FIJOS Y RECURRENTES ---
+    generadores_mes = {mes: generador(mes) for mes in range(1, 13)}
+    for catalogo, meses, dia, descripcion in CALENDARIO_GASTOS:
+        for mes in meses:
+            if mes in meses_omitidos:
+                continue
+            for gasto_data in catalogo:
+                filas.append({'fecha': date(anio, mes, dia), 'monto': monto(gasto_data, mes, generadores_mes[mes]),
+                              'categoria': gasto_data['cat'], 'concepto': gasto_data['con'],
+                              'descripcion': descripcion})
+
+    # --- 2. GASTOS OCASIONALES (en un mes al azar) ---
+    # Se sortean siempre mes, día y monto, aunque el mes se saltee: los demás no cambian
+    rng = generador('ocasionales')
+    for gasto_data in GASTOS_OCASIONALES:
+        mes_aleatorio = rng.randint(1, 12)
+        dia_aleatorio = rng.randint(1, 28) # Usamos 28 para evitar problemas con Febrero
+        monto_aleatorio = monto(gasto_data, mes_aleatorio, rng)
+        if mes_aleatorio in meses_omitidos:
+            continue
+        filas.append({'fecha': date(anio, mes_aleatorio, dia_aleatorio), 'monto': monto_aleatorio,
+                      'categoria': gasto_data['cat'], 'concepto': gasto_data['con'],
+                      'descripcion': "Gasto ocasional simulado"})
+    return filas
+
+def simular_gastos(desde_anio=None, hasta_anio=None, inflacion_anual=0.0, anio_base=None,
+                   variacion=0.0, semilla=None):
+    """
+    Genera y guarda los gastos de cada año del rango (por defecto, el año
+    actual). Cada año se inserta con un único INSERT masivo, actualiza su
+    resumen diario y se confirma en su propia transacción.
+    Los montos del catálogo valen para 'anio_base' (por defecto, el año
+    actual, y no el final del rango: así, al ampliar el rango en otra
+    corrida, los precios siguen la misma serie de inflación).
+    Devuelve la cantidad de gastos creados.
+    """
+    hasta_anio = hasta_anio or datetime.now().year
+    desde_anio = desde_anio or hasta_anio
+    anio_base = anio_base or datetime.now().year
+    print(f"Iniciando simulación de gastos para {desde_anio}-{hasta_anio} "
+          f"(inflación anual {inflacion_anual:.0%}, montos base de {anio_base})...")
+
+    creados = 0
+    inicio = time.perf_counter()
     # --- Contexto de la Aplicación ---
     # Esto es OBLIGATORIO para que SQLAlchemy sepa a qué DB conectarse
     with app.app_context():
-        try:
-            # --- 1. GASTOS RECURRENTES ---
-            print("Cargando gastos fijos y recurrentes...")
-            for mes in range(1, 13):
-                print(f"  Procesando Mes {mes}/{AÑO_ACTUAL}...")
-                
-                # Insertar todos los gastos mensuales
-                for gasto_data in GASTOS_MENSUALES:
-                    # Usamos el día 15 como fecha de pago estándar
-                    fecha_gasto_str = f"{AÑO_ACTUAL}-{mes:02d}-15"
-                    gasto = Gasto(
-                        fecha=fecha_gasto_str,
-                        monto=gasto_data['monto'],
-                        categoria=gasto_data['cat'],
-                        concepto=gasto_data['con'],
-                        descripcion="Gasto mensual simulado"
-                    )
-                    db.session.add(gasto)
-                
-                # Insertar gastos trimestrales
-                if mes in [3, 6, 9, 12]:
-                    for gasto_data in GASTOS_TRIMESTRALES:
-                        fecha_gasto_str = f"{AÑO_ACTUAL}-{mes:02d}-10"
-                        gasto = Gasto(fecha=fecha_gasto_str, monto=gasto_data['monto'], categoria=gasto_data['cat'], concepto=gasto_data['con'], descripcion="Gasto trimestral simulado")
-                        db.session.add(gasto)
-
-                # Insertar gastos semestrales
-                if mes in [6, 12]:
-                    for gasto_data in GASTOS_SEMESTRALES:
-                        fecha_gasto_str = f"{AÑO_ACTUAL}-{mes:02d}-20"
-                        gasto = Gasto(fecha=fecha_gasto_str, monto=gasto_data['monto'], categoria=gasto_data['cat'], concepto=gasto_data['con'], descripcion="Gasto semestral simulado")
-                        db.session.add(gasto)
-
-                # Insertar gastos anuales
-                if mes == 1:
-                    for gasto_data in GASTOS_ANUALES:
-                        fecha_gasto_str = f"{AÑO_ACTUAL}-{mes:02d}-25"
-                        gasto = Gasto(fecha=fecha_gasto_str, monto=gasto_data['monto'], categoria=gasto_data['cat'], concepto=gasto_data['con'], descripcion="Gasto anual simulado")
-                        db.session.add(gasto)
-            
-            # --- 2. GASTOS OCASIONALES ---
-            print("\nCargando gastos ocasionales (en meses aleatorios)...")
-            for gasto_data in GASTOS_OCASIONALES:
-                mes_aleatorio = random.randint(1, 12)
-                dia_aleatorio = random.randint(1, 28) # Usamos 28 para evitar problemas con Febrero
-                fecha_gasto_str = f"{AÑO_ACTUAL}-{mes_aleatorio:02d}-{dia_aleatorio:02d}"
-                
-                gasto = Gasto(
-                    fecha=fecha_gasto_str,
-                    monto=gasto_data['monto'],
-                    categoria=gasto_data['cat'],
-                    concepto=gasto_data['con'],
-                    descripcion="Gasto ocasional simulado"
-                )
-                db.session.add(gasto)
-                print(f"  -> '{gasto_data['con']}' asignado al {fecha_gasto_str}")
-
-            # --- 3. COMMIT A LA BASE DE DATOS ---
-            print("\nGuardando todos los gastos en la base de datos...")
-            db.session.commit()
-            print("\n¡Éxito! La simulación de gastos ha sido guardada en la base de datos.")
-
-        except Exception as e:
-            print(f"\n*** ERROR: Ocurrió un problema y no se pudieron guardar los gastos. ***")
-            print(f"Detalle del error: {e}")
-            print("Haciendo rollback (revirtiendo cambios)...")
-            db.session.rollback()
-        finally:
-            print("Simulación terminada.")
+        ya_simulados = meses_ya_simulados(desde_anio, hasta_anio)
+        for anio in range(desde_anio, hasta_anio + 1):
+            meses_omitidos = {mes for (a, mes) in ya_simulados if a == anio}
+            if len(meses_omitidos) == 12:
+                print(f"  {anio}: ya simulado, se saltea.")
+                continue
+
+            filas = generar_gastos_anio(anio, meses_omitidos, anio_base, inflacion_anual, variacion, semilla)
+            try:
+                if filas:
+                    db.session.execute(insert(Gasto), filas)
+                reconstruir_resumen_diario(date(anio, 1, 1), date(anio, 12, 31))
+                db.session.commit()
+            except Exception as e:
+                print(f"\n*** ERROR: Ocurrió un problema y no se pudieron guardar los gastos de {anio}. ***")
+                print(f"Detalle del error: {e}")
+                print("Haciendo rollback (revirtiendo cambios del año)...")
+                db.session.rollback()
+                break
+
+            creados += len(filas)
+            omitidos = f" ({len(meses_omitidos)} meses ya estaban simulados)" if meses_omitidos else ""
+            print(f"  {anio}: {len(filas)} gastos, total ${sum(f['monto'] for f in filas):,.2f}{omitidos}")
+
+    print(f"Simulación terminada: {creados} gastos en {time.perf_counter() - inicio:.1f} s.")
+    return creados
 
 # --- Punto de entrada para ejecutar el script ---
 if __name__ == "__main__":
-    simular_gastos()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Simula los gastos del negocio para un rango de años.")
+    parser.add_argument('--desde-anio', type=int, help="Primer año a simular (por defecto, --hasta-anio).")
+    parser.add_argument('--hasta-anio', type=int, help="Último año a simular (por defecto, el actual).")
+    parser.add_argument('--inflacion-anual', type=float, default=0.0,
+                        help="Inflación anual para ajustar los montos (ej: 0.5 = 50%%).")
+    parser.add_argument('--anio-base', type=int, help="Año en el que valen los montos del catálogo (por defecto, el actual).")
+    parser.add_argument('--variacion', type=float, default=0.0,
+                        help="Variación aleatoria de cada monto (0.05 = +/-5%%). Por defecto 0: montos exactos.")
+    parser.add_argument('--semilla', type=int, default=None)
+    args = parser.parse_args()
+    simular_gastos(args.desde_anio, args.hasta_anio, args.inflacion_anual, args.anio_base, args.variacion, args.semilla)
@@ -1,20 +1,72 @@
+"""
+Simulación de reservas para datos de ejemplo y de prueba.
+
+Sin argumentos abre el menú interactivo (día / mes / año). Con --desde y
+--hasta genera reservas masivas sin preguntar, vectorizadas con NumPy:
+
+    python simular_reservas.py --desde 2020-01-01 --hasta 2025-12-31 --por-dia 30 --semilla 7
+"""
 import os
+import time
 import random
-from datetime import datetime, timedelta
+import argparse
+from datetime import datetime, timedelta, time as dt_time
 from collections import defaultdict
 import calendar
 
+import numpy as np
+from sqlalchemy import insert, and_
+from sqlalchemy.exc import IntegrityError
+
 # --- IMPORTANTE: Importamos la app y los modelos de la DB ---
-from app import app, db, Usuario, Cancha, Reserva
+from app import app, db, Usuario, Cancha, Reserva, reconstruir_resumen_diario, HORA_APERTURA, HORA_CIERRE
 
 # --- La función crear_canchas_iniciales() se ha eliminado ---
 # --- La función crear_usuarios_iniciales() se ha eliminado ---
 
 
-def generar_simulacion(usuarios_disponibles, canchas_db, fecha_simulacion, total_reservas=14):
+def turnos_activos_por_fecha(desde, hasta):
+    """Turnos con reserva activa en la DB entre 'desde' y 'hasta': {'YYYY-MM-DD': {(cancha_id, 'HH:MM'), ...}}."""
+    ocupados = defaultdict(set)
+    filas = db.session.query(Reserva.fecha, Reserva.cancha_id, Reserva.hora_inicio).filter(
+        and_(Reserva.estado == 'activa', Reserva.fecha.between(desde, hasta))
+    ).all()
+    for fecha, cancha_id, hora_inicio in filas:
+        ocupados[fecha.isoformat()].add((cancha_id, hora_inicio.strftime('%H:%M')))
+    return ocupados
+
+def guardar_reservas(reservas_para_db):
+    """
+    Guarda las reservas simuladas y actualiza el resumen diario de esas fechas.
+    Si alguien reservó uno de los turnos mientras tanto, el índice único lo
+    rechaza: no se guarda nada, se informan los turnos en conflicto y devuelve False.
+    """
+    if not reservas_para_db:
+        return True
+    fechas = [r.fecha for r in reservas_para_db]
+    try:
+        db.session.add_all(reservas_para_db)
+        reconstruir_resumen_diario(min(fechas), max(fechas))
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        ocupados = turnos_activos_por_fecha(min(fechas), max(fechas))
+        conflictos = sorted({(r.fecha.isoformat(), r.cancha_id, r.hora_inicio.strftime('%H:%M'))
+                             for r in reservas_para_db if r.estado == 'activa'
+                             and (r.cancha_id, r.hora_inicio.strftime('%H:%M')) in ocupados[r.fecha.isoformat()]})
+        print("Error: estos turnos se reservaron mientras se generaba la simulación. No se guardó nada:")
+        for fecha, cancha_id, hora_inicio in conflictos:
+            print(f"  - {fecha} {hora_inicio}, cancha {cancha_id}")
+        return False
+    return True
+
+
+def generar_simulacion(usuarios_disponibles, canchas_db, fecha_simulacion, total_reservas=14, turnos_existentes=()):
     """
     Genera una simulación de reservas (LÓGICA DE 1 HORA)
     Respeta la regla de 1 usuario/semana y 14 reservas/día.
+    'turnos_existentes': {(cancha_id, 'HH:MM')} con reserva activa en la DB para
+    la fecha (ver turnos_activos_por_fecha); esos turnos no se vuelven a ocupar.
     """
     
     # Lógica de 14 reservas totales (9-10 activas, 4-5 canceladas)
@@ -27,7 +79,7 @@ def generar_simulacion(usuarios_disponibles, canchas_db, fecha_simulacion, total
 
     nuevas_reservas_generadas = []
     horas_inicio_reservas = []
-    turnos_ocupados = set()
+    turnos_ocupados = {(fecha_simulacion, cancha_id, hora) for cancha_id, hora in turnos_existentes}
     
     # Hacemos una copia de la lista de usuarios disponibles para este día
     usuarios_para_hoy = list(usuarios_disponibles)
@@ -61,14 +113,13 @@ def generar_simulacion(usuarios_disponibles, canchas_db, fecha_simulacion, total
         usuarios_para_hoy.remove(usuario)
 
         hora_inicio_dt = datetime.strptime(hora_inicio, '%H:%M')
-        hora_fin_str = (hora_inicio_dt + timedelta(hours=1)).strftime('%H:%M')
         
         reserva = Reserva(
             usuario_id=usuario.id,
             cancha_id=cancha.id,
-            fecha=fecha_simulacion,
-            hora_inicio=hora_inicio,
-            hora_fin=hora_fin_str,
+            fecha=datetime.strptime(fecha_simulacion, '%Y-%m-%d').date(),
+            hora_inicio=hora_inicio_dt.time(),
+            hora_fin=(hora_inicio_dt + timedelta(hours=1)).time(),
             monto=cancha.monto,
             estado='activa' 
         )
@@ -172,6 +223,7 @@ def generar_reservas_mensual(usuarios_db, canchas_db):
     
     semana_actual = -1
     usuarios_usados_esta_semana = set()
+    ocupados = turnos_activos_por_fecha(datetime(año, mes, 1).date(), datetime(año, mes, num_dias).date())
     
     for dia in range(1, num_dias + 1):
         fecha_actual_dt = datetime(año, mes, dia)
@@ -195,7 +247,8 @@ def generar_reservas_mensual(usuarios_db, canchas_db):
             continue
 
         total_reservas_dia = 14
-        estadisticas = generar_simulacion(usuarios_disponibles, canchas_db, fecha_actual, total_reservas_dia)
+        estadisticas = generar_simulacion(usuarios_disponibles, canchas_db, fecha_actual, total_reservas_dia,
+                                          ocupados[fecha_actual])
         
         if not estadisticas:
             print(f"Error al generar simulación para {fecha_actual}.")
@@ -205,8 +258,8 @@ def generar_reservas_mensual(usuarios_db, canchas_db):
         usuarios_usados_esta_semana.update(estadisticas['usuarios_usados'])
     
     print(f"\nGuardando {len(reservas_para_db)} reservas en la base de datos...")
-    db.session.add_all(reservas_para_db)
-    db.session.commit()
+    if not guardar_reservas(reservas_para_db):
+        return
 
     print(f"\nSimulación mensual completada para {mes_simulacion}!")
     print(f"- Total de reservas generadas: {len(reservas_para_db)}")
@@ -230,6 +283,7 @@ def generar_reservas_anual(usuarios_db, canchas_db):
     
     semana_actual = -1
     usuarios_usados_esta_semana = set()
+    ocupados = turnos_activos_por_fecha(start_date.date(), today.date())
     
     current_date = start_date
     while current_date <= today:
@@ -250,7 +304,8 @@ def generar_reservas_anual(usuarios_db, canchas_db):
             continue
             
         total_reservas_dia = 14
-        estadisticas = generar_simulacion(usuarios_disponibles, canchas_db, fecha_simulacion, total_reservas_dia)
+        estadisticas = generar_simulacion(usuarios_disponibles, canchas_db, fecha_simulacion, total_reservas_dia,
+                                          ocupados[fecha_simulacion])
         
         if not estadisticas:
             print(f"Error al generar simulación para {fecha_simulacion}.")
@@ -263,13 +318,124 @@ def generar_reservas_anual(usuarios_db, canchas_db):
         current_date += timedelta(days=1)
     
     print(f"\nGuardando {len(reservas_para_db)} reservas en la base de datos...")
-    db.session.add_all(reservas_para_db)
-    db.session.commit()
+    if not guardar_reservas(reservas_para_db):
+        return
 
     print(f"\nSimulación ANUAL completada!")
     print(f"- Total de días simulados: {total_dias + 1}")
     print(f"- Total de reservas generadas: {len(reservas_para_db)}")
 
+# --- Generación masiva (no interactiva, vectorizada) ---
+
+# Fracción de las reservas que cae en las horas preferentes (17:00 a 20:00),
+# la misma proporción que usa generar_simulacion
+PROPORCION_HORARIO_PREFERENTE = 0.7
+HORAS_PREFERENTES = range(17, 21)
+
+def pesos_por_turno(cantidad_canchas):
+    """Peso de cada turno del día (cancha x hora), con la demanda concentrada en las horas preferentes."""
+    horas = np.arange(HORA_APERTURA, HORA_CIERRE)
+    preferente = np.isin(horas, HORAS_PREFERENTES)
+    peso_hora = np.where(preferente,
+                         PROPORCION_HORARIO_PREFERENTE / preferente.sum(),
+                         (1 - PROPORCION_HORARIO_PREFERENTE) / (~preferente).sum())
+    return np.tile(peso_hora, cantidad_canchas) # Índice de turno = cancha * horas_por_dia + hora
+
+def turnos_activos_existentes(desde, hasta, canchas_ids, horas_por_dia):
+    """Índices (día, turno) de las reservas activas que ya hay en el rango: no se pueden volver a ocupar."""
+    posicion_cancha = {cancha_id: i for i, cancha_id in enumerate(canchas_ids)}
+    filas = db.session.query(Reserva.fecha, Reserva.cancha_id, Reserva.hora_inicio).filter(
+        and_(Reserva.estado == 'activa', Reserva.fecha.between(desde, hasta))
+    ).all()
+    return [((fecha - desde).days, posicion_cancha[cancha_id] * horas_por_dia + hora.hour - HORA_APERTURA)
+            for fecha, cancha_id, hora in filas if cancha_id in posicion_cancha]
+
+def generar_reservas_masivas(desde, hasta, por_dia=14, cancelacion=0.3, semilla=None, tamano_lote=50000):
+    """
+    Genera 'por_dia' reservas por día entre 'desde' y 'hasta' (inclusive).
+    Por día se eligen turnos distintos (nunca dos reservas en la misma cancha y
+    hora, ni sobre una reserva activa existente) con muestreo ponderado sin
+    reemplazo; el usuario y el estado se sortean con NumPy. Las filas se
+    insertan con INSERT masivos por tramos de días (memoria constante sin
+    importar el rango) y cada tramo actualiza el resumen diario y hace commit.
+    Devuelve la cantidad de reservas creadas.
+    """
+    usuarios_ids = np.array([i for (i,) in db.session.query(Usuario.id)])
+    canchas = db.session.query(Cancha.id, Cancha.monto).order_by(Cancha.id).all()
+    if not len(usuarios_ids) or not canchas:
+        print("Error: se necesitan usuarios y canchas. Ejecuta 'python crear_usuarios.py' y carga canchas primero.")
+        return 0
+
+    canchas_ids = [cancha_id for cancha_id, _ in canchas]
+    montos = np.array([monto for _, monto in canchas])
+    horas_por_dia = HORA_CIERRE - HORA_APERTURA
+    turnos_por_dia = len(canchas) * horas_por_dia
+    if por_dia > turnos_por_dia:
+        print(f"Advertencia: sólo hay {turnos_por_dia} turnos por día; se generarán {turnos_por_dia} reservas por día.")
+        por_dia = turnos_por_dia
+
+    rng = np.random.default_rng(semilla)
+    log_pesos = np.log(pesos_por_turno(len(canchas)))
+    horas = [dt_time(HORA_APERTURA + h) for h in range(horas_por_dia)]
+    horas_fin = [dt_time(HORA_APERTURA + h + 1) for h in range(horas_por_dia)]
+    dias_por_tramo = max(1, tamano_lote // por_dia)
+    total_dias = (hasta - desde).days + 1
+
+    print(f"Generando {por_dia} reservas por día entre {desde} y {hasta} ({total_dias} días, "
+          f"{len(usuarios_ids)} usuarios, {len(canchas)} canchas)...")
+    inicio = time.perf_counter()
+    creadas = 0
+    for primer_dia in range(0, total_dias, dias_por_tramo):
+        dias = min(dias_por_tramo, total_dias - primer_dia)
+        tramo_desde = desde + timedelta(days=primer_dia)
+        tramo_hasta = tramo_desde + timedelta(days=dias - 1)
+
+        # --- 1. TURNOS: top-k de claves de Gumbel = muestreo ponderado sin reemplazo por día ---
+        claves = log_pesos + rng.gumbel(size=(dias, turnos_por_dia))
+        for dia, turno in turnos_activos_existentes(tramo_desde, tramo_hasta, canchas_ids, horas_por_dia):
+            claves[dia, turno] = -np.inf
+        elegidos = np.argpartition(-claves, por_dia - 1, axis=1)[:, :por_dia]
+        libres = np.isfinite(np.take_along_axis(claves, elegidos, axis=1)) # Días casi llenos: descarta los ocupados
+        dia_de = np.broadcast_to(np.arange(dias)[:, None], elegidos.shape)[libres]
+        turno_de = elegidos[libres]
+
+        # --- 2. USUARIOS Y ESTADOS ---
+        cantidad = len(turno_de)
+        usuarios = usuarios_ids[rng.integers(0, len(usuarios_ids), size=cantidad)]
+        canceladas = rng.random(cantidad) < cancelacion
+        cancha_de, hora_de = np.divmod(turno_de, horas_por_dia)
+
+        # --- 3. INSERT MASIVO DEL TRAMO ---
+        fechas = [tramo_desde + timedelta(days=d) for d in range(dias)]
+        filas = [{
+            'usuario_id': int(usuario_id),
+            'cancha_id': canchas_ids[c],
+            'fecha': fechas[d],
+            'hora_inicio': horas[h],
+            'hora_fin': horas_fin[h],
+            'monto': float(montos[c]),
+            'estado': 'cancelada' if cancelada else 'activa',
+        } for usuario_id, c, d, h, cancelada in zip(usuarios.tolist(), cancha_de.tolist(), dia_de.tolist(),
+                                                    hora_de.tolist(), canceladas.tolist())]
+        try:
+            if filas:
+                db.session.execute(insert(Reserva), filas)
+            reconstruir_resumen_diario(tramo_desde, tramo_hasta)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error al guardar el tramo {tramo_desde} a {tramo_hasta}: {e}")
+            break
+
+        creadas += len(filas)
+        transcurrido = time.perf_counter() - inicio
+        print(f"  {tramo_hasta}: {creadas} reservas ({creadas / transcurrido:.0f} reservas/s)")
+
+    duracion = time.perf_counter() - inicio
+    print(f"¡Simulación completada! {creadas} reservas en {duracion:.1f} s "
+          f"({creadas / duracion if duracion else 0:.0f} reservas/s).")
+    return creadas
+
 def generar_reservas_simuladas(app_context):
     with app_context:
         # --- CARGAMOS LOS DATOS EXISTENTES DE LA DB ---
@@ -303,16 +469,18 @@ def generar_reservas_simuladas(app_context):
                 usuarios_disponibles = random.sample(usuarios_db, 14)
                 
                 while True:
-                    estadisticas = generar_simulacion(usuarios_disponibles, canchas_db, fecha_simulacion, 14) 
+                    fecha_dia = datetime.strptime(fecha_simulacion, '%Y-%m-%d').date()
+                    ocupados = turnos_activos_por_fecha(fecha_dia, fecha_dia)
+                    estadisticas = generar_simulacion(usuarios_disponibles, canchas_db, fecha_simulacion, 14,
+                                                      ocupados[fecha_simulacion])
                     mostrar_resumen(estadisticas)
                     
                     opcion = input("\nOpciones: [s] Confirmar y guardar, [n] Generar nueva, [c] Cambiar fecha, [q] Salir\nSeleccione: ").strip().lower()
                     
                     if opcion == 's':
                         print(f"Guardando {len(estadisticas['reservas_para_db'])} reservas en la base de datos...")
-                        db.session.add_all(estadisticas['reservas_para_db'])
-                        db.session.commit()
-                        print("\nSimulación guardada exitosamente!")
+                        if guardar_reservas(estadisticas['reservas_para_db']):
+                            print("\nSimulación guardada exitosamente!")
                         break
                     elif opcion == 'n':
                         print("\nGenerando nueva simulación para la misma fecha...")
@@ -339,6 +507,26 @@ def generar_reservas_simuladas(app_context):
             else:
                 print("Opción no válida. Por favor seleccione d, m o a.")
 
+def main():
+    parser = argparse.ArgumentParser(description="Simulación de reservas. Sin argumentos abre el menú interactivo.")
+    parser.add_argument('--desde', help="Primer día a simular (YYYY-MM-DD). Activa el modo no interactivo.")
+    parser.add_argument('--hasta', help="Último día a simular (YYYY-MM-DD). Por defecto, hoy.")
+    parser.add_argument('--por-dia', type=int, default=14, help="Reservas por día.")
+    parser.add_argument('--cancelacion', type=float, default=0.3, help="Fracción de reservas canceladas.")
+    parser.add_argument('--semilla', type=int, default=None, help="Semilla para repetir la misma simulación.")
+    parser.add_argument('--lote', type=int, default=50000, help="Reservas por INSERT masivo (y por commit).")
+    args = parser.parse_args()
+
+    if not args.desde:
+        generar_reservas_simuladas(app.app_context())
+        return
+
+    desde = datetime.strptime(args.desde, '%Y-%m-%d').date()
+    hasta = datetime.strptime(args.hasta, '%Y-%m-%d').date() if args.hasta else datetime.now().date()
+    if hasta < desde:
+        parser.error("--hasta no puede ser anterior a --desde.")
+    with app.app_context():
+        generar_reservas_masivas(desde, hasta, args.por_dia, args.cancelacion, args.semilla, args.lote)
+
 if __name__ == '__main__':
-    app_context = app.app_context()
-    generar_reservas_simuladas(app_context)
\ No newline at end of file
+    main()
\ No newline at end of file
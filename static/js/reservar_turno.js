@@ -14,6 +14,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const formCancha = document.getElementById('form-cancha');
     const formHoraInicio = document.getElementById('form-hora_inicio');
     const formHoraFin = document.getElementById('form-hora_fin');
+    const formClave = document.getElementById('form-clave_idempotencia');
     const selectedCanchaName = document.getElementById('selectedCanchaName');
     const selectedTimeRange = document.getElementById('selectedTimeRange');
     const formCanchaInfo = document.getElementById('form-cancha-info');
@@ -23,6 +24,21 @@ document.addEventListener('DOMContentLoaded', () => {
     let currentYear = today.getFullYear();
     let selectedDate = null;
     let turnosDisponiblesData = {}; // Para almacenar los datos de la API
+    let disponibilidadMes = null; // Datos precargados del mes visible (una sola request)
+    let celdasPorFecha = {}; // fecha -> celda del calendario, para sombrear días completos
+    let eventosEnVivo = null; // Conexión SSE con los avisos de la fecha seleccionada
+    let esperaEnVivo = null; // Temporizador que abre la conexión SSE
+
+    // Tiempo (ms) durante el cual se reutilizan los datos precargados del mes
+    const VIGENCIA_PRECARGA_MS = 60 * 1000;
+
+    // Tiempo (ms) que el usuario tiene que quedarse en un día para abrir los
+    // avisos en vivo: cada conexión ocupa un hilo del servidor
+    const ESPERA_EN_VIVO_MS = 3000;
+
+    // Clases de los botones de turno según su estado
+    const CLASES_LIBRE = ['bg-green-100', 'text-green-800', 'hover:bg-green-200', 'cursor-pointer'];
+    const CLASES_OCUPADO = ['disabled', 'bg-gray-300', 'text-gray-500', 'cursor-not-allowed'];
 
     const months = ['Enero', 'Febrero', 'Marzo', 'Abril', 'Mayo', 'Junio', 'Julio', 'Agosto', 'Septiembre', 'Octubre', 'Noviembre', 'Diciembre'];
 
@@ -34,6 +50,15 @@ document.addEventListener('DOMContentLoaded', () => {
         return `${year}-${month}-${day}`;
     }
 
+    // Clave de idempotencia nueva para cada turno elegido: los reenvíos de la
+    // misma elección se reconocen como repetidos, pero elegir otro turno (por
+    // ejemplo, al volver atrás a la página después de reservar) es otra reserva
+    function nuevaClaveIdempotencia() {
+        if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+        const bytes = crypto.getRandomValues(new Uint8Array(16)); // randomUUID sólo existe con HTTPS
+        return Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+    }
+
     function hideMessageBox() {
         messageBox.classList.add('hidden');
         messageBox.textContent = '';
@@ -52,6 +77,7 @@ document.addEventListener('DOMContentLoaded', () => {
     // --- 3. Renderizado del calendario ---
     function renderCalendar() {
         calendarGrid.innerHTML = '';
+        celdasPorFecha = {};
         currentMonthYearEl.textContent = `${months[currentMonth]} ${currentYear}`;
         
         const firstDay = new Date(currentYear, currentMonth, 1);
@@ -88,9 +114,23 @@ document.addEventListener('DOMContentLoaded', () => {
                 if (dateStr === selectedDate) {
                     dayCell.classList.add('selected');
                 }
+                celdasPorFecha[dateStr] = dayCell;
             }
             calendarGrid.appendChild(dayCell);
         }
+
+        prefetchMonth(firstDay, lastDay);
+    }
+
+    // Sombrea los días sin turnos libres usando los datos precargados
+    function shadeCalendar() {
+        if (!disponibilidadMes) return;
+        Object.entries(disponibilidadMes.dias).forEach(([dateStr, dia]) => {
+            const cell = celdasPorFecha[dateStr];
+            if (!cell) return;
+            cell.title = `${dia.turnos_libres} turnos libres`;
+            cell.classList.toggle('full', dia.turnos_libres === 0);
+        });
     }
 
     // --- 4. Manejo de eventos de la interfaz ---
@@ -108,7 +148,21 @@ document.addEventListener('DOMContentLoaded', () => {
         
         reservationForm.classList.add('hidden'); // Ocultar el formulario
         hideMessageBox();
-        fetchAvailableSlots(dateStr);
+
+        // Si el mes ya fue precargado hace poco, no hace falta otra request
+        const precargado = disponibilidadMes
+            && Date.now() - disponibilidadMes.cargadoEn < VIGENCIA_PRECARGA_MS
+            && disponibilidadMes.dias[dateStr];
+        if (precargado) {
+            turnosDisponiblesData = {
+                canchas: disponibilidadMes.canchas,
+                horarios_disponibles: precargado.horarios_disponibles
+            };
+            renderAvailableSlots(turnosDisponiblesData);
+        } else {
+            fetchAvailableSlots(dateStr);
+        }
+        escucharFecha(dateStr);
     }
     
     function handleSlotClick(canchaId, horaInicio, horaFin, cancha) {
@@ -126,6 +180,7 @@ document.addEventListener('DOMContentLoaded', () => {
         formCancha.value = canchaId;
         formHoraInicio.value = horaInicio;
         formHoraFin.value = horaFin;
+        formClave.value = nuevaClaveIdempotencia();
         
         // Rellenar los detalles de confirmación
         selectedCanchaName.textContent = cancha.nombre;
@@ -140,13 +195,30 @@ document.addEventListener('DOMContentLoaded', () => {
         reservationForm.classList.remove('hidden'); // Mostrar el formulario
     }
 
+    // Si el turno elegido se ocupó mientras el usuario completaba el formulario
+    function revisarSeleccion() {
+        if (reservationForm.classList.contains('hidden') || formFecha.value !== selectedDate) return;
+        const btn = document.querySelector(`button[data-cancha-id='${formCancha.value}'][data-hora-inicio='${formHoraInicio.value}']`);
+        if (btn && !btn.disabled) {
+            btn.classList.add('selected');
+            return;
+        }
+        reservationForm.classList.add('hidden');
+        showMessageBox('El turno que elegiste acaba de ser reservado. Elige otro horario.');
+    }
+
     // --- 5. Interacción con la API de Flask ---
-    async function fetchAvailableSlots(date) {
-        availableSlots.innerHTML = '<p class="text-center text-gray-500">Cargando turnos...</p>';
+    // 'silencioso': actualiza la grilla sin mostrar el aviso de carga (reconexión o recarga en vivo)
+    async function fetchAvailableSlots(date, silencioso = false) {
+        if (!silencioso) {
+            availableSlots.innerHTML = '<p class="text-center text-gray-500">Cargando turnos...</p>';
+        }
         try {
             const response = await fetch(`/api/turnos_disponibles/${date}`);
             const data = await response.json();
             
+            // Ignorar la respuesta si el usuario ya eligió otra fecha
+            if (date !== selectedDate) return;
             if (response.ok) {
                 turnosDisponiblesData = data;
                 renderAvailableSlots(data);
@@ -159,6 +231,32 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // Precarga la disponibilidad de todo el mes visible con una sola request
+    async function prefetchMonth(firstDay, lastDay) {
+        const todayStart = new Date(today.getFullYear(), today.getMonth(), today.getDate());
+        if (lastDay < todayStart) {
+            disponibilidadMes = null;
+            return;
+        }
+        const desde = getFormattedDate(firstDay < todayStart ? todayStart : firstDay);
+        const hasta = getFormattedDate(lastDay);
+        const mesSolicitado = `${currentYear}-${currentMonth}`;
+
+        try {
+            const response = await fetch(`/api/turnos_disponibles?desde=${desde}&hasta=${hasta}`);
+            const data = await response.json();
+
+            // Ignorar la respuesta si el usuario ya cambió de mes
+            if (!response.ok || mesSolicitado !== `${currentYear}-${currentMonth}`) return;
+
+            disponibilidadMes = { ...data, cargadoEn: Date.now() };
+            shadeCalendar();
+        } catch (error) {
+            // Sin precarga se sigue consultando día por día
+            console.error('Error prefetching month:', error);
+        }
+    }
+
     function renderAvailableSlots(data) {
     availableSlots.innerHTML = '';
     const { canchas, horarios_disponibles } = data;
@@ -204,9 +302,7 @@ document.addEventListener('DOMContentLoaded', () => {
                         slot => slot.hora_inicio === horaInicio
                     );
                     
-                    const buttonClass = disponible 
-                        ? 'slot-button bg-green-100 text-green-800 hover:bg-green-200 cursor-pointer' 
-                        : 'slot-button disabled bg-gray-300 text-gray-500 cursor-not-allowed';
+                    const buttonClass = ['slot-button', ...(disponible ? CLASES_LIBRE : CLASES_OCUPADO)].join(' ');
                     
                     return `
                         <td class="p-1 border border-gray-300 text-center">
@@ -229,20 +325,80 @@ document.addEventListener('DOMContentLoaded', () => {
 
     tableHTML += `</tbody></table>`;
     availableSlots.innerHTML = tableHTML;
+    revisarSeleccion();
+}
 
-    // Asignar eventos a los botones
-    document.querySelectorAll('.slot-button:not(.disabled)').forEach(button => {
-        button.addEventListener('click', (e) => {
-            const canchaId = e.target.getAttribute('data-cancha-id');
-            const horaInicio = e.target.getAttribute('data-hora-inicio');
-            const horaFin = e.target.getAttribute('data-hora-fin');
-            const cancha = canchas.find(c => c.id == canchaId);
-            handleSlotClick(canchaId, horaInicio, horaFin, cancha);
-        });
+    // Un solo listener para toda la grilla: sirve también para los botones que
+    // se habilitan en vivo, sin volver a asignar eventos
+    availableSlots.addEventListener('click', (e) => {
+        const button = e.target.closest('.slot-button');
+        if (!button || button.disabled) return;
+        const canchaId = button.getAttribute('data-cancha-id');
+        const horaInicio = button.getAttribute('data-hora-inicio');
+        const horaFin = button.getAttribute('data-hora-fin');
+        const cancha = turnosDisponiblesData.canchas.find(c => c.id == canchaId);
+        handleSlotClick(canchaId, horaInicio, horaFin, cancha);
     });
-}
 
-    // --- 6. Inicialización y Event Listeners ---
+    // --- 6. Avisos en vivo (Server-Sent Events) ---
+    // Marca un turno como libre u ocupado en una lista de horarios disponibles.
+    // Es idempotente: aplicar dos veces el mismo aviso no cambia nada.
+    function actualizarHorarios(horarios, canchaId, horaInicio, horaFin, disponible) {
+        const libres = (horarios[canchaId] || []).filter(slot => slot.hora_inicio !== horaInicio);
+        if (disponible) {
+            libres.push({ hora_inicio: horaInicio, hora_fin: horaFin });
+            libres.sort((a, b) => a.hora_inicio.localeCompare(b.hora_inicio));
+        }
+        horarios[canchaId] = libres;
+    }
+
+    function aplicarAvisoTurno(aviso, disponible) {
+        const button = document.querySelector(`button[data-cancha-id='${aviso.cancha_id}'][data-hora-inicio='${aviso.hora_inicio}']`);
+        if (aviso.fecha !== selectedDate || !button) return;
+        const horaFin = button.getAttribute('data-hora-fin');
+
+        // Datos en memoria: la grilla del día y la precarga del mes
+        actualizarHorarios(turnosDisponiblesData.horarios_disponibles, aviso.cancha_id, aviso.hora_inicio, horaFin, disponible);
+        const dia = disponibilidadMes && disponibilidadMes.dias[aviso.fecha];
+        if (dia) {
+            actualizarHorarios(dia.horarios_disponibles, aviso.cancha_id, aviso.hora_inicio, horaFin, disponible);
+            dia.turnos_libres = Object.values(dia.horarios_disponibles).reduce((total, libres) => total + libres.length, 0);
+            shadeCalendar();
+        }
+
+        // El botón se actualiza en su lugar, sin volver a dibujar la grilla
+        button.classList.remove(...CLASES_LIBRE, ...CLASES_OCUPADO, 'selected');
+        button.classList.add(...(disponible ? CLASES_LIBRE : CLASES_OCUPADO));
+        button.disabled = !disponible;
+        button.textContent = disponible ? 'Disponible' : 'Ocupado';
+        revisarSeleccion();
+    }
+
+    function escucharFecha(dateStr) {
+        if (eventosEnVivo) eventosEnVivo.close();
+        eventosEnVivo = null;
+        clearTimeout(esperaEnVivo);
+        if (!window.EventSource) return; // Sin soporte: se sigue validando al reservar
+
+        // Sólo si el usuario se queda mirando el día: recorrer el calendario no abre conexiones
+        esperaEnVivo = setTimeout(() => conectarEnVivo(dateStr), ESPERA_EN_VIVO_MS);
+    }
+
+    function conectarEnVivo(dateStr) {
+        eventosEnVivo = new EventSource(`/api/turnos_stream?fecha=${dateStr}`);
+        // Al conectar (y al reconectar) se pide el estado actual: cubre lo que
+        // cambió entre la carga de la grilla y la suscripción, que no llega como
+        // aviso. Si nada cambió, el servidor responde 304.
+        eventosEnVivo.addEventListener('open', () => fetchAvailableSlots(dateStr, true));
+        eventosEnVivo.addEventListener('ocupado', e => aplicarAvisoTurno(JSON.parse(e.data), false));
+        eventosEnVivo.addEventListener('liberado', e => aplicarAvisoTurno(JSON.parse(e.data), true));
+        eventosEnVivo.addEventListener('recargar', () => {
+            if (disponibilidadMes) disponibilidadMes.cargadoEn = 0; // La precarga del mes ya no es confiable
+            fetchAvailableSlots(dateStr, true);
+        });
+    }
+
+    // --- 7. Inicialización y Event Listeners ---
     prevMonthBtn.addEventListener('click', () => {
         currentMonth--;
         if (currentMonth < 0) {
@@ -261,6 +417,12 @@ document.addEventListener('DOMContentLoaded', () => {
         renderCalendar();
     });
 
+    // Al volver atrás el navegador puede restaurar la página desde su caché,
+    // con el formulario y la clave del envío anterior: se renueva la clave
+    window.addEventListener('pageshow', (event) => {
+        if (event.persisted) formClave.value = nuevaClaveIdempotencia();
+    });
+
     renderCalendar();
 });
 
@@ -0,0 +1,99 @@
+document.addEventListener('DOMContentLoaded', () => {
+    // --- 1. Inicialización: listado renderizado por el servidor (primera página) ---
+    const listaTurnos = document.getElementById('listaTurnos');
+    const indicador = document.getElementById('cargandoMas');
+    if (!listaTurnos || !indicador) return; // Todo entró en la primera página
+
+    let siguiente = listaTurnos.dataset.siguiente; // Cursor de la próxima página
+    let cargando = false;
+
+    // Sólo el listado de activos tiene acción de cancelar (la URL termina en /0)
+    const urlCancelar = listaTurnos.dataset.urlCancelar;
+
+    // Cuántos píxeles antes del final se pide la página siguiente
+    const MARGEN_PRECARGA_PX = 400;
+
+    // --- 2. Armado del HTML (mismas filas y secciones que la plantilla) ---
+    function escapar(texto) {
+        const div = document.createElement('div');
+        div.textContent = texto;
+        return div.innerHTML;
+    }
+
+    function filaHTML(turno) {
+        const ultimaCelda = urlCancelar
+            ? `<a href="${urlCancelar.replace(/0$/, turno.id)}" class="action-link"
+                  onclick="return confirm('¿Cancelar este turno?')">
+                   <i class="fas fa-times-circle mr-1"></i> Cancelar
+               </a>`
+            : '';
+        return `
+            <tr>
+                <td>${turno.hora_inicio} - ${turno.hora_fin}</td>
+                <td>${escapar(turno.cancha_nombre)}</td>
+                <td>${escapar(turno.usuario)}</td>
+                <td>$${Number(turno.monto_total).toFixed(2)}</td>
+                <td>${ultimaCelda}</td>
+            </tr>`;
+    }
+
+    function crearSeccionDia(fecha) {
+        // Se clona el encabezado de tabla de una sección existente para no duplicar columnas
+        const encabezado = listaTurnos.querySelector('.tabla-turnos thead').outerHTML;
+        const seccion = document.createElement('div');
+        seccion.className = 'reservas-section mb-8';
+        seccion.dataset.fecha = fecha;
+        seccion.innerHTML = `
+            <div class="reservas-header">
+                <h2 class="text-xl font-semibold">${fecha}</h2>
+            </div>
+            <div class="overflow-x-auto">
+                <table class="tabla-turnos">${encabezado}<tbody></tbody></table>
+            </div>`;
+        listaTurnos.appendChild(seccion);
+        return seccion;
+    }
+
+    // --- 3. Carga de la página siguiente ---
+    async function cargarMas() {
+        if (cargando || !siguiente) return;
+        cargando = true;
+
+        // Se reenvían los filtros de la vista junto con el cursor
+        const parametros = new URLSearchParams(window.location.search);
+        parametros.set('cursor', siguiente);
+
+        try {
+            const response = await fetch(`${listaTurnos.dataset.api}?${parametros}`);
+            if (!response.ok) throw new Error(`Error ${response.status}`);
+            const datos = await response.json();
+
+            datos.dias.forEach(dia => {
+                // Si un día quedó partido entre páginas, se completa su sección
+                const ultima = listaTurnos.lastElementChild;
+                const seccion = ultima && ultima.dataset.fecha === dia.fecha ? ultima : crearSeccionDia(dia.fecha);
+                seccion.querySelector('tbody').insertAdjacentHTML('beforeend', dia.turnos.map(filaHTML).join(''));
+            });
+            siguiente = datos.siguiente;
+        } catch (error) {
+            console.error('Error al cargar más turnos:', error);
+            indicador.textContent = 'No se pudieron cargar más turnos. Recarga la página para reintentar.';
+            observador.disconnect();
+            return;
+        } finally {
+            cargando = false;
+        }
+
+        if (!siguiente) {
+            observador.disconnect();
+            indicador.remove();
+        } else if (indicador.getBoundingClientRect().top < window.innerHeight + MARGEN_PRECARGA_PX) {
+            cargarMas(); // La página era corta y el indicador sigue a la vista
+        }
+    }
+
+    const observador = new IntersectionObserver(entradas => {
+        if (entradas.some(entrada => entrada.isIntersecting)) cargarMas();
+    }, { rootMargin: `${MARGEN_PRECARGA_PX}px` });
+    observador.observe(indicador);
+});